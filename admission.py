@@ -0,0 +1,130 @@
+"""
+Control de admisión de las peticiones de ruta del servicio
+
+Cuando muchos usuarios pulsan "Calcular rutas" a la vez, varias peticiones
+suelen ser idénticas (mismos puntos proyectados, franja y perfil).
+AdmissionController:
+
+    - Agrupa las peticiones idénticas en curso sobre un solo cálculo
+    - Limita los cálculos simultáneos al número de workers
+    - Rechaza al momento (ServiceBusyError -> 503) cuando la cola de espera
+      está llena, en vez de acumular peticiones que ya llegarían tarde; un
+      lote se admite entero y sus rutas no se rechazan entre ellas
+    - Mide la profundidad de la cola y los tiempos de espera y de cálculo
+"""
+import asyncio
+import time
+
+from instrumentation import StageHistogram
+
+
+class ServiceBusyError(RuntimeError):
+    """Raised when `max_queue` computations are already waiting for a worker"""
+
+
+class AdmissionController:
+    """
+    Runs blocking route computations on an executor with coalescing and load shedding
+
+    Attributes:
+        workers: Maximum number of computations running at the same time
+        max_queue: Maximum number of computations waiting once every worker is busy
+        waiting, running: Computations admitted but not started yet, and in progress
+        histogram: StageHistogram with 'queue_wait' and 'run' times
+    """
+
+    def __init__(self, executor, workers=4, max_queue=32):
+        self.executor = executor
+        self.workers = workers
+        self.max_queue = max_queue
+        self.semaphore = asyncio.Semaphore(workers)
+        self.waiting = 0
+        self.running = 0
+        self.max_waiting = 0
+        self.counters = {'admitted': 0, 'coalesced': 0, 'rejected': 0, 'completed': 0, 'failed': 0}
+        self.histogram = StageHistogram()
+        self._in_flight = {}
+
+    def check(self):
+        """
+        Raise ServiceBusyError if a new computation would not be admitted
+
+        Raises:
+            ServiceBusyError: If the queue is full
+        """
+        # Las peticiones aún sin empezar que caben en workers libres no cuentan como cola
+        if self.waiting - max(0, self.workers - self.running) >= self.max_queue:
+            self.counters['rejected'] += 1
+            raise ServiceBusyError(f"Hay {self.waiting} cálculos en espera, inténtalo más tarde")
+
+    async def run(self, fn, *args, key=None, shed=True):
+        """
+        Result of fn(*args) computed on the executor
+
+        Args:
+            key: Optional hashable identifying the computation; requests
+                 with the same key arriving while it runs share its result,
+                 so the result must not be modified by the caller
+            shed: Apply the queue limit; False for the items of a batch
+                  already admitted as a whole with check()
+
+        Raises:
+            ServiceBusyError: If the queue is full
+        """
+        task = self._in_flight.get(key) if key is not None else None
+        if task is not None:
+            self.counters['coalesced'] += 1
+            return await asyncio.shield(task)
+
+        if shed:
+            self.check()
+
+        self.counters['admitted'] += 1
+        # Se cuenta en la cola antes de crear la tarea, para que las peticiones que llegan a la vez lo vean
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        # El cálculo es una tarea propia: si el cliente que lo inició se desconecta, los demás siguen esperando
+        task = asyncio.ensure_future(self._execute(fn, time.perf_counter(), *args))
+        task.add_done_callback(self._finished)
+        if key is not None:
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _execute(self, fn, queued_at, *args):
+        started = False
+        try:
+            async with self.semaphore:
+                self.waiting -= 1
+                started = True
+                self.histogram.record('queue_wait', time.perf_counter() - queued_at)
+                self.running += 1
+                start = time.perf_counter()
+                try:
+                    loop = asyncio.get_running_loop()
+                    return await loop.run_in_executor(self.executor, fn, *args)
+                finally:
+                    self.running -= 1
+                    self.histogram.record('run', time.perf_counter() - start)
+        finally:
+            if not started:
+                self.waiting -= 1
+
+    def _finished(self, task):
+        if task.cancelled():
+            return
+        # Consultar la excepción la marca como recibida aunque nadie espere ya la tarea
+        self.counters['failed' if task.exception() is not None else 'completed'] += 1
+
+    def stats(self):
+        """Queue depth, counters and the wait/run time histograms"""
+        return {
+            'workers': self.workers,
+            'running': self.running,
+            'queue_depth': self.waiting,
+            'max_queue_depth': self.max_waiting,
+            'max_queue': self.max_queue,
+            'in_flight': len(self._in_flight),
+            **self.counters,
+            'times': self.histogram.summary(),
+        }
@@ -0,0 +1,180 @@
+"""
+Rutas alternativas seguras por el método de las mesetas (plateaus)
+
+Se calculan solo dos árboles de caminos mínimos: uno hacia delante desde el
+origen y otro hacia atrás desde el destino, ambos limitados a max_stretch
+veces el coste óptimo. Una meseta es una cadena de aristas que pertenece a
+los dos árboles; cada meseta define una ruta origen -> meseta -> destino que
+es localmente óptima. Las mesetas se ordenan por coste y se descartan las que
+se solapan demasiado con las rutas ya elegidas, así que k alternativas cuestan
+poco más que una sola búsqueda.
+"""
+import heapq
+import math
+
+import numpy as np
+
+from instrumentation import stage, count
+
+
+def _search_tree(indptr, adj, ends, weights, source, target, max_stretch):
+    """
+    Dijkstra from `source` that stops once costs exceed max_stretch times the
+    cost of `target`
+
+    Returns:
+        Tuple (dist, pred) of dicts: node -> cost, node -> tree edge
+    """
+    dist = {source: 0.0}
+    pred = {}
+    settled = set()
+    limit = math.inf
+    heap = [(0.0, source)]
+
+    while heap:
+        d, node = heapq.heappop(heap)
+        if node in settled:
+            continue
+        if d > limit:
+            break
+        settled.add(node)
+        if node == target:
+            limit = d * max_stretch
+
+        for e in adj[indptr[node]:indptr[node + 1]]:
+            nxt = ends[e]
+            nd = d + weights[e]
+            if nd < dist.get(nxt, math.inf):
+                dist[nxt] = nd
+                pred[nxt] = e
+                heapq.heappush(heap, (nd, nxt))
+
+    count('nodes_settled', len(settled))
+    return dist, pred
+
+
+def _pred_array(pred, n_nodes):
+    array = np.full(n_nodes, -1, dtype=np.int64)
+    if pred:
+        array[np.fromiter(pred.keys(), dtype=np.int64)] = np.fromiter(pred.values(), dtype=np.int64)
+    return array
+
+
+def find_plateaus(arrays, pred_fwd, pred_bwd):
+    """
+    Chains of edges that belong to both search trees
+
+    Args:
+        arrays: GraphArrays
+        pred_fwd: Forward tree as an array node -> edge reaching it (-1 if none)
+        pred_bwd: Backward tree as an array node -> edge leaving it towards
+                  the target (-1 if none)
+
+    Returns:
+        List of plateaus, each a list of consecutive edge indices
+    """
+    edges = np.arange(arrays.n_edges)
+    in_both = (pred_fwd[arrays.v] == edges) & (pred_bwd[arrays.u] == edges)
+    plateau_edges = np.flatnonzero(in_both)
+
+    # Una meseta empieza donde la arista del árbol hacia delante que llega a u no es de meseta
+    incoming = pred_fwd[arrays.u[plateau_edges]]
+    starts = plateau_edges[(incoming < 0) | ~in_both[np.maximum(incoming, 0)]]
+
+    plateaus = []
+    for e in starts.tolist():
+        chain = [e]
+        nxt = int(pred_bwd[arrays.v[e]])
+        while nxt >= 0 and in_both[nxt]:
+            chain.append(nxt)
+            nxt = int(pred_bwd[arrays.v[nxt]])
+        plateaus.append(chain)
+    return plateaus
+
+
+def _tree_path(arrays, pred, node, forward):
+    """Edges from the tree root to `node` (forward) or from `node` to the root"""
+    edges = []
+    ends = arrays.u if forward else arrays.v
+    while pred[node] >= 0:
+        e = int(pred[node])
+        edges.append(e)
+        node = int(ends[e])
+    if forward:
+        edges.reverse()
+    return edges
+
+
+def plateau_alternatives(model, origin, destination, k=3, hour=None, crime_profile=None, strategy='log',
+                         max_stretch=1.4, max_overlap=0.6, min_plateau=0.1):
+    """
+    Up to k diverse safe routes between two (lat, lon) points
+
+    Args:
+        model: risk_model.RiskModel
+        k: Maximum number of routes (the first one is the optimal safe route)
+        hour, crime_profile, strategy: As in RiskModel.edge_costs
+        max_stretch: Maximum cost of an alternative relative to the optimum
+        max_overlap: Maximum fraction of an alternative's length shared with
+                     any route already chosen
+        min_plateau: Minimum plateau cost as a fraction of the route cost;
+                     short plateaus give routes with pointless detours
+
+    Returns:
+        List of risk_model.Route ordered by cost, with `cost` set
+    """
+    arrays = model.arrays
+    with stage('nearest_nodes'):
+        source = arrays.nearest_node(origin[0], origin[1])
+        target = arrays.nearest_node(destination[0], destination[1])
+
+    with stage('edge_costs'):
+        costs = model.edge_costs(hour, crime_profile, strategy)
+        risk = model.edge_risk(hour, crime_profile)
+        cost_list = costs.tolist()
+
+    with stage('search_trees'):
+        fwd_dist, fwd_pred = _search_tree(*arrays.adjacency_lists(), cost_list, source, target, max_stretch)
+        bwd_dist, bwd_pred = _search_tree(*arrays.reverse_adjacency_lists(), cost_list, target, source,
+                                          max_stretch)
+    if target not in fwd_dist:
+        raise ValueError(f"No hay camino entre los nodos {arrays.nodes[source]} y {arrays.nodes[target]}")
+    best = fwd_dist[target]
+
+    with stage('plateaus'):
+        pred_fwd = _pred_array(fwd_pred, arrays.n_nodes)
+        pred_bwd = _pred_array(bwd_pred, arrays.n_nodes)
+        plateaus = find_plateaus(arrays, pred_fwd, pred_bwd)
+        count('plateaus', len(plateaus))
+
+        candidates = []
+        for chain in plateaus:
+            first, last = int(arrays.u[chain[0]]), int(arrays.v[chain[-1]])
+            if first not in fwd_dist or last not in bwd_dist:
+                continue
+            plateau_cost = float(costs[chain].sum())
+            total = fwd_dist[first] + plateau_cost + bwd_dist[last]
+            if total <= best * max_stretch + 1e-9 and (total == 0 or plateau_cost >= min_plateau * total):
+                candidates.append((total, -plateau_cost, chain))
+        candidates.sort(key=lambda c: c[:2])
+
+    routes = []
+    chosen_edges = []
+    for total, _, chain in candidates:
+        first, last = int(arrays.u[chain[0]]), int(arrays.v[chain[-1]])
+        edges = _tree_path(arrays, pred_fwd, first, True) + chain + _tree_path(arrays, pred_bwd, last, False)
+        edge_array = np.asarray(edges, dtype=np.int64)
+        length = float(arrays.length[edge_array].sum())
+
+        # Diversidad: longitud compartida con cada ruta ya elegida
+        if any(arrays.length[np.intersect1d(edge_array, other)].sum() > max_overlap * length
+               for other in chosen_edges):
+            continue
+
+        chosen_edges.append(edge_array)
+        routes.append(model.build_route(source, edges, risk, cost=total))
+        if len(routes) == k:
+            break
+
+    count('alternatives', len(routes))
+    return routes
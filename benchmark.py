@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+"""
+Benchmark reproducible de las rutas seguras
+
+Genera pares origen-destino con semilla fija en varias bandas de distancia
+(1, 3, 7 y 15 km desde el Zócalo, como random_point_k_km_away de los
+notebooks) y franjas horarias, ejecuta cada motor registrado en ENGINES y
+escribe un JSON comparable entre commits con latencias p50/p95/p99, pico de
+memoria y calidad de ruta (sobrecoste de longitud y reducción de riesgo de la
+ruta segura respecto a la rápida).
+
+Sin datos reales se usa un grafo sintético en cuadrícula generado a partir de
+la semilla, por lo que se puede ejecutar sin conexión:
+
+    python benchmark.py --synthetic --out bench.json
+    python benchmark.py --graph cache_MexicoCity_walk.graphml --crimes crime_buffers.geojson
+    python benchmark.py --import-time --out imports.json
+"""
+import argparse
+import json
+import math
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import geopandas as gpd
+import networkx as nx
+import shapely
+from shapely import LineString
+
+from geodesy import EARTH_RADIUS_M, haversine_m
+from principal_functions import buscar_ruta, fast_edge_weight_calculation
+from risk_model import RiskModel
+
+
+# Coordenadas aproximadas del Zócalo
+ZOCALO = (19.432608, -99.133209)
+DISTANCE_BANDS_KM = (1, 3, 7, 15)
+TIME_ZONES = ("madrugada", "mañana", "mediodia", "tarde", "noche", "medianoche")
+
+# Delitos de ejemplo para los buffers sintéticos
+SYNTHETIC_DELITOS = (
+    "ROBO A TRANSEUNTE EN VIA PUBLICA CON VIOLENCIA",
+    "ROBO A TRANSEUNTE EN VIA PUBLICA SIN VIOLENCIA",
+    "ROBO DE ACCESORIOS DE AUTO",
+    "ROBO DE OBJETOS",
+    "ACOSO SEXUAL",
+)
+
+_RISK_MODELS = {}
+
+
+def _risk_model(graph, crime_buffers):
+    """RiskModel built once per (graph, buffers); the warmup run pays the cost"""
+    key = (id(graph), id(crime_buffers))
+    if key not in _RISK_MODELS:
+        _RISK_MODELS[key] = RiskModel.from_graph(graph, crime_buffers)
+    return _RISK_MODELS[key]
+
+
+def risk_model_static(origin, destination, time, graph, crime_buffers):
+    return buscar_ruta(origin, destination, time, graph, crime_buffers,
+                       risk_model=_risk_model(graph, crime_buffers))
+
+
+def risk_model_time_dependent(origin, destination, time, graph, crime_buffers):
+    return buscar_ruta(origin, destination, time, graph, crime_buffers,
+                       risk_model=_risk_model(graph, crime_buffers), time_dependent=True)
+
+
+# Motores a comparar: nombre -> función con la firma de buscar_ruta que
+# devuelve (ruta_segura, ruta_rapida) como listas de (lat, lon)
+ENGINES = {
+    'buscar_ruta': buscar_ruta,
+    'risk_model_static': risk_model_static,
+    'risk_model_time_dependent': risk_model_time_dependent,
+}
+
+
+def random_point_k_km_away(center, distance_km, rng):
+    """
+    Point at `distance_km` from `center` in a random direction
+
+    Same idea as the notebook helper but driven by `rng` so it is repeatable
+    and without geopy (spherical destination formula).
+    """
+    bearing = math.radians(rng.uniform(0, 360))
+    lat1, lon1 = math.radians(center[0]), math.radians(center[1])
+    d = distance_km * 1000 / EARTH_RADIUS_M
+
+    lat2 = math.asin(math.sin(lat1) * math.cos(d) + math.cos(lat1) * math.sin(d) * math.cos(bearing))
+    lon2 = lon1 + math.atan2(math.sin(bearing) * math.sin(d) * math.cos(lat1),
+                             math.cos(d) - math.sin(lat1) * math.sin(lat2))
+    return (math.degrees(lat2), math.degrees(lon2))
+
+
+def synthetic_grid_graph(radius_km=16, spacing_m=250, center=ZOCALO, seed=0, drop_fraction=0.05):
+    """
+    Walking-network stand-in: a jittered square grid around `center`
+
+    Args:
+        radius_km: Half the side of the grid
+        spacing_m: Distance between neighbouring intersections
+        center: (lat, lon) of the grid center
+        seed: Random seed for the jitter and the dropped streets
+        drop_fraction: Fraction of streets removed so routes are not trivial
+
+    Returns:
+        nx.MultiDiGraph in EPSG:4326 with 'x', 'y' on nodes and 'length' on edges,
+        like the graphs produced by osmnx
+    """
+    rng = np.random.default_rng(seed)
+    n = int(2 * radius_km * 1000 / spacing_m) + 1
+    dlat = spacing_m / 111320.0
+    dlon = dlat / math.cos(math.radians(center[0]))
+
+    ii, jj = np.meshgrid(np.arange(n), np.arange(n), indexing='ij')
+    lat = center[0] + (ii - n // 2) * dlat + rng.normal(0, dlat * 0.1, ii.shape)
+    lon = center[1] + (jj - n // 2) * dlon + rng.normal(0, dlon * 0.1, jj.shape)
+
+    G = nx.MultiDiGraph(crs='epsg:4326')
+    ids = np.arange(n * n).reshape(n, n)
+    G.add_nodes_from((int(ids[i, j]), {'x': float(lon[i, j]), 'y': float(lat[i, j])})
+                     for i in range(n) for j in range(n))
+
+    pairs = [(ids[:, :-1].ravel(), ids[:, 1:].ravel()), (ids[:-1, :].ravel(), ids[1:, :].ravel())]
+    us = np.concatenate([p[0] for p in pairs])
+    vs = np.concatenate([p[1] for p in pairs])
+    keep = rng.random(len(us)) >= drop_fraction
+    us, vs = us[keep], vs[keep]
+
+    flat_lat, flat_lon = lat.ravel(), lon.ravel()
+    lengths = haversine_m(flat_lat[us], flat_lon[us], flat_lat[vs], flat_lon[vs])
+    for u, v, length in zip(us.tolist(), vs.tolist(), lengths.tolist()):
+        G.add_edge(u, v, length=length)
+        G.add_edge(v, u, length=length)
+    return G
+
+
+def synthetic_crime_buffers(graph, n_crimes=5000, radius_m=50, seed=0, hotspots=40):
+    """
+    Crime buffers clustered around random hotspots of `graph`
+
+    Returns:
+        GeoDataFrame (EPSG:4326) with the columns used by buscar_ruta:
+        'weight', 'time_zones', 'delito' and 'hora'
+    """
+    rng = np.random.default_rng(seed)
+    xs = np.array([d['x'] for _, d in graph.nodes(data=True)])
+    ys = np.array([d['y'] for _, d in graph.nodes(data=True)])
+
+    centers = rng.integers(0, len(xs), hotspots)
+    which = centers[rng.integers(0, hotspots, n_crimes)]
+    spread = 400 / 111320.0
+    lat = ys[which] + rng.normal(0, spread, n_crimes)
+    lon = xs[which] + rng.normal(0, spread, n_crimes)
+
+    hora = rng.uniform(0, 24, n_crimes)
+    zone_idx = np.searchsorted([5, 10, 13, 17, 21], hora, side='right')
+
+    points = gpd.GeoSeries(gpd.points_from_xy(lon, lat), crs=4326)
+    buffers = points.to_crs(epsg=32614).buffer(radius_m).to_crs(epsg=4326)
+    return gpd.GeoDataFrame({
+        'weight': rng.choice([0.2, 0.3, 0.5, 0.7, 1.0], n_crimes),
+        'time_zones': np.array(TIME_ZONES)[zone_idx],
+        'delito': rng.choice(SYNTHETIC_DELITOS, n_crimes),
+        'hora': hora,
+    }, geometry=buffers, crs=4326)
+
+
+def generate_od_pairs(center=ZOCALO, bands_km=DISTANCE_BANDS_KM, per_band=10, time_zones=TIME_ZONES,
+                      seed=0, origin_jitter_km=2.0):
+    """
+    Seeded origin-destination pairs
+
+    Origins are spread up to `origin_jitter_km` around `center` and each
+    destination is exactly `band` km away from its origin.
+
+    Returns:
+        List of dicts {'band_km', 'time', 'origin', 'destination'}
+    """
+    rng = random.Random(seed)
+    pairs = []
+    for band in bands_km:
+        for i in range(per_band):
+            origin = random_point_k_km_away(center, rng.uniform(0, origin_jitter_km), rng)
+            pairs.append({
+                'band_km': band,
+                'time': time_zones[i % len(time_zones)],
+                'origin': origin,
+                'destination': random_point_k_km_away(origin, band, rng),
+            })
+    return pairs
+
+
+def route_length_m(route_coords):
+    if len(route_coords) < 2:
+        return 0.0
+    coords = np.asarray(route_coords, dtype=float)
+    return float(haversine_m(coords[:-1, 0], coords[:-1, 1], coords[1:, 0], coords[1:, 1]).sum())
+
+
+def route_risk(route_coords, crime_buffers, weight_col='weight'):
+    """Sum of the weights of the crime buffers touched by the route"""
+    if len(route_coords) < 2:
+        return 0.0
+    line = LineString([(lon, lat) for lat, lon in route_coords])
+    hits = crime_buffers.sindex.query(line, predicate='intersects')
+    return float(crime_buffers[weight_col].to_numpy()[hits].sum())
+
+
+def _percentiles(values):
+    if not values:
+        return {'p50': None, 'p95': None, 'p99': None, 'mean': None}
+    arr = np.asarray(values)
+    return {
+        'p50': float(np.percentile(arr, 50)),
+        'p95': float(np.percentile(arr, 95)),
+        'p99': float(np.percentile(arr, 99)),
+        'mean': float(arr.mean()),
+    }
+
+
+def _mean(values):
+    return float(np.mean(values)) if values else None
+
+
+def run_engine(engine, pairs, graph, crime_buffers, measure_memory=True, warmup=1):
+    """
+    Run one engine over all OD pairs
+
+    Latency is measured without tracemalloc; when `measure_memory` is set each
+    query is repeated under tracemalloc to get its peak Python allocation.
+
+    Returns:
+        List of per-query records
+    """
+    for pair in pairs[:warmup]:
+        try:
+            engine(pair['origin'], pair['destination'], pair['time'], graph, crime_buffers)
+        except Exception:
+            pass
+
+    records = []
+    for pair in pairs:
+        record = {'band_km': pair['band_km'], 'time': pair['time']}
+        try:
+            start = time.perf_counter()
+            safe, fast = engine(pair['origin'], pair['destination'], pair['time'], graph, crime_buffers)
+            record['latency_ms'] = (time.perf_counter() - start) * 1000
+        except Exception as e:
+            record['error'] = f"{type(e).__name__}: {e}"
+            records.append(record)
+            continue
+
+        if measure_memory:
+            tracemalloc.start()
+            engine(pair['origin'], pair['destination'], pair['time'], graph, crime_buffers)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            record['peak_mb'] = peak / 2 ** 20
+
+        zone_buffers = crime_buffers[crime_buffers['time_zones'] == pair['time']]
+        safe_len, fast_len = route_length_m(safe), route_length_m(fast)
+        safe_risk, fast_risk = route_risk(safe, zone_buffers), route_risk(fast, zone_buffers)
+        record.update({
+            'safe_length_m': safe_len,
+            'fast_length_m': fast_len,
+            'safe_risk': safe_risk,
+            'fast_risk': fast_risk,
+            'length_overhead': safe_len / fast_len - 1 if fast_len > 0 else 0.0,
+            'risk_reduction': 1 - safe_risk / fast_risk if fast_risk > 0 else 0.0,
+        })
+        records.append(record)
+    return records
+
+
+def summarize(records):
+    """Aggregate per-query records into the numbers compared across commits"""
+    ok = [r for r in records if 'error' not in r]
+    return {
+        'queries': len(records),
+        'errors': len(records) - len(ok),
+        'latency_ms': _percentiles([r['latency_ms'] for r in ok]),
+        'peak_mb_max': max((r['peak_mb'] for r in ok if 'peak_mb' in r), default=None),
+        'length_overhead_mean': _mean([r['length_overhead'] for r in ok]),
+        'risk_reduction_mean': _mean([r['risk_reduction'] for r in ok]),
+    }
+
+
+def check_merged_routes(graph, crime_buffers, merged_buffers, pairs, tolerance=0.05):
+    """
+    Compare routes computed on the dissolved risk layer with the original buffers
+
+    Both safe routes are scored against the original buffers, so the check
+    measures how much the merged layer changes the route choice.
+
+    Args:
+        graph: Walking graph
+        crime_buffers: Original crime buffers
+        merged_buffers: Output of crime_pipeline.dissolve_risk_buffers
+        pairs: OD pairs from generate_od_pairs
+        tolerance: Maximum relative difference in length and risk
+
+    Returns:
+        dict with the share of identical routes, of routes within tolerance,
+        the mean relative differences, and the polygon and vertex counts and
+        edge-weighting seconds of both layers
+    """
+    # Etiquetado de aristas del grafo completo con cada capa, en la franja del primer par
+    zone = pairs[0]['time'] if pairs else None
+    weighting = {}
+    for name, layer, merged in (('buffers', crime_buffers, False), ('merged', merged_buffers, True)):
+        layer = layer[layer['time_zones'] == zone] if zone in set(layer['time_zones']) else layer
+        start = time.perf_counter()
+        fast_edge_weight_calculation(graph.copy(), layer, merged=merged)
+        weighting[name] = time.perf_counter() - start
+
+    identical, within, length_diffs, risk_diffs = 0, 0, [], []
+    for pair in pairs:
+        args = (pair['origin'], pair['destination'], pair['time'], graph)
+        safe, _ = buscar_ruta(*args, crime_buffers)
+        safe_merged, _ = buscar_ruta(*args, merged_buffers, merged=True)
+
+        zone_buffers = crime_buffers[crime_buffers['time_zones'] == pair['time']]
+        length, length_merged = route_length_m(safe), route_length_m(safe_merged)
+        risk, risk_merged = route_risk(safe, zone_buffers), route_risk(safe_merged, zone_buffers)
+
+        length_diff = abs(length_merged - length) / max(length, 1.0)
+        risk_diff = abs(risk_merged - risk) / max(risk, 1.0)
+        length_diffs.append(length_diff)
+        risk_diffs.append(risk_diff)
+        identical += safe == safe_merged
+        within += length_diff <= tolerance and risk_diff <= tolerance
+
+    n = max(len(pairs), 1)
+    return {
+        'pairs': len(pairs),
+        'tolerance': tolerance,
+        'identical_share': identical / n,
+        'within_tolerance_share': within / n,
+        'length_diff_mean': _mean(length_diffs),
+        'risk_diff_mean': _mean(risk_diffs),
+        'buffers': len(crime_buffers),
+        'merged_polygons': len(merged_buffers),
+        'buffer_vertices': int(shapely.get_num_coordinates(crime_buffers.geometry.to_numpy()).sum()),
+        'merged_vertices': int(shapely.get_num_coordinates(merged_buffers.geometry.to_numpy()).sum()),
+        'edge_weighting_s': weighting,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Módulos que importan los procesos de trabajo y las herramientas de línea de comandos
+IMPORT_MODULES = ('principal_functions', 'risk_model', 'routing_client', 'poi_index', 'safe')
+
+
+def import_time(module, repeat=3):
+    """
+    Cold-start import time of `module` in a fresh interpreter (python -X importtime)
+
+    Returns:
+        Minimum cumulative import time in ms over `repeat` runs, or None if
+        the module cannot be imported here
+    """
+    times = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            return None
+        # Última línea: "import time: self | cumulative | módulo" en microsegundos
+        cumulative = result.stderr.strip().splitlines()[-1].split('|')[1]
+        times.append(int(cumulative) / 1000)
+    return min(times)
+
+
+def run_benchmark(graph, crime_buffers, engines=None, bands_km=DISTANCE_BANDS_KM, per_band=10,
+                  seed=0, measure_memory=True, center=ZOCALO):
+    """
+    Run every engine over the same seeded OD set
+
+    Returns:
+        dict ready to be dumped as JSON
+    """
+    engines = engines or ENGINES
+    pairs = generate_od_pairs(center, bands_km, per_band, seed=seed)
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'seed': seed,
+        'bands_km': list(bands_km),
+        'per_band': per_band,
+        'graph': {'nodes': graph.number_of_nodes(), 'edges': graph.number_of_edges()},
+        'crime_buffers': len(crime_buffers),
+        'engines': {},
+    }
+
+    for name, engine in engines.items():
+        print(f"Ejecutando {name} sobre {len(pairs)} pares...")
+        records = run_engine(engine, pairs, graph, crime_buffers, measure_memory)
+        report['engines'][name] = {
+            'overall': summarize(records),
+            'bands': {str(band): summarize([r for r in records if r['band_km'] == band]) for band in bands_km},
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark reproducible de rutas seguras')
+    parser.add_argument('--synthetic', action='store_true', help='Usar el grafo sintético en cuadrícula')
+    parser.add_argument('--graph', help='Archivo GraphML con la red peatonal')
+    parser.add_argument('--crimes', help='GeoJSON con los buffers de crimen')
+    parser.add_argument('--bands', type=float, nargs='+', default=list(DISTANCE_BANDS_KM), help='Bandas en km')
+    parser.add_argument('--per-band', type=int, default=10, help='Pares origen-destino por banda')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--engines', nargs='+', choices=sorted(ENGINES), help='Motores a ejecutar (todos por defecto)')
+    parser.add_argument('--no-memory', action='store_true', help='No medir el pico de memoria')
+    parser.add_argument('--check-merged', type=float, metavar='TOL',
+                        help='Comparar también con la capa disuelta de polígonos de riesgo')
+    parser.add_argument('--import-time', action='store_true',
+                        help='Medir solo el tiempo de importación de los módulos principales')
+    parser.add_argument('--out', default='bench_output.json', help='Archivo JSON de salida')
+    args = parser.parse_args()
+
+    if args.import_time:
+        report = {'commit': git_commit(), 'python': platform.python_version(), 'import_ms': {}}
+        for module in IMPORT_MODULES:
+            ms = import_time(module)
+            report['import_ms'][module] = ms
+            print(f"  {module:<20} {'no disponible' if ms is None else f'{ms:.0f} ms'}")
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Resultados guardados en {args.out}")
+        return
+
+    if args.synthetic or not args.graph:
+        graph = synthetic_grid_graph(radius_km=max(args.bands) + 3, seed=args.seed)
+        crime_buffers = synthetic_crime_buffers(graph, seed=args.seed)
+    else:
+        import osmnx as ox
+        graph = ox.load_graphml(args.graph)
+        crime_buffers = gpd.read_file(args.crimes)
+
+    engines = {name: ENGINES[name] for name in args.engines} if args.engines else ENGINES
+    report = run_benchmark(graph, crime_buffers, engines, args.bands, args.per_band,
+                           args.seed, not args.no_memory)
+
+    if args.check_merged is not None:
+        from crime_pipeline import dissolve_risk_buffers
+        merged = dissolve_risk_buffers(crime_buffers)
+        pairs = generate_od_pairs(ZOCALO, args.bands, args.per_band, seed=args.seed)
+        report['merged_check'] = check_merged_routes(graph, crime_buffers, merged, pairs, args.check_merged)
+
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Resultados guardados en {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""
+Pipeline de datos de crimen: CSV de la fiscalía -> buffers por franja horaria
+
+Reúne en un solo script los pasos de mainUAB.ipynb, carreteres.ipynb y
+model.ipynb:
+
+    1. Lee CMX_2024.csv por bloques (sin cargar el año completo en memoria)
+    2. Filtra hechos no delictivos y delitos de bajo impacto irrelevantes
+    3. Calcula el peso de cada delito por categoría
+    4. Asigna la franja horaria a partir de la hora del hecho
+    5. Reproyecta a EPSG:32614, crea buffers de 50 m y vuelve a EPSG:4326
+       con operaciones vectorizadas de Shapely 2
+    6. Escribe un almacén particionado por franja horaria
+       (<salida>/time_zones=<franja>/part-<n>.parquet)
+    7. Opcionalmente disuelve los buffers solapados de cada franja en
+       polígonos de igual nivel de riesgo, sin solapes, que recuerdan los
+       buffers de los que vienen (dissolve_risk_buffers)
+
+Las franjas son rangos fijos de hora en lugar de un KMeans sobre
+time_seconds: así cada bloque se etiqueta igual sin ver el año completo, y
+coinciden con los rangos de hora que usa safe.py.
+
+Uso:
+    python crime_pipeline.py CMX_2024.csv --out crime_buffers --geojson crime_buffers.geojson
+    python crime_pipeline.py CMX_2024.csv --dissolved risk_polygons.geojson --levels 5
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import time
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from pyproj import Transformer
+
+from risk_model import TIME_ZONE_STARTS, TIME_ZONES
+
+
+PROJECTED_CRS = 'EPSG:32614'
+GEOGRAPHIC_CRS = 'EPSG:4326'
+BUFFER_RADIUS_M = 50
+
+# Pesos por categoría (carreteres.ipynb); el resto vale 1
+CRIME_CATEGORY_TO_WEIGHT = {
+    'DELITO DE BAJO IMPACTO': 1,
+    'ROBO A TRANSEUNTE EN VÍA PÚBLICA CON Y SIN VIOLENCIA': 3,
+    'ROBO DE VEHÍCULO CON Y SIN VIOLENCIA': 2,
+    'ROBO A NEGOCIO CON VIOLENCIA': 3,
+    'VIOLACIÓN': 4,
+    'ROBO A PASAJERO A BORDO DEL METRO CON Y SIN VIOLENCIA': 2,
+    'HOMICIDIO DOLOSO': 5,
+    'ROBO A REPARTIDOR CON Y SIN VIOLENCIA': 3,
+    'ROBO A PASAJERO A BORDO DE MICROBÚS CON Y SIN VIOLENCIA': 2,
+    'LESIONES DOLOSAS POR DISPARO DE ARMA DE FUEGO': 4,
+    'ROBO A CASA HABITACIÓN CON VIOLENCIA': 3,
+    'ROBO A CUENTAHABIENTE SALIENDO DEL CAJERO CON VIOLENCIA': 3,
+    'ROBO A PASAJERO A BORDO DE TAXI CON VIOLENCIA': 3,
+    'ROBO A TRANSPORTISTA CON Y SIN VIOLENCIA': 2,
+    'SECUESTRO': 5
+}
+MAX_WEIGHT = 5
+LOW_IMPACT_KEEP = 'ROBO|ACOSO|HOMICIDIO|PANDILLA'
+
+USECOLS = ['delito', 'categoria_delito', 'hora_hecho', 'latitud', 'longitud']
+
+_to_projected = Transformer.from_crs(GEOGRAPHIC_CRS, PROJECTED_CRS, always_xy=True)
+_to_geographic = Transformer.from_crs(PROJECTED_CRS, GEOGRAPHIC_CRS, always_xy=True)
+
+
+def assign_time_zones(hours):
+    """
+    Time-zone label for each hour of the day
+
+    Args:
+        hours: Array of hours in [0, 24)
+
+    Returns:
+        NumPy array of labels from TIME_ZONES
+    """
+    idx = np.searchsorted(TIME_ZONE_STARTS, hours, side='right') - 1
+    return np.asarray(TIME_ZONES, dtype=object)[np.clip(idx, 0, len(TIME_ZONES) - 1)]
+
+
+def hours_from_strings(hora_hecho):
+    """Parse 'HH:MM[:SS]' strings to fractional hours (NaN when invalid)"""
+    parts = hora_hecho.astype(str).str.split(':', expand=True)
+    h = pd.to_numeric(parts[0], errors='coerce')
+    m = pd.to_numeric(parts[1], errors='coerce') if parts.shape[1] > 1 else 0
+    s = pd.to_numeric(parts[2], errors='coerce').fillna(0) if parts.shape[1] > 2 else 0
+    return (h + m / 60 + s / 3600).to_numpy(dtype=float)
+
+
+def clean_chunk(df):
+    """
+    Filter and weight one chunk of the raw CSV
+
+    Returns:
+        DataFrame with delito, categoria_delito, latitud, longitud, hora,
+        time_zones and weight (normalized to 0-1 like crimes.geojson)
+    """
+    df = df[df['categoria_delito'] != 'HECHO NO DELICTIVO']
+    low_impact = df['categoria_delito'] == 'DELITO DE BAJO IMPACTO'
+    relevant = df['delito'].str.contains(LOW_IMPACT_KEEP, case=False, na=False)
+    df = df[~low_impact | relevant]
+
+    df = df.assign(hora=hours_from_strings(df['hora_hecho']))
+    df = df.dropna(subset=['latitud', 'longitud', 'hora'])
+
+    weight = df['categoria_delito'].map(CRIME_CATEGORY_TO_WEIGHT).fillna(1).to_numpy(dtype=float)
+    weight = weight + 0.5 * df['delito'].str.contains('CON', case=True, na=False).to_numpy()
+
+    return pd.DataFrame({
+        'delito': df['delito'].to_numpy(),
+        'categoria_delito': df['categoria_delito'].to_numpy(),
+        'latitud': df['latitud'].to_numpy(dtype=float),
+        'longitud': df['longitud'].to_numpy(dtype=float),
+        'hora': df['hora'].to_numpy(),
+        'time_zones': assign_time_zones(df['hora'].to_numpy()),
+        'weight': weight / MAX_WEIGHT,
+    })
+
+
+def buffer_points(lon, lat, radius_m=BUFFER_RADIUS_M, quad_segs=8):
+    """
+    Metric buffers around WGS84 points, returned in WGS84
+
+    Reprojection and buffering run on whole arrays (pyproj + Shapely 2),
+    without a Python loop over points.
+    """
+    x, y = _to_projected.transform(lon, lat)
+    buffers = shapely.buffer(shapely.points(x, y), radius_m, quad_segs=quad_segs)
+    return shapely.transform(buffers, lambda xy: np.column_stack(_to_geographic.transform(xy[:, 0], xy[:, 1])))
+
+
+def write_partitions(gdf, out_dir, part):
+    """Append `gdf` to the store, one file per time zone"""
+    written = {}
+    for zone, group in gdf.groupby('time_zones'):
+        zone_dir = os.path.join(out_dir, f"time_zones={zone}")
+        os.makedirs(zone_dir, exist_ok=True)
+        group.to_parquet(os.path.join(zone_dir, f"part-{part:05d}.parquet"), index=False)
+        written[zone] = len(group)
+    return written
+
+
+def load_crime_buffers(store_dir, time_zones=None):
+    """
+    Read the partitioned store written by run_pipeline
+
+    Args:
+        store_dir: Directory of the store
+        time_zones: Iterable of zones to load, None for all of them
+
+    Returns:
+        GeoDataFrame in EPSG:4326 with the same columns as crime_buffers.geojson
+        plus 'hora' and 'categoria_delito'
+    """
+    frames = []
+    for name in sorted(os.listdir(store_dir)):
+        if not name.startswith('time_zones='):
+            continue
+        zone = name.split('=', 1)[1]
+        if time_zones is not None and zone not in time_zones:
+            continue
+        zone_dir = os.path.join(store_dir, name)
+        frames.extend(gpd.read_parquet(os.path.join(zone_dir, f)) for f in sorted(os.listdir(zone_dir)))
+
+    if not frames:
+        return gpd.GeoDataFrame(columns=['weight', 'time_zones', 'delito', 'geometry'],
+                                geometry='geometry', crs=GEOGRAPHIC_CRS)
+    return gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), crs=GEOGRAPHIC_CRS)
+
+
+def _risk_faces(group, weight_col):
+    """
+    Planar faces of the buffers of one zone and the (face, buffer) pairs covering them
+
+    Raises:
+        ValueError: If a buffer is not covered by any face (invalid geometry)
+    """
+    geoms = group.geometry.to_numpy()
+    edges = shapely.union_all(shapely.boundary(geoms))
+    faces = shapely.get_parts(shapely.polygonize(shapely.get_parts(edges)))
+
+    # Buffers que cubren cada cara: un punto interior de la cara dentro del buffer
+    tree = shapely.STRtree(geoms)
+    face_idx, buffer_idx = tree.query(shapely.point_on_surface(faces), predicate='within')
+    uncovered = int((np.bincount(buffer_idx, minlength=len(geoms)) == 0).sum())
+    if uncovered:
+        raise ValueError(f"{uncovered} buffers no quedan cubiertos por ninguna cara; revisa sus geometrías")
+
+    # Las caras sin buffers son huecos rodeados por buffers
+    counts = np.bincount(face_idx, minlength=len(faces))
+    keep = np.flatnonzero(counts)
+    new_id = np.full(len(faces), -1, dtype=np.int64)
+    new_id[keep] = np.arange(len(keep))
+    face_idx = new_id[face_idx]
+    weights = np.bincount(face_idx, weights=group[weight_col].to_numpy(dtype=float)[buffer_idx],
+                          minlength=len(keep))
+    return faces[keep], weights, face_idx, buffer_idx
+
+
+def dissolve_risk_buffers(buffer_gdf, weight_col='weight', by='time_zones', levels=None):
+    """
+    Dissolve overlapping crime buffers into polygons of equal risk
+
+    The boundaries of all buffers of a time zone are noded and polygonized
+    into faces without overlaps; every face gets the summed weight of the
+    buffers covering it. Touching faces with the same risk level (or the
+    same summed weight when `levels` is None) are then unioned into one
+    polygon.
+
+    Every polygon keeps the buffers it comes from (buffer_ids, with their
+    buffer_weights and buffer_delitos) so that principal_functions counts
+    each buffer once along an edge that crosses several polygons. Without
+    `levels` the sums along an edge match the unmerged buffers; with
+    `levels` a polygon can join buffers an edge crossing it never touches,
+    so they become an upper bound. In dense clusters the faces can
+    outnumber the buffers: check the polygon and vertex counts in the
+    report of main() or benchmark.check_merged_routes.
+
+    Args:
+        buffer_gdf: GeoDataFrame with crime buffers
+        weight_col: Column with the weight of each buffer
+        by: Column used to partition separately (None for a single layer)
+        levels: Quantize the summed face weights into this many risk levels
+                (quantile bins) before dissolving; 'weight' becomes the mean
+                weight of the level. None dissolves only faces with the same
+                summed weight
+
+    Returns:
+        GeoDataFrame with geometry, `by`, weight, count (number of buffers
+        in the polygon), delito (most frequent crime among them), the tuples
+        buffer_ids (positions in buffer_gdf), buffer_weights and
+        buffer_delitos, and risk_level when `levels` is given
+
+    Raises:
+        ValueError: If a buffer is not covered by any face
+    """
+    positions = np.arange(len(buffer_gdf))
+    groups = positions.reshape(1, -1) if not by else [
+        members for _, members in buffer_gdf.groupby(by, sort=False).indices.items()]
+
+    zones = []
+    for members in groups:
+        group = buffer_gdf.iloc[members]
+        faces, weights, face_idx, buffer_idx = _risk_faces(group, weight_col)
+        zones.append((group, faces, weights, face_idx, members[buffer_idx]))
+
+    all_weights = np.concatenate([weights for _, _, weights, _, _ in zones])
+    if levels:
+        codes = pd.qcut(all_weights, levels, labels=False, duplicates='drop') + 1
+        level_weight = pd.Series(all_weights).groupby(codes).mean()
+    else:
+        codes = all_weights
+
+    delitos = buffer_gdf['delito'].to_numpy() if 'delito' in buffer_gdf else None
+    buffer_weights = buffer_gdf[weight_col].to_numpy(dtype=float)
+    frames, offset = [], 0
+    for group, faces, weights, face_idx, buffer_pos in zones:
+        face_codes = codes[offset:offset + len(faces)]
+        offset += len(faces)
+
+        # Unir las caras contiguas del mismo nivel; cada parte conexa es un polígono
+        polygons, polygon_codes, part_of_face = [], [], np.empty(len(faces), dtype=np.int64)
+        for code in np.unique(face_codes):
+            members = np.flatnonzero(face_codes == code)
+            parts = shapely.get_parts(shapely.coverage_union_all(faces[members]))
+            owner, part = shapely.STRtree(parts).query(shapely.point_on_surface(faces[members]), predicate='within')
+            part_of_face[members[owner]] = len(polygons) + part
+            polygons.extend(parts)
+            polygon_codes.extend([code] * len(parts))
+
+        pairs = pd.DataFrame({'polygon': part_of_face[face_idx], 'buffer': buffer_pos}).drop_duplicates()
+        pairs = pairs.sort_values(['polygon', 'buffer'])
+        ids = pairs.groupby('polygon')['buffer'].agg(tuple).reindex(range(len(polygons)))
+        data = {
+            weight_col: level_weight.reindex(polygon_codes).to_numpy() if levels else np.asarray(polygon_codes),
+            'count': ids.map(len).to_numpy(),
+            'buffer_ids': ids.to_numpy(),
+            'buffer_weights': ids.map(lambda b: tuple(buffer_weights[list(b)].tolist())).to_numpy(),
+        }
+        if levels:
+            data['risk_level'] = np.asarray(polygon_codes, dtype=np.int64)
+        if delitos is not None:
+            data['buffer_delitos'] = ids.map(lambda b: tuple(delitos[list(b)])).to_numpy()
+            data['delito'] = [Counter(d).most_common(1)[0][0] for d in data['buffer_delitos']]
+        if by:
+            data[by] = group[by].iloc[0]
+        frames.append(gpd.GeoDataFrame(data, geometry=polygons, crs=buffer_gdf.crs))
+
+    return gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), crs=buffer_gdf.crs)
+
+
+def peak_memory_mb():
+    """Peak resident memory of this process (ru_maxrss is KiB on Linux)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_pipeline(csv_path, out_dir, chunksize=200_000, radius_m=BUFFER_RADIUS_M, encoding='latin1',
+                 geojson_path=None):
+    """
+    Run the whole pipeline in streaming chunks
+
+    Args:
+        csv_path: Raw CSV (CMX_2024.csv)
+        out_dir: Directory of the partitioned store
+        chunksize: Rows read per chunk
+        radius_m: Buffer radius in meters
+        encoding: Encoding of the CSV
+        geojson_path: Optionally also write a single GeoJSON for the web app
+
+    Returns:
+        dict report with row counts, per-zone counts, stage timings and memory
+    """
+    # Borrar las particiones de una ejecución anterior: con menos bloques quedarían part-N huérfanos
+    if os.path.isdir(out_dir):
+        for name in os.listdir(out_dir):
+            if name.startswith('time_zones='):
+                shutil.rmtree(os.path.join(out_dir, name))
+    os.makedirs(out_dir, exist_ok=True)
+    timings = {'read': 0.0, 'clean': 0.0, 'buffer': 0.0, 'write': 0.0}
+    report = {'rows_read': 0, 'rows_kept': 0, 'chunks': 0, 'zones': {}}
+    start = time.perf_counter()
+
+    reader = pd.read_csv(csv_path, usecols=USECOLS, encoding=encoding, chunksize=chunksize)
+    while True:
+        t = time.perf_counter()
+        chunk = next(reader, None)
+        timings['read'] += time.perf_counter() - t
+        if chunk is None:
+            break
+
+        t = time.perf_counter()
+        clean = clean_chunk(chunk)
+        timings['clean'] += time.perf_counter() - t
+
+        t = time.perf_counter()
+        geometry = buffer_points(clean['longitud'].to_numpy(), clean['latitud'].to_numpy(), radius_m)
+        gdf = gpd.GeoDataFrame(clean, geometry=geometry, crs=GEOGRAPHIC_CRS)
+        timings['buffer'] += time.perf_counter() - t
+
+        t = time.perf_counter()
+        for zone, n in write_partitions(gdf, out_dir, report['chunks']).items():
+            report['zones'][zone] = report['zones'].get(zone, 0) + n
+        timings['write'] += time.perf_counter() - t
+
+        report['rows_read'] += len(chunk)
+        report['rows_kept'] += len(clean)
+        report['chunks'] += 1
+        print(f"Bloque {report['chunks']}: {len(clean)}/{len(chunk)} filas")
+
+    if geojson_path:
+        t = time.perf_counter()
+        store = load_crime_buffers(out_dir)
+        # periodo_de y tipo_delic son los campos del tooltip de la capa de crimen (map_state.py)
+        store = store.assign(periodo_de=store['time_zones'], tipo_delic=store['delito'])
+        store[['weight', 'time_zones', 'delito', 'hora', 'periodo_de', 'tipo_delic', 'geometry']].to_file(
+            geojson_path, driver='GeoJSON')
+        timings['geojson'] = time.perf_counter() - t
+
+    report['seconds'] = {name: round(s, 3) for name, s in timings.items()}
+    report['seconds']['total'] = round(time.perf_counter() - start, 3)
+    report['peak_memory_mb'] = round(peak_memory_mb(), 1)
+
+    with open(os.path.join(out_dir, 'report.json'), 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Genera los buffers de crimen por franja horaria')
+    parser.add_argument('csv', help='CSV de carpetas de investigación (CMX_2024.csv)')
+    parser.add_argument('--out', default='crime_buffers', help='Directorio del almacén particionado')
+    parser.add_argument('--chunksize', type=int, default=200_000, help='Filas por bloque')
+    parser.add_argument('--radius', type=float, default=BUFFER_RADIUS_M, help='Radio del buffer en metros')
+    parser.add_argument('--encoding', default='latin1')
+    parser.add_argument('--geojson', help='Escribir además un GeoJSON único para la web')
+    parser.add_argument('--dissolved', help='Escribir los polígonos de riesgo disueltos en este GeoJSON')
+    parser.add_argument('--levels', type=int, help='Cuantizar los polígonos disueltos en N niveles de riesgo')
+    args = parser.parse_args()
+
+    report = run_pipeline(args.csv, args.out, args.chunksize, args.radius, args.encoding, args.geojson)
+
+    if args.dissolved:
+        t = time.perf_counter()
+        buffers = load_crime_buffers(args.out)
+        merged = dissolve_risk_buffers(buffers, levels=args.levels)
+        seconds = time.perf_counter() - t
+        # GeoJSON no admite tuplas: los buffers de cada polígono se guardan separados por comas
+        tuples = [c for c in ('buffer_ids', 'buffer_weights', 'buffer_delitos') if c in merged]
+        merged.assign(**{c: merged[c].map(lambda values: ','.join(map(str, values))) for c in tuples}).to_file(
+            args.dissolved, driver='GeoJSON')
+        report['dissolved'] = {
+            'buffers': len(buffers), 'polygons': len(merged),
+            'buffer_vertices': int(shapely.get_num_coordinates(buffers.geometry.to_numpy()).sum()),
+            'polygon_vertices': int(shapely.get_num_coordinates(merged.geometry.to_numpy()).sum()),
+            'seconds': round(seconds, 3),
+        }
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Distancias geográficas vectorizadas y selección de los k más cercanos
+
+Un solo kernel NumPy calcula la distancia haversine de un punto a todos los
+candidatos de una vez, y np.argpartition elige los k mejores sin ordenar el
+resto: el coste de ordenar pasa de n log n a n + k log k. Lo usan la búsqueda
+de POI (poi_index.py, cercar_botigues.py) y la de delitos cercanos
+(principal_functions.get_nearest_crimes).
+"""
+import numpy as np
+
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters (works on scalars and NumPy arrays)"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def top_k_smallest(values, k=None):
+    """
+    Indices of the k smallest values, in ascending order
+
+    Args:
+        values: 1-D array
+        k: Number of indices, or None for a full (stable) sort
+
+    Returns:
+        int array with min(k, len(values)) indices
+    """
+    values = np.asarray(values)
+    if k is None or k >= len(values):
+        return np.argsort(values, kind='stable')
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    part = np.argpartition(values, k - 1)[:k]
+    return part[np.argsort(values[part], kind='stable')]
+
+
+def nearest(lat, lon, lats, lons, k=None, max_distance_m=None):
+    """
+    The k points closest to (lat, lon)
+
+    Args:
+        lat, lon: Query point
+        lats, lons: Arrays with the candidate coordinates
+        k: Number of points, or None for all of them
+        max_distance_m: Ignore points farther than this
+
+    Returns:
+        Tuple (indices into lats/lons, distances_m) ordered by distance
+    """
+    distances = haversine_m(lat, lon, np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64))
+    indices = np.arange(len(distances))
+    if max_distance_m is not None:
+        inside = distances <= max_distance_m
+        indices, distances = indices[inside], distances[inside]
+    order = top_k_smallest(distances, k)
+    return indices[order], distances[order]
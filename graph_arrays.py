@@ -0,0 +1,566 @@
+"""
+Representación compacta del grafo peatonal en arrays de NumPy
+
+GraphArrays compila una vez el MultiDiGraph de osmnx en arrays indexados por
+entero (nodos 0..n-1, aristas 0..m-1) y una lista de adyacencia CSR. Los
+pesos de las aristas pasan a ser un array de longitud m, de modo que cambiar
+de franja horaria o de estrategia de peso es una operación vectorizada sobre
+ese array en lugar de un bucle sobre los diccionarios de networkx.
+"""
+import heapq
+import math
+
+import numpy as np
+import shapely
+from shapely.ops import substring
+
+from instrumentation import count
+
+
+METERS_PER_DEGREE = 111320.0
+
+
+class GraphArrays:
+    """
+    Integer-indexed arrays of a networkx (Multi)DiGraph
+
+    Attributes:
+        nodes: List with the original node ids; position = node index
+        node_index: Dict original node id -> node index
+        x, y: Node coordinates (lon, lat for osmnx graphs)
+        u, v: Source and target node index of every edge
+        keys: Original edge keys (None for non-multigraphs)
+        length: Edge 'length' attribute in meters
+        indptr, adj: CSR adjacency; the edges leaving node i are
+                     adj[indptr[i]:indptr[i + 1]]
+    """
+
+    def __init__(self, nodes, x, y, u, v, keys, length, geometries=None):
+        self.nodes = nodes
+        self.node_index = {node: i for i, node in enumerate(nodes)}
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.u = np.asarray(u, dtype=np.int64)
+        self.v = np.asarray(v, dtype=np.int64)
+        self.keys = keys
+        self.length = np.asarray(length, dtype=np.float64)
+        self._geometries = geometries
+
+        self.adj = np.argsort(self.u, kind='stable')
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(self.u, minlength=len(nodes)))])
+        self._lists = None
+        self._reverse_lists = None
+        self._length_list = None
+        self._node_tree = None
+        self._edge_tree = None
+        self._scaled_edges = None
+        self._flipped_edges = None
+        self._reverse_edge = None
+
+    @classmethod
+    def from_graph(cls, graph):
+        """
+        Compile a networkx graph (as returned by osmnx) into arrays
+
+        Edges without 'geometry' get a straight segment between their nodes
+        when the geometries are first requested.
+        """
+        nodes = list(graph.nodes)
+        node_index = {node: i for i, node in enumerate(nodes)}
+        x = [data['x'] for _, data in graph.nodes(data=True)]
+        y = [data['y'] for _, data in graph.nodes(data=True)]
+
+        u, v, keys, length, geometries = [], [], [], [], []
+        if graph.is_multigraph():
+            edges = graph.edges(keys=True, data=True)
+        else:
+            edges = ((a, b, None, data) for a, b, data in graph.edges(data=True))
+        for a, b, k, data in edges:
+            u.append(node_index[a])
+            v.append(node_index[b])
+            keys.append(k)
+            length.append(data.get('length', 0.0))
+            geometries.append(data.get('geometry'))
+
+        return cls(nodes, x, y, u, v, keys, length, geometries)
+
+    @property
+    def n_nodes(self):
+        return len(self.nodes)
+
+    @property
+    def n_edges(self):
+        return len(self.u)
+
+    def edge_geometries(self):
+        """
+        Shapely array with one LineString per edge
+
+        Straight segments are built in bulk for edges without geometry; the
+        array is built once and cached.
+        """
+        if isinstance(self._geometries, np.ndarray):
+            return self._geometries
+
+        geoms = np.empty(self.n_edges, dtype=object)
+        if self._geometries is not None:
+            geoms[:] = self._geometries
+        missing = np.flatnonzero(shapely.is_missing(geoms))
+        if len(missing):
+            coords = np.stack([
+                np.column_stack([self.x[self.u[missing]], self.y[self.u[missing]]]),
+                np.column_stack([self.x[self.v[missing]], self.y[self.v[missing]]]),
+            ], axis=1)
+            geoms[missing] = shapely.linestrings(coords)
+        self._geometries = geoms
+        return geoms
+
+    def adjacency_lists(self):
+        """Plain Python lists of the CSR arrays, cached for the heapq searches"""
+        if self._lists is None:
+            self._lists = (self.indptr.tolist(), self.adj.tolist(), self.v.tolist())
+        return self._lists
+
+    def length_list(self):
+        """Edge lengths as a Python list, cached for the heapq searches"""
+        if self._length_list is None:
+            self._length_list = self.length.tolist()
+        return self._length_list
+
+    def reverse_adjacency_lists(self):
+        """
+        Incoming edges as CSR Python lists, for searches towards a target
+
+        Returns:
+            Tuple (indptr, adj, tails): the edges entering node i are
+            adj[indptr[i]:indptr[i + 1]] and tails[e] is the source of edge e
+        """
+        if self._reverse_lists is None:
+            adj = np.argsort(self.v, kind='stable')
+            indptr = np.concatenate([[0], np.cumsum(np.bincount(self.v, minlength=self.n_nodes))])
+            self._reverse_lists = (indptr.tolist(), adj.tolist(), self.u.tolist())
+        return self._reverse_lists
+
+    def nearest_node(self, lat, lon):
+        """
+        Index of the node closest to (lat, lon)
+
+        Uses an equirectangular approximation, accurate at city scale.
+        """
+        scale = math.cos(math.radians(lat))
+        d2 = ((self.x - lon) * scale) ** 2 + (self.y - lat) ** 2
+        return int(np.argmin(d2))
+
+    def lon_scale(self):
+        """Cosine of the mean latitude, the longitude scale of the equirectangular projection"""
+        return math.cos(math.radians(float(self.y.mean()))) if self.n_nodes else 1.0
+
+    def nearest_nodes(self, lats, lons):
+        """
+        Closest node to each (lat, lon) point, for many points at once
+
+        Uses an STRtree over the nodes with the same equirectangular scaling
+        as nearest_node (longitude scaled by the cosine of the mean latitude).
+
+        Returns:
+            Tuple (node indices, distances in meters)
+        """
+        scale = self.lon_scale()
+        if self._node_tree is None:
+            self._node_tree = shapely.STRtree(shapely.points(self.x * scale, self.y))
+        points = shapely.points(np.asarray(lons, dtype=np.float64) * scale, np.asarray(lats, dtype=np.float64))
+        (point_idx, nodes), distances = self._node_tree.query_nearest(points, return_distance=True, all_matches=False)
+        result_nodes = np.empty(len(points), dtype=np.int64)
+        result_dist = np.empty(len(points), dtype=np.float64)
+        result_nodes[point_idx] = nodes
+        result_dist[point_idx] = distances * METERS_PER_DEGREE
+        return result_nodes, result_dist
+
+    def _edge_index(self):
+        """
+        STRtree over the edge geometries projected once (longitude scaled by
+        lon_scale), plus whether each geometry runs from v to u
+        """
+        if self._edge_tree is None:
+            geoms = self.edge_geometries()
+            xy, owner = shapely.get_coordinates(geoms, return_index=True)
+            starts = np.concatenate([[0], np.cumsum(np.bincount(owner, minlength=self.n_edges))[:-1]])
+            first = xy[starts]
+            to_u = (first[:, 0] - self.x[self.u]) ** 2 + (first[:, 1] - self.y[self.u]) ** 2
+            to_v = (first[:, 0] - self.x[self.v]) ** 2 + (first[:, 1] - self.y[self.v]) ** 2
+            self._flipped_edges = to_u > to_v
+
+            xy[:, 0] *= self.lon_scale()
+            self._scaled_edges = shapely.linestrings(xy, indices=owner)
+            self._edge_tree = shapely.STRtree(self._scaled_edges)
+        return self._edge_tree
+
+    def build_edge_index(self):
+        """
+        Build now the structures nearest_edge builds on its first call
+
+        Long-running services call this at startup so the first request does
+        not pay for the edge STRtree and the reverse-edge table.
+        """
+        self._edge_index()
+        self.reverse_edges()
+
+    def reverse_edges(self):
+        """
+        Index of the opposite edge (v -> u) of every edge, -1 for one-way streets
+
+        Among parallel candidates the one with the closest length is taken.
+        """
+        if self._reverse_edge is None:
+            u, v, length = self.u.tolist(), self.v.tolist(), self.length.tolist()
+            by_pair = {}
+            for e, pair in enumerate(zip(u, v)):
+                by_pair.setdefault(pair, []).append(e)
+            reverse = np.full(self.n_edges, -1, dtype=np.int64)
+            for e, (a, b) in enumerate(zip(u, v)):
+                candidates = by_pair.get((b, a)) if a != b else None
+                if candidates:
+                    reverse[e] = min(candidates, key=lambda c: abs(length[c] - length[e]))
+            self._reverse_edge = reverse
+        return self._reverse_edge
+
+    def nearest_edge(self, lat, lon):
+        """
+        Snap (lat, lon) onto the closest point of the closest edge
+
+        Returns:
+            EdgeSnap
+        """
+        tree = self._edge_index()
+        point = shapely.Point(lon * self.lon_scale(), lat)
+        edges, distances = tree.query_nearest(point, return_distance=True, all_matches=False)
+        edge = int(edges[0])
+        fraction = float(shapely.line_locate_point(self._scaled_edges[edge], point, normalized=True))
+        if self._flipped_edges[edge]:
+            fraction = 1.0 - fraction
+        return EdgeSnap(edge, fraction, int(self.reverse_edges()[edge]), float(distances[0]) * METERS_PER_DEGREE)
+
+    def node_coords(self, node_path):
+        """List of (lat, lon) tuples for a sequence of node indices"""
+        return [(float(self.y[i]), float(self.x[i])) for i in node_path]
+
+    def path_coords(self, edges, source=None):
+        """
+        Full geometry of a path as a NumPy array
+
+        Unlike node_coords, the curved shape of every street is kept.
+
+        Args:
+            edges: Edge indices of the path
+            source: Start node, only used when the path has no edges
+
+        Returns:
+            float64 array (n_points, 2) with (lat, lon) rows
+        """
+        edges = np.asarray(edges, dtype=np.int64)
+        if len(edges) == 0:
+            if source is None:
+                return np.empty((0, 2))
+            return np.array([[self.y[source], self.x[source]]])
+
+        xy, owner = shapely.get_coordinates(self.edge_geometries()[edges], return_index=True)
+        counts = np.bincount(owner, minlength=len(edges))
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+        # Orientar cada geometría de u a v (osmnx ya las guarda así, pero no es obligatorio)
+        first = xy[starts]
+        to_u = (first[:, 0] - self.x[self.u[edges]]) ** 2 + (first[:, 1] - self.y[self.u[edges]]) ** 2
+        to_v = (first[:, 0] - self.x[self.v[edges]]) ** 2 + (first[:, 1] - self.y[self.v[edges]]) ** 2
+        for i in np.flatnonzero(to_u > to_v):
+            xy[starts[i]:starts[i] + counts[i]] = xy[starts[i]:starts[i] + counts[i]][::-1]
+
+        # El primer punto de cada arista repite el último de la anterior
+        keep = np.ones(len(xy), dtype=bool)
+        keep[starts[1:]] = False
+        return np.ascontiguousarray(xy[keep][:, ::-1])
+
+    def piece_coords(self, pieces):
+        """
+        Geometry of a path whose first and last edges may be partial
+
+        Args:
+            pieces: List of (edge, start, end) fractions along each edge from
+                    u (0) to v (1), as returned by snapped_shortest_path
+
+        Returns:
+            float64 array (n_points, 2) with (lat, lon) rows
+        """
+        self._edge_index()
+        scale = self.lon_scale()
+        parts, run = [], []
+        for edge, start, end in pieces:
+            if start == 0.0 and end == 1.0:
+                run.append(edge)
+                continue
+            if run:
+                parts.append(self.path_coords(run))
+                run = []
+            flipped = self._flipped_edges[edge]
+            if flipped:
+                start, end = 1.0 - end, 1.0 - start
+            xy = shapely.get_coordinates(substring(self._scaled_edges[edge], start, end, normalized=True))
+            if flipped:
+                xy = xy[::-1]
+            parts.append(np.column_stack([xy[:, 1], xy[:, 0] / scale]))
+        if run:
+            parts.append(self.path_coords(run))
+        if not parts:
+            return np.empty((0, 2))
+        # Cada tramo empieza donde acaba el anterior
+        return np.concatenate([parts[0]] + [part[1:] for part in parts[1:]])
+
+
+class EdgeSnap:
+    """
+    A point snapped onto an edge of the graph
+
+    Attributes:
+        edge: Edge index
+        fraction: Position of the point along the edge, from u (0) to v (1)
+        reverse: Index of the opposite edge (v -> u), -1 on one-way streets
+        distance: Meters between the original point and the edge
+    """
+
+    def __init__(self, edge, fraction, reverse, distance):
+        self.edge = edge
+        self.fraction = fraction
+        self.reverse = reverse
+        self.distance = distance
+
+    def flipped(self):
+        """The same point described on the opposite edge"""
+        return EdgeSnap(self.reverse, 1.0 - self.fraction, self.edge, self.distance)
+
+
+def dijkstra(arrays, weights, source, target=None):
+    """
+    Shortest paths from `source` over the CSR adjacency
+
+    Args:
+        arrays: GraphArrays
+        weights: Sequence with the (non-negative) cost of every edge; pass a
+                 list (GraphArrays.length_list, RiskModel.edge_cost_list) so
+                 the whole array is not converted on every call
+        source: Node index where the search starts
+        target: Optional node index; the search stops when it is settled
+
+    Returns:
+        Tuple (dist, pred) of dicts: node index -> cost, and
+        node index -> index of the edge used to reach it
+    """
+    indptr, adj, heads = arrays.adjacency_lists()
+    w = weights.tolist() if isinstance(weights, np.ndarray) else weights
+
+    dist = {source: 0.0}
+    pred = {}
+    settled = set()
+    heap = [(0.0, source)]
+
+    while heap:
+        d, node = heapq.heappop(heap)
+        if node in settled:
+            continue
+        settled.add(node)
+        if node == target:
+            break
+
+        for e in adj[indptr[node]:indptr[node + 1]]:
+            head = heads[e]
+            nd = d + w[e]
+            if nd < dist.get(head, math.inf):
+                dist[head] = nd
+                pred[head] = e
+                heapq.heappush(heap, (nd, head))
+
+    count('nodes_settled', len(settled))
+    return dist, pred
+
+
+def path_edges(arrays, pred, source, target):
+    """
+    Edge indices of the path from `source` to `target` in a predecessor map
+
+    Raises:
+        ValueError: If `target` was not reached
+    """
+    if target != source and target not in pred:
+        raise ValueError(f"No hay camino entre los nodos {arrays.nodes[source]} y {arrays.nodes[target]}")
+
+    edges = []
+    node = target
+    while node != source:
+        e = pred[node]
+        edges.append(e)
+        node = int(arrays.u[e])
+    edges.reverse()
+    return edges
+
+
+def edges_to_nodes(arrays, source, edges):
+    """Node indices visited by a path given as edge indices"""
+    return [source] + [int(arrays.v[e]) for e in edges]
+
+
+def shortest_path(arrays, weights, source, target):
+    """
+    Node indices of the cheapest path between two nodes
+
+    Returns:
+        List of node indices from source to target
+    """
+    _, pred = dijkstra(arrays, weights, source, target)
+    return edges_to_nodes(arrays, source, path_edges(arrays, pred, source, target))
+
+
+def snap_starts(arrays, weights, source):
+    """
+    Nodes reachable directly from a point snapped onto an edge
+
+    Returns:
+        Dict node index -> (cost, piece): the cost of walking from the point
+        to the node and the (edge, start, end) fraction walked
+    """
+    starts = {int(arrays.v[source.edge]): ((1.0 - source.fraction) * weights[source.edge],
+                                           (source.edge, source.fraction, 1.0))}
+    if source.reverse >= 0:
+        node = int(arrays.u[source.edge])
+        cost = source.fraction * weights[source.reverse]
+        if cost < starts.get(node, (math.inf,))[0]:
+            starts[node] = (cost, (source.reverse, 1.0 - source.fraction, 1.0))
+    return starts
+
+
+def snap_ends(arrays, weights, target):
+    """Nodes from which a snapped point is reached directly, like snap_starts"""
+    ends = {int(arrays.u[target.edge]): (target.fraction * weights[target.edge],
+                                         (target.edge, 0.0, target.fraction))}
+    if target.reverse >= 0:
+        node = int(arrays.v[target.edge])
+        cost = (1.0 - target.fraction) * weights[target.reverse]
+        if cost < ends.get(node, (math.inf,))[0]:
+            ends[node] = (cost, (target.reverse, 0.0, 1.0 - target.fraction))
+    return ends
+
+
+def same_edge_path(weights, source, target):
+    """
+    Direct path when both snapped points lie on the same street
+
+    Returns:
+        Tuple (cost, pieces); (inf, []) when the points are on different
+        streets or the direct way is against a one-way edge
+    """
+    if source.reverse >= 0 and target.edge == source.reverse:
+        target = target.flipped()
+    if target.edge == source.edge:
+        if target.fraction >= source.fraction:
+            return ((target.fraction - source.fraction) * weights[source.edge],
+                    [(source.edge, source.fraction, target.fraction)])
+        if source.reverse >= 0:
+            return ((source.fraction - target.fraction) * weights[source.reverse],
+                    [(source.reverse, 1.0 - source.fraction, 1.0 - target.fraction)])
+    return math.inf, []
+
+
+def snapped_search(arrays, weights, starts, ends=None, bound=math.inf):
+    """
+    Dijkstra seeded with the nodes of snap_starts
+
+    Args:
+        weights: List with the cost of every edge
+        starts: Dict from snap_starts
+        ends: Optional dict from snap_ends; the search stops once no
+              cheaper way to the target point can be found
+        bound: Cost of a path already known (e.g. same_edge_path)
+
+    Returns:
+        Tuple (dist, pred, best, best_end): dist and pred as in dijkstra,
+        the cost to the target point and the node of `ends` the best path
+        leaves from (None if no path through the graph beats `bound`)
+    """
+    indptr, adj, heads = arrays.adjacency_lists()
+    dist = {node: cost for node, (cost, _) in starts.items()}
+    pred = {}
+    settled = set()
+    heap = [(cost, node) for node, cost in dist.items()]
+    heapq.heapify(heap)
+    best, best_end = bound, None
+
+    while heap:
+        d, node = heapq.heappop(heap)
+        if d >= best:
+            break
+        if node in settled:
+            continue
+        settled.add(node)
+        if ends is not None and node in ends and d + ends[node][0] < best:
+            best, best_end = d + ends[node][0], node
+
+        for e in adj[indptr[node]:indptr[node + 1]]:
+            head = heads[e]
+            nd = d + weights[e]
+            if nd < dist.get(head, math.inf):
+                dist[head] = nd
+                pred[head] = e
+                heapq.heappush(heap, (nd, head))
+
+    count('nodes_settled', len(settled))
+    return dist, pred, best, best_end
+
+
+def snapped_pieces(arrays, pred, starts, end_piece, node):
+    """
+    (edge, start, end) pieces of the path that leaves the graph at `node`
+
+    Args:
+        pred: Node index -> edge index (dict, or array with -1 at the seeds)
+        starts: Dict from snap_starts
+        end_piece: Partial edge from `node` to the target point
+    """
+    edges = []
+    e = pred.get(node, -1) if isinstance(pred, dict) else int(pred[node])
+    while e >= 0:
+        edges.append(e)
+        node = int(arrays.u[e])
+        e = pred.get(node, -1) if isinstance(pred, dict) else int(pred[node])
+    edges.reverse()
+    pieces = [starts[node][1]] + [(e, 0.0, 1.0) for e in edges] + [end_piece]
+    return [piece for piece in pieces if piece[2] > piece[1]]
+
+
+def snapped_shortest_path(arrays, weights, source, target):
+    """
+    Cheapest path between two points snapped onto edges
+
+    The search starts from a virtual point: leaving it costs the remaining
+    fraction of its edge towards v (or of the opposite edge towards u), and
+    the target is reached through the fraction of its edge up to the point.
+    Nothing is added to the shared arrays, so no per-request copy is needed.
+
+    Args:
+        arrays: GraphArrays
+        weights: Sequence with the (non-negative) cost of every edge
+        source, target: EdgeSnap
+
+    Returns:
+        Tuple (cost, pieces) with pieces a list of (edge, start, end)
+        fractions; the edges in between are (edge, 0.0, 1.0)
+
+    Raises:
+        ValueError: If the target cannot be reached
+    """
+    w = weights.tolist() if isinstance(weights, np.ndarray) else weights
+    direct, direct_pieces = same_edge_path(w, source, target)
+    starts, ends = snap_starts(arrays, w, source), snap_ends(arrays, w, target)
+    _, pred, best, best_end = snapped_search(arrays, w, starts, ends, direct)
+
+    if best == math.inf:
+        raise ValueError("No hay camino entre los puntos de origen y destino")
+    if best_end is None:
+        return best, direct_pieces
+    return best, snapped_pieces(arrays, pred, starts, ends[best_end][1], best_end)
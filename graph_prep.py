@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Preparación del grafo peatonal antes de calcular rutas
+
+El grafo descargado de OSM trae piezas sueltas (aceras aisladas, patios) en
+las que un punto puede quedar asignado a un nodo desde el que no se llega a
+ninguna parte, cadenas de nodos de grado 2 que solo describen la forma de la
+calle y aristas paralelas casi idénticas. Todo ello hace más lentas las
+búsquedas y ocupa memoria. Esta etapa:
+
+    1. Conserva la mayor componente fuertemente conexa
+    2. Contrae las cadenas de grado 2 (ox.simplify_graph) sumando longitud y
+       riesgo y uniendo la geometría
+    3. Opcionalmente consolida intersecciones a menos de `tolerance_m` metros
+       (ox.consolidate_intersections sobre el grafo proyectado)
+    4. Elimina aristas paralelas casi duplicadas
+
+e informa de la reducción de nodos y aristas y de la aceleración de las
+consultas sobre RiskModel.
+
+Uso:
+    python graph_prep.py --graph cache_MexicoCity_walk.graphml --out walk_prepared.graphml --tolerance 10 \\
+        --crimes crime_buffers.geojson --bench 50
+    python graph_prep.py --synthetic --bench 30
+"""
+import argparse
+import math
+import random
+import time
+
+import numpy as np
+import networkx as nx
+import osmnx as ox
+import shapely
+
+from geodesy import haversine_m
+from graph_arrays import METERS_PER_DEGREE
+
+
+# Atributos de riesgo que se suman al contraer una cadena de aristas
+RISK_ATTRS = ('edge_weight', 'combined_weight', 'buffer_weight')
+# Aristas paralelas cuya longitud y trazado difieren menos que esto se consideran duplicadas
+DUPLICATE_TOLERANCE_M = 1.0
+
+
+def geometry_lengths(geometries):
+    """Length in meters of (lon, lat) LineStrings, with one vectorized haversine call"""
+    coords, index = shapely.get_coordinates(geometries, return_index=True)
+    same = index[1:] == index[:-1]
+    segments = haversine_m(coords[:-1, 1], coords[:-1, 0], coords[1:, 1], coords[1:, 0])
+    return np.bincount(index[1:][same], weights=segments[same], minlength=len(geometries))
+
+
+def largest_strong_component(graph):
+    """Subgraph with the largest strongly connected component"""
+    return ox.truncate.largest_component(graph, strongly=True)
+
+
+def contract_degree_two(graph):
+    """
+    Merge chains of degree-2 nodes into single edges
+
+    Length and the risk attributes in RISK_ATTRS are summed; the geometry of
+    the merged edge follows the whole chain. Graphs already simplified by
+    osmnx are returned unchanged.
+    """
+    if graph.graph.get('simplified'):
+        return graph
+    present = {attr for _, _, data in graph.edges(data=True) for attr in RISK_ATTRS if attr in data}
+    aggs = {'length': sum, **{attr: sum for attr in present}}
+    return ox.simplify_graph(graph, edge_attr_aggs=aggs)
+
+
+def consolidate_intersections(graph, tolerance_m=10):
+    """
+    Merge intersections closer than `tolerance_m` into one node
+
+    The graph is projected to UTM for the consolidation and back to its CRS;
+    the edge lengths are recomputed from the rebuilt geometries.
+    """
+    crs = graph.graph.get('crs', 'epsg:4326')
+    projected = ox.project_graph(graph)
+    consolidated = ox.consolidate_intersections(projected, tolerance=tolerance_m, rebuild_graph=True,
+                                                dead_ends=True)
+    result = ox.project_graph(consolidated, to_crs=crs)
+    result.remove_edges_from(list(nx.selfloop_edges(result)))
+
+    edges = [(u, v, k) for u, v, k, data in result.edges(keys=True, data=True) if 'geometry' in data]
+    if edges:
+        lengths = geometry_lengths(np.array([result.edges[e]['geometry'] for e in edges], dtype=object))
+        nx.set_edge_attributes(result, dict(zip(edges, lengths.tolist())), 'length')
+    return result
+
+
+def _edge_geometry(graph, u, v, data):
+    if 'geometry' in data:
+        return data['geometry']
+    return shapely.LineString([(graph.nodes[u]['x'], graph.nodes[u]['y']), (graph.nodes[v]['x'], graph.nodes[v]['y'])])
+
+
+def _hausdorff_m(a, b):
+    """Hausdorff distance in meters between two (lon, lat) LineStrings, equirectangular around their latitude"""
+    scale = math.cos(math.radians(a.centroid.y))
+    a, b = (shapely.transform(g, lambda coords: coords * (scale, 1.0)) for g in (a, b))
+    return shapely.hausdorff_distance(a, b) * METERS_PER_DEGREE
+
+
+def drop_duplicate_edges(graph, tolerance_m=DUPLICATE_TOLERANCE_M):
+    """
+    Remove parallel edges (same u, v) that repeat a shorter one
+
+    An edge is a duplicate only when both its length and its geometry
+    (Hausdorff distance) are within tolerance_m of a kept edge; two streets
+    of similar length between the same nodes, e.g. both sides of a
+    block, are kept.
+    """
+    duplicates = []
+    for u, v in {(u, v) for u, v, k in graph.edges(keys=True) if k != 0}:
+        parallel = sorted(graph[u][v].items(), key=lambda item: item[1].get('length', 0))
+        kept = []
+        for key, data in parallel:
+            length = data.get('length', 0)
+            geometry = _edge_geometry(graph, u, v, data)
+            if any(abs(length - other) < tolerance_m and _hausdorff_m(geometry, other_geometry) < tolerance_m
+                   for other, other_geometry in kept):
+                duplicates.append((u, v, key))
+            else:
+                kept.append((length, geometry))
+    graph.remove_edges_from(duplicates)
+    return graph
+
+
+def prepare_graph(graph, simplify=True, tolerance_m=None, drop_duplicates=True):
+    """
+    Run the preparation steps and record their effect
+
+    Args:
+        graph: osmnx MultiDiGraph in EPSG:4326
+        simplify: Contract degree-2 chains
+        tolerance_m: Consolidate intersections within this distance, or None
+        drop_duplicates: Remove near-duplicate parallel edges
+
+    Returns:
+        Tuple (prepared graph, report) where report is a list of dicts with
+        step, nodes, edges and seconds
+    """
+    report = [{'step': 'original', 'nodes': graph.number_of_nodes(), 'edges': graph.number_of_edges(),
+               'seconds': 0.0}]
+
+    def run(step, fn, G):
+        start = time.perf_counter()
+        G = fn(G)
+        report.append({'step': step, 'nodes': G.number_of_nodes(), 'edges': G.number_of_edges(),
+                       'seconds': time.perf_counter() - start})
+        return G
+
+    G = run('largest_scc', largest_strong_component, graph)
+    if simplify:
+        G = run('degree_2', contract_degree_two, G)
+    if tolerance_m:
+        G = run('consolidate', lambda g: consolidate_intersections(g, tolerance_m), G)
+        # La consolidación puede dejar nodos sin salida
+        G = run('largest_scc', largest_strong_component, G)
+    if drop_duplicates:
+        G = run('duplicates', drop_duplicate_edges, G)
+    return G, report
+
+
+def compare_queries(original, prepared, crime_buffers, n_queries=30, seed=0):
+    """
+    Time the same safe-route queries on RiskModels of both graphs
+
+    Origins and destinations are random nodes of the prepared graph, so
+    both graphs can answer them.
+
+    Returns:
+        dict with the mean ms per query on each graph, the speedup and the
+        number of queries that failed on the original graph
+    """
+    from risk_model import RiskModel
+
+    rng = random.Random(seed)
+    nodes = list(prepared.nodes)
+    points = [[(prepared.nodes[n]['y'], prepared.nodes[n]['x']) for n in rng.sample(nodes, 2)]
+              for _ in range(n_queries)]
+
+    result = {}
+    for name, graph in (('original', original), ('prepared', prepared)):
+        model = RiskModel.from_graph(graph, crime_buffers)
+        times, failures = [], 0
+        for origin, destination in points:
+            start = time.perf_counter()
+            try:
+                model.route(origin, destination, hour=21)
+            except ValueError:
+                failures += 1
+            times.append((time.perf_counter() - start) * 1000)
+        result[name] = {'mean_ms': float(np.mean(times)), 'failures': failures}
+    result['speedup'] = result['original']['mean_ms'] / result['prepared']['mean_ms']
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prepara el grafo peatonal para el cálculo de rutas')
+    parser.add_argument('--graph', help='Archivo GraphML con la red peatonal')
+    parser.add_argument('--synthetic', action='store_true', help='Usar el grafo sintético de benchmark.py')
+    parser.add_argument('--out', help='Archivo GraphML de salida')
+    parser.add_argument('--tolerance', type=float, help='Consolidar intersecciones a menos de N metros')
+    parser.add_argument('--no-simplify', action='store_true', help='No contraer las cadenas de grado 2')
+    parser.add_argument('--crimes', help='GeoJSON con los buffers de crimen (para --bench)')
+    parser.add_argument('--bench', type=int, metavar='N', help='Comparar N consultas antes y después')
+    args = parser.parse_args()
+
+    if args.synthetic or not args.graph:
+        from benchmark import synthetic_grid_graph, synthetic_crime_buffers
+        graph = synthetic_grid_graph(radius_km=4, spacing_m=100, drop_fraction=0.3)
+        crime_buffers = synthetic_crime_buffers(graph)
+    else:
+        import geopandas as gpd
+        graph = ox.load_graphml(args.graph)
+        crime_buffers = gpd.read_file(args.crimes) if args.crimes else None
+
+    prepared, report = prepare_graph(graph, not args.no_simplify, args.tolerance)
+    for record in report:
+        print(f"  {record['step']:<12} {record['nodes']:>8} nodos {record['edges']:>8} aristas "
+              f"({record['seconds']:.2f} s)")
+    first, last = report[0], report[-1]
+    print(f"Reducción: {100 * (1 - last['nodes'] / first['nodes']):.1f}% nodos, "
+          f"{100 * (1 - last['edges'] / first['edges']):.1f}% aristas")
+
+    if args.out:
+        ox.save_graphml(prepared, args.out)
+        print(f"Grafo guardado en {args.out}")
+
+    if args.bench:
+        if crime_buffers is None:
+            parser.error('--bench necesita --crimes')
+        comparison = compare_queries(graph, prepared, crime_buffers, args.bench)
+        print(f"Consulta media: {comparison['original']['mean_ms']:.1f} ms -> "
+              f"{comparison['prepared']['mean_ms']:.1f} ms (x{comparison['speedup']:.2f}); "
+              f"fallos en el original: {comparison['original']['failures']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Instrumentación del camino caliente de las rutas
+
+Uso típico:
+
+    with trace_route('buscar_ruta', time=time) as trace:
+        with stage('crop_graph'):
+            ...
+        count('edges_processed', n)
+
+Cada traza emite un log estructurado (JSON en el logger 'saferoute.timing') con
+los tiempos por etapa y los contadores, y acumula los tiempos en un histograma
+global consultable con timing_summary(). Fuera de una traza, stage() y count()
+solo alimentan el histograma o no hacen nada.
+
+El perfilado con cProfile se activa con trace_route(..., profile=True) o con la
+variable de entorno SAFEROUTE_PROFILE=1. El contador 'edges_relaxed' de la ruta
+con networkx tiene un coste apreciable y solo se activa con SAFEROUTE_COUNT_EDGES=1.
+"""
+import bisect
+import contextvars
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+
+logger = logging.getLogger('saferoute.timing')
+
+# Límites superiores de los cubos del histograma, en milisegundos
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, float('inf'))
+
+_current_trace = contextvars.ContextVar('saferoute_trace', default=None)
+
+
+class StageHistogram:
+    """
+    Fixed-bucket histogram of stage durations, safe to update from many threads
+    """
+
+    def __init__(self, buckets_ms=BUCKETS_MS):
+        self.buckets_ms = buckets_ms
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def record(self, name, seconds):
+        ms = seconds * 1000
+        with self._lock:
+            stats = self._stages.get(name)
+            if stats is None:
+                stats = self._stages[name] = {
+                    'count': 0, 'total_ms': 0.0, 'min_ms': float('inf'), 'max_ms': 0.0,
+                    'buckets': [0] * len(self.buckets_ms),
+                }
+            stats['count'] += 1
+            stats['total_ms'] += ms
+            stats['min_ms'] = min(stats['min_ms'], ms)
+            stats['max_ms'] = max(stats['max_ms'], ms)
+            stats['buckets'][bisect.bisect_left(self.buckets_ms, ms)] += 1
+
+    def _percentile(self, stats, q):
+        target = q * stats['count']
+        seen = 0
+        for limit, n in zip(self.buckets_ms, stats['buckets']):
+            seen += n
+            if seen >= target:
+                return min(limit, stats['max_ms'])
+        return stats['max_ms']
+
+    def summary(self):
+        """
+        Returns:
+            dict stage -> {count, mean_ms, min_ms, max_ms, p50_ms, p95_ms, buckets}
+            where percentiles are the upper bound of the matching bucket
+        """
+        with self._lock:
+            stages = {name: dict(stats, buckets=list(stats['buckets'])) for name, stats in self._stages.items()}
+
+        result = {}
+        for name, stats in stages.items():
+            result[name] = {
+                'count': stats['count'],
+                'mean_ms': stats['total_ms'] / stats['count'],
+                'min_ms': stats['min_ms'],
+                'max_ms': stats['max_ms'],
+                'p50_ms': self._percentile(stats, 0.50),
+                'p95_ms': self._percentile(stats, 0.95),
+                'buckets': {
+                    ('inf' if limit == float('inf') else f"<={limit}"): n
+                    for limit, n in zip(self.buckets_ms, stats['buckets']) if n
+                },
+            }
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+
+HISTOGRAM = StageHistogram()
+
+
+class RouteTrace:
+    """
+    Timings and counters collected while computing one route
+    """
+
+    def __init__(self, name, **fields):
+        self.name = name
+        self.fields = fields
+        self.stages = {}
+        self.counters = {}
+        self.total = 0.0
+        self.profile_stats = None
+
+    def add_stage(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def to_dict(self):
+        return {
+            'event': self.name,
+            **self.fields,
+            'total_ms': round(self.total * 1000, 3),
+            'stages_ms': {name: round(s * 1000, 3) for name, s in self.stages.items()},
+            'counters': self.counters,
+        }
+
+
+def current_trace():
+    """RouteTrace active in this thread/task, or None"""
+    return _current_trace.get()
+
+
+@contextmanager
+def stage(name):
+    """Time a block as stage `name` of the current trace and of the global histogram"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        HISTOGRAM.record(name, elapsed)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_stage(name, elapsed)
+
+
+def count(name, n=1):
+    """Add `n` to counter `name` of the current trace (no-op without a trace)"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_count(name, n)
+
+
+@contextmanager
+def trace_route(name, profile=None, **fields):
+    """
+    Collect stage timings and counters for one route computation
+
+    Args:
+        name: Event name used in the structured log and histogram
+        profile: Run the block under cProfile; None reads SAFEROUTE_PROFILE
+        **fields: Extra values copied to the log record (e.g. the time zone)
+
+    Yields:
+        RouteTrace; after the block `trace.profile_stats` holds the cProfile
+        report when profiling was enabled
+    """
+    if profile is None:
+        profile = os.getenv('SAFEROUTE_PROFILE') == '1'
+
+    trace = RouteTrace(name, **fields)
+    token = _current_trace.set(trace)
+    profiler = cProfile.Profile() if profile else None
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield trace
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        trace.total = time.perf_counter() - start
+        _current_trace.reset(token)
+        HISTOGRAM.record(name, trace.total)
+
+        if profiler is not None:
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(25)
+            trace.profile_stats = out.getvalue()
+            logger.debug(trace.profile_stats)
+
+        logger.info(json.dumps(trace.to_dict(), ensure_ascii=False, default=str))
+
+
+def timing_summary():
+    """Aggregated histogram of every stage recorded in this process"""
+    return HISTOGRAM.summary()
@@ -0,0 +1,43 @@
+"""
+Importación diferida de dependencias pesadas
+
+osmnx, geopandas, pandas, folium o networkx tardan en conjunto más de un
+segundo en importarse. Los módulos que solo los usan en algunas funciones los
+declaran con lazy_module() y el import real ocurre en el primer acceso a un
+atributo, así los procesos de trabajo y las herramientas de línea de comandos
+que solo calculan rutas arrancan sin pagar ese coste.
+
+Para medirlo:
+    python -X importtime -c "import principal_functions" 2>&1 | tail -1
+"""
+import importlib
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is imported on first attribute access
+
+    Attributes:
+        name: Dotted name of the module (e.g. "rtree.index")
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self.name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = 'cargado' if self._module is not None else 'sin cargar'
+        return f"<LazyModule {self.name} ({state})>"
+
+
+def lazy_module(name):
+    """LazyModule for `name`; `gpd = lazy_module('geopandas')` replaces `import geopandas as gpd`"""
+    return LazyModule(name)
@@ -0,0 +1,201 @@
+import math
+import numpy as np
+import folium
+import shapely
+from folium.plugins import Draw
+
+from polyline_codec import decode_polyline
+
+
+# Coordenadas del centro de la Ciudad de México
+DEFAULT_CENTER = [19.424918, -99.175004]
+DEFAULT_ZOOM = 12
+
+# Metros por píxel en el ecuador para zoom 0 (proyección Web Mercator)
+METERS_PER_PIXEL_Z0 = 156543.03392
+METERS_PER_DEGREE = 111320.0
+
+
+def create_base_map(center=None, zoom=DEFAULT_ZOOM, crime_gdf=None):
+    """
+    Build the static part of the map: tiles, Draw plugin and optional crime layer
+
+    The result only depends on its arguments, so callers can cache it and reuse
+    the same object across Streamlit reruns. The map is rendered once here so
+    `st_folium(..., render=False)` does not serialize the crime layer again.
+
+    Args:
+        center: [lat, lon] initial center of the map
+        zoom: Initial zoom level
+        crime_gdf: GeoDataFrame with crime buffers, or None to skip the layer
+
+    Returns:
+        folium.Map ready to be passed to st_folium
+    """
+    m = folium.Map(location=center or DEFAULT_CENTER, zoom_start=zoom, control_scale=True)
+    Draw(draw_options={'marker': True, 'polyline': False}, export=False).add_to(m)
+
+    if crime_gdf is not None:
+        folium.GeoJson(
+            crime_gdf,
+            name="Zonas de Riesgo",
+            style_function=lambda x: {'fillColor': 'red', 'color': 'red', 'fillOpacity': 0.3},
+            tooltip=folium.GeoJsonTooltip(fields=['periodo_de', 'tipo_delic'])
+        ).add_to(m)
+
+    folium.LayerControl().add_to(m)
+    m.get_root().render()
+    return m
+
+
+def route_tolerance(zoom, lat=DEFAULT_CENTER[0], pixels=1.0):
+    """
+    Simplification tolerance in degrees equivalent to `pixels` screen pixels
+
+    Args:
+        zoom: Current map zoom level
+        lat: Latitude used to correct the Web Mercator scale
+        pixels: Number of pixels a removed vertex may deviate from the line
+
+    Returns:
+        float: Tolerance in degrees for Douglas-Peucker simplification
+    """
+    meters_per_pixel = METERS_PER_PIXEL_Z0 * math.cos(math.radians(lat)) / (2 ** zoom)
+    return pixels * meters_per_pixel / METERS_PER_DEGREE
+
+
+def route_array(route):
+    """
+    (lat, lon) NumPy array for a route stored in any of the supported forms
+
+    Args:
+        route: Encoded polyline string, NumPy array or list of (lat, lon)
+
+    Returns:
+        float64 array (n, 2)
+    """
+    if isinstance(route, (str, bytes)):
+        return decode_polyline(route)
+    return np.asarray(route, dtype=np.float64).reshape(-1, 2)
+
+
+def simplify_route(route_coords, zoom, pixels=1.0):
+    """
+    Simplify a route polyline so it keeps only the vertices visible at `zoom`
+
+    Args:
+        route_coords: Route as accepted by route_array
+        zoom: Current map zoom level
+        pixels: Maximum deviation allowed, in screen pixels
+
+    Returns:
+        List of [lat, lon] pairs with the simplified route (Douglas-Peucker)
+    """
+    coords = route_array(route_coords)
+    if len(coords) < 3:
+        return coords.tolist()
+
+    line = shapely.linestrings(coords[:, ::-1])
+    simplified = shapely.simplify(line, route_tolerance(zoom, coords[0, 0], pixels), preserve_topology=False)
+    return shapely.get_coordinates(simplified)[:, ::-1].tolist()
+
+
+def get_route_bounds(routes, margin=0.005):
+    """
+    Bounding box [[south, west], [north, east]] covering all routes
+
+    Args:
+        routes: Iterable of routes in any form accepted by route_array
+        margin: Extra margin in degrees (0.005 is about 500 m)
+
+    Returns:
+        List with the two corners of the box, or None if there are no points
+    """
+    arrays = [route_array(route) for route in routes or []]
+    all_points = np.concatenate(arrays) if arrays else np.empty((0, 2))
+    if not len(all_points):
+        return None
+
+    min_lat, min_lng = all_points.min(axis=0)
+    max_lat, max_lng = all_points.max(axis=0)
+    return [[float(min_lat) - margin, float(min_lng) - margin], [float(max_lat) + margin, float(max_lng) + margin]]
+
+
+def bounds_to_view(bounds, width_px=850, height_px=550, max_zoom=18):
+    """
+    Center and zoom level that fit `bounds` inside a map of the given size
+
+    st_folium can move the view of an already mounted map through its `center`
+    and `zoom` arguments, which replaces `fit_bounds` on a rebuilt map.
+
+    Args:
+        bounds: [[south, west], [north, east]]
+        width_px: Map width in pixels
+        height_px: Map height in pixels
+        max_zoom: Upper limit for the zoom level
+
+    Returns:
+        Tuple (center, zoom)
+    """
+    (south, west), (north, east) = bounds
+    center = [(south + north) / 2, (west + east) / 2]
+
+    lat_span = max(north - south, 1e-9)
+    lng_span = max(east - west, 1e-9)
+    zoom_lng = math.log2(360 * width_px / (256 * lng_span))
+    zoom_lat = math.log2(360 * height_px * math.cos(math.radians(center[0])) / (256 * lat_span))
+
+    return center, int(min(zoom_lng, zoom_lat, max_zoom))
+
+
+def build_dynamic_layer(points, routes, zoom):
+    """
+    Feature group with the elements that change between reruns
+
+    Only markers and routes go here; st_folium adds this group to the mounted
+    map without reloading the base map or the crime layer.
+
+    Args:
+        points: List of [lat, lon] clicked by the user (origin first)
+        routes: Tuple (safe_route, fast_route) or None; each route may be an
+                encoded polyline (see route_array)
+        zoom: Current zoom, used to simplify the route polylines
+
+    Returns:
+        folium.FeatureGroup
+    """
+    fg = folium.FeatureGroup(name="Rutas")
+
+    for i, point in enumerate(points):
+        folium.Marker(
+            location=point,
+            icon=folium.Icon(color='green' if i == 0 else 'red'),
+            tooltip="Origen" if i == 0 else "Destino"
+        ).add_to(fg)
+
+    if routes:
+        ruta_segura, ruta_rapida = routes
+        folium.PolyLine(simplify_route(ruta_segura, zoom), color='green', weight=3).add_to(fg)
+        folium.PolyLine(simplify_route(ruta_rapida, zoom), color='red', weight=3).add_to(fg)
+
+    return fg
+
+
+def layer_payload_size(points, routes, zoom):
+    """
+    Number of coordinates sent to the browser for the dynamic layer
+
+    Args:
+        points: List of [lat, lon] markers
+        routes: Tuple (safe_route, fast_route) or None
+        zoom: Current zoom level
+
+    Returns:
+        Tuple (raw_vertices, simplified_vertices)
+    """
+    raw = len(points)
+    simplified = len(points)
+    for route in routes or []:
+        raw += len(route_array(route))
+        simplified += len(simplify_route(route, zoom))
+    return raw, simplified
@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+"""
+Índice local de puntos de interés (POI) para cercar_botigues
+
+En lugar de enviar una consulta Overpass por cada búsqueda, los POI de un
+extracto de OpenStreetMap (amenity, shop, cuisine, nombre, marca y
+coordenadas) se cargan una vez en memoria con:
+
+    - un índice espacial (shapely.STRtree) para "lugares a menos de R metros"
+    - un índice invertido de palabras y etiquetas (amenity=cafe, cuisine=pizza...)
+
+El almacén se guarda en el mismo formato JSON que devuelve Overpass
+({"elements": [...]}), así que un archivo local sustituye a la API en pruebas.
+
+Uso:
+    # Extracto descargado una vez (Overpass con "out center;") o exportado con osmium a GeoJSON
+    python poi_index.py extracto.json --out pois_cdmx.json
+    python poi_index.py extracto.geojson --out pois_cdmx.json --query "tacos" --lat 19.4326 --lon -99.1332
+    # Benchmark de rank() con POI sintéticos
+    python poi_index.py --synthetic 50000 --radius 5000 --bench
+"""
+import argparse
+import bisect
+import json
+import math
+import re
+import time
+import unicodedata
+from collections import defaultdict
+
+import numpy as np
+import shapely
+
+from geodesy import haversine_m, top_k_smallest
+
+try:
+    from rapidfuzz import fuzz as _rapid_fuzz, process as _rapid_process
+except ImportError:
+    _rapid_process = None
+
+
+# Etiquetas que se conservan de cada elemento (las que usa cercar_botigues)
+POI_TAGS = (
+    'name', 'brand', 'amenity', 'shop', 'cuisine', 'tourism', 'description',
+    'opening_hours', 'phone', 'website', 'review:count', 'review:rating',
+    'addr:full', 'addr:street', 'addr:housenumber',
+)
+# Etiquetas indexadas como "clave=valor" y cuyas palabras también se indexan
+CATEGORY_KEYS = ('amenity', 'shop', 'cuisine', 'tourism')
+TEXT_KEYS = ('name', 'brand', 'description') + CATEGORY_KEYS
+
+# Campos que puntúa rank() (los mismos que calcular_puntuacion)
+RANK_KEYS = ('name', 'brand', 'cuisine', 'shop', 'amenity', 'description')
+NGRAM = 3
+
+METERS_PER_DEGREE = 111320.0
+
+
+def normalize_text(text):
+    """Lowercase text without accents ("Pizzería" -> "pizzeria")"""
+    text = unicodedata.normalize('NFKD', str(text).lower())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    """Words of a normalized text"""
+    return re.findall(r'[a-z0-9]+', normalize_text(text))
+
+
+def ngrams(text, n=NGRAM):
+    """Distinct character n-grams of a normalized text padded with spaces"""
+    padded = f" {text} "
+    return {padded[i:i + n] for i in range(max(len(padded) - n + 1, 1))}
+
+
+def _contains(values, text):
+    """Boolean array: `text` is a substring of each value"""
+    return np.char.find(values, text) >= 0
+
+
+def elements_from_overpass(data):
+    """
+    (lat, lon, tags) of every tagged element of an Overpass JSON response
+
+    Ways and relations use their 'center' ("out center;") or the middle of
+    their 'bounds', like buscar_lugares_cercanos.
+    """
+    for element in data.get('elements', []):
+        tags = element.get('tags')
+        if not tags:
+            continue
+        if 'lat' in element and 'lon' in element:
+            lat, lon = element['lat'], element['lon']
+        elif 'center' in element:
+            lat, lon = element['center']['lat'], element['center']['lon']
+        elif 'bounds' in element:
+            bounds = element['bounds']
+            lat = (bounds['minlat'] + bounds['maxlat']) / 2
+            lon = (bounds['minlon'] + bounds['maxlon']) / 2
+        else:
+            continue
+        yield float(lat), float(lon), tags
+
+
+def elements_from_geojson(path):
+    """
+    (lat, lon, tags) of every feature of a GeoJSON file with OSM tags as
+    properties (e.g. `osmium export extracto.osm.pbf -o extracto.geojson`)
+    """
+    import geopandas as gpd
+
+    gdf = gpd.read_file(path)
+    points = gdf.geometry.representative_point()
+    properties = gdf.drop(columns='geometry')
+    for point, (_, row) in zip(points, properties.iterrows()):
+        if point is None or point.is_empty:
+            continue
+        tags = {key: value for key, value in row.items() if isinstance(value, str) and value}
+        if tags:
+            yield point.y, point.x, tags
+
+
+class POIIndex:
+    """
+    In-memory POI store with a spatial index and a tag/word inverted index
+
+    Attributes:
+        lat, lon: float64 arrays with the coordinates of each POI
+        tags: List with the kept OSM tags of each POI
+        postings: Dict token -> sorted int array of POI ids. Tokens are the
+                  normalized words of TEXT_KEYS and "key=value" entries for
+                  CATEGORY_KEYS
+    """
+
+    def __init__(self, lat, lon, tags):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.tags = tags
+        self._tree = shapely.STRtree(shapely.points(self.lon, self.lat))
+
+        postings = defaultdict(list)
+        for i, poi_tags in enumerate(tags):
+            tokens = set()
+            for key in TEXT_KEYS:
+                value = poi_tags.get(key)
+                if not value:
+                    continue
+                tokens.update(tokenize(value))
+                if key in CATEGORY_KEYS:
+                    tokens.update(f"{key}={normalize_text(v.strip())}" for v in value.split(';'))
+            for token in tokens:
+                postings[token].append(i)
+        self.postings = {token: np.asarray(ids, dtype=np.int64) for token, ids in postings.items()}
+        self.vocabulary = sorted(self.postings)
+
+        # Campos normalizados una sola vez para puntuar en bloque con np.char
+        self.fields = {
+            key: np.array([normalize_text(poi_tags.get(key, '')) for poi_tags in tags], dtype=str)
+            for key in RANK_KEYS
+        }
+        grams = defaultdict(list)
+        for i, name in enumerate(self.fields['name']):
+            for gram in ngrams(name):
+                grams[gram].append(i)
+        self.gram_postings = {gram: np.asarray(ids, dtype=np.int64) for gram, ids in grams.items()}
+
+    @classmethod
+    def from_elements(cls, elements):
+        """Build the index from (lat, lon, tags) tuples, keeping POI_TAGS only"""
+        lat, lon, tags = [], [], []
+        for element_lat, element_lon, element_tags in elements:
+            kept = {key: element_tags[key] for key in POI_TAGS if element_tags.get(key)}
+            if not any(key in kept for key in TEXT_KEYS):
+                continue
+            lat.append(element_lat)
+            lon.append(element_lon)
+            tags.append(kept)
+        return cls(lat, lon, tags)
+
+    @classmethod
+    def load(cls, path):
+        """Load a store saved with save() or any Overpass JSON response"""
+        with open(path, encoding='utf-8') as f:
+            return cls.from_elements(elements_from_overpass(json.load(f)))
+
+    def save(self, path):
+        """Write the store as an Overpass-style JSON file"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'elements': self.elements(range(len(self)))}, f, ensure_ascii=False)
+
+    def __len__(self):
+        return len(self.tags)
+
+    def _in_radius(self, lat, lon, radius_m):
+        """Unordered (ids, distances_m) of the POIs within `radius_m` meters"""
+        dlat = radius_m / METERS_PER_DEGREE
+        dlon = dlat / max(math.cos(math.radians(lat)), 1e-6)
+        ids = self._tree.query(shapely.box(lon - dlon, lat - dlat, lon + dlon, lat + dlat))
+        distances = haversine_m(lat, lon, self.lat[ids], self.lon[ids])
+        inside = distances <= radius_m
+        return ids[inside], distances[inside]
+
+    def near(self, lat, lon, radius_m, k=None):
+        """
+        POIs within `radius_m` meters of (lat, lon)
+
+        Args:
+            k: Keep only the k closest (selected with argpartition), or None
+
+        Returns:
+            Tuple (ids, distances_m) sorted by distance
+        """
+        ids, distances = self._in_radius(lat, lon, radius_m)
+        order = top_k_smallest(distances, k)
+        return ids[order], distances[order]
+
+    def lookup(self, terms=(), tags=()):
+        """
+        Ids of the POIs matching any term or tag
+
+        Args:
+            terms: Words; each matches every indexed word that starts with it
+                   ("hamburguesa" finds "hamburguesas")
+            tags: (key, value) pairs such as ("amenity", "cafe")
+
+        Returns:
+            Sorted int array of POI ids
+        """
+        matches = []
+        for key, value in tags:
+            ids = self.postings.get(f"{key}={normalize_text(value)}")
+            if ids is not None:
+                matches.append(ids)
+        for term in terms:
+            for token in tokenize(term):
+                start = bisect.bisect_left(self.vocabulary, token)
+                for word in self.vocabulary[start:]:
+                    if not word.startswith(token):
+                        break
+                    if '=' not in word:
+                        matches.append(self.postings[word])
+        if not matches:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(matches))
+
+    def search(self, lat, lon, radius_m, terms=(), tags=(), k=None):
+        """
+        POIs near (lat, lon) that match any term or tag
+
+        Without terms and tags every POI in the radius is returned.
+
+        Args:
+            k: Keep only the k closest matches, or None
+
+        Returns:
+            Tuple (ids, distances_m) sorted by distance
+        """
+        ids, distances = self._in_radius(lat, lon, radius_m)
+        if terms or tags:
+            keep = np.isin(ids, self.lookup(terms, tags))
+            ids, distances = ids[keep], distances[keep]
+        order = top_k_smallest(distances, k)
+        return ids[order], distances[order]
+
+    def gram_overlap(self, text):
+        """
+        Number of distinct n-grams of `text` shared with each POI name
+
+        Returns:
+            Tuple (overlap int array over all POIs, number of n-grams of text)
+        """
+        grams = ngrams(text)
+        matches = [self.gram_postings[g] for g in grams if g in self.gram_postings]
+        if not matches:
+            return np.zeros(len(self), dtype=np.int64), len(grams)
+        return np.bincount(np.concatenate(matches), minlength=len(self)), len(grams)
+
+    def fuzzy_scores(self, text, ids, overlap=None):
+        """
+        Fuzzy similarity (0-100) between `text` and the names of `ids`
+
+        Uses rapidfuzz's batch partial_ratio when it is installed; otherwise
+        the share of the n-grams of `text` found in each name, which also
+        rewards partial matches.
+        """
+        if _rapid_process is not None:
+            names = self.fields['name'][ids].tolist()
+            return _rapid_process.cdist([text], names, scorer=_rapid_fuzz.partial_ratio, workers=-1)[0]
+        if overlap is None:
+            overlap = self.gram_overlap(text)
+        shared, total = overlap
+        return np.round(100 * shared[ids] / total)
+
+    def score(self, busqueda, ids, overlap=None):
+        """
+        Relevance of each POI in `ids` for a search, computed for all at once
+
+        Same rules as calcular_puntuacion (capped at 100) plus half the fuzzy
+        similarity of the name, like buscar_lugares_cercanos.
+
+        Returns:
+            float array aligned with ids
+        """
+        termino = normalize_text(busqueda).strip()
+        palabras = [p for p in re.split(r'[\s,]+', termino) if len(p) > 2]
+        fields = {key: values[ids] for key, values in self.fields.items()}
+        name = fields['name']
+
+        score = np.where(name == termino, 100, np.where(_contains(name, termino), 80, 0))
+        for palabra in palabras:
+            score = score + 40 * _contains(name, palabra)
+        score = score + 70 * _contains(fields['brand'], termino)
+        score = score + 60 * _contains(fields['cuisine'], termino)
+        shop_words = np.zeros(len(ids), dtype=bool)
+        for palabra in palabras:
+            shop_words |= _contains(fields['shop'], palabra)
+        score = score + np.where(_contains(fields['shop'], termino), 50, np.where(shop_words, 30, 0))
+        score = score + 40 * _contains(fields['amenity'], termino)
+        score = score + 30 * _contains(fields['description'], termino)
+
+        fuzzy = self.fuzzy_scores(termino, ids, overlap)
+        return np.minimum(score, 100) + np.floor(fuzzy / 2)
+
+    def rank(self, busqueda, lat, lon, radius_m, k=None, tags=(), min_overlap=0.5):
+        """
+        Top-k POIs near (lat, lon) for a free-text search
+
+        Candidates in the radius are prefiltered with the n-gram index (names
+        sharing at least `min_overlap` of the search n-grams) and the inverted
+        index (words and tags), then scored in bulk with score().
+
+        Args:
+            busqueda: Search text
+            k: Number of results, or None for every POI with a positive score
+            tags: (key, value) pairs that also select candidates
+            min_overlap: Minimum share of the search n-grams found in a name
+
+        Returns:
+            Tuple (ids, scores, distances_m) ordered by score and distance
+        """
+        termino = normalize_text(busqueda).strip()
+        ids, distances = self._in_radius(lat, lon, radius_m)
+        if not termino or not len(ids):
+            return ids[:0], np.empty(0), distances[:0]
+
+        overlap = self.gram_overlap(termino)
+        shared, total = overlap
+        keep = (shared[ids] >= min_overlap * total) | np.isin(ids, self.lookup([termino], tags))
+        ids, distances = ids[keep], distances[keep]
+
+        scores = self.score(termino, ids, overlap)
+        positive = scores > 0
+        ids, scores, distances = ids[positive], scores[positive], distances[positive]
+        # Clave única (puntuación, distancia) para elegir el top-k con argpartition
+        key = -scores * (radius_m + 1) + distances
+        order = top_k_smallest(key, k)
+        return ids[order], scores[order], distances[order]
+
+    def elements(self, ids):
+        """Overpass-style node dicts for the given POI ids"""
+        return [
+            {'type': 'node', 'lat': float(self.lat[i]), 'lon': float(self.lon[i]), 'tags': self.tags[i]}
+            for i in ids
+        ]
+
+
+SYNTHETIC_NAMES = (
+    'Tacos El Güero', 'Taquería Los Parados', 'Pizzería Roma', 'Hamburguesas Al Carbón', 'Café Tacuba',
+    'Farmacia Guadalajara', 'Oxxo', 'Librería Gandhi', 'Sushi Itto', 'Tortas Ahogadas', 'Panadería La Ideal',
+    'Ferretería El Clavo', 'Florería Xochimilco', 'Cantina La Ópera', 'Super Soriana',
+)
+SYNTHETIC_TAGS = (
+    {'amenity': 'restaurant', 'cuisine': 'mexican'}, {'amenity': 'restaurant', 'cuisine': 'pizza'},
+    {'amenity': 'fast_food', 'cuisine': 'burger'}, {'amenity': 'cafe'}, {'amenity': 'pharmacy'},
+    {'shop': 'convenience'}, {'shop': 'books'}, {'amenity': 'restaurant', 'cuisine': 'japanese'},
+    {'shop': 'bakery'}, {'shop': 'hardware'}, {'shop': 'florist'}, {'amenity': 'bar'}, {'shop': 'supermarket'},
+)
+BENCH_QUERIES = ('tacos', 'hamburguesa', 'pizzeria roma', 'farmacia', 'cafe', 'libreria gandhi', 'ferreteria')
+
+
+def synthetic_pois(n_pois, center=(19.4326, -99.1332), spread_deg=0.1, seed=0):
+    """Random POIs around `center` as (lat, lon, tags) tuples, for benchmarks"""
+    rng = np.random.default_rng(seed)
+    lat = center[0] + rng.uniform(-spread_deg, spread_deg, n_pois)
+    lon = center[1] + rng.uniform(-spread_deg, spread_deg, n_pois)
+    names = rng.integers(len(SYNTHETIC_NAMES), size=n_pois)
+    kinds = rng.integers(len(SYNTHETIC_TAGS), size=n_pois)
+    for i in range(n_pois):
+        tags = dict(SYNTHETIC_TAGS[kinds[i]], name=f"{SYNTHETIC_NAMES[names[i]]} {i}")
+        yield float(lat[i]), float(lon[i]), tags
+
+
+def benchmark_rank(index, lat, lon, radius_m, queries=BENCH_QUERIES, k=10, repeat=5):
+    """
+    Time rank() for each query
+
+    Returns:
+        List of dicts with query, candidates in the radius, candidates kept by
+        the prefilter and the median time in ms
+    """
+    near_ids, _ = index._in_radius(lat, lon, radius_m)
+    records = []
+    for query in queries:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            ids, _, _ = index.rank(query, lat, lon, radius_m, k=k)
+            times.append((time.perf_counter() - start) * 1000)
+        termino = normalize_text(query)
+        shared, total = index.gram_overlap(termino)
+        kept = int(((shared[near_ids] >= 0.5 * total) | np.isin(near_ids, index.lookup([termino]))).sum())
+        records.append({'query': query, 'in_radius': len(near_ids), 'kept': kept, 'ms': float(np.median(times))})
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Construye el índice local de POI a partir de un extracto OSM')
+    parser.add_argument('source', nargs='?', help='JSON de Overpass o GeoJSON con etiquetas OSM')
+    parser.add_argument('--out', help='Archivo JSON donde guardar el índice')
+    parser.add_argument('--synthetic', type=int, metavar='N', help='Usar N POI sintéticos en lugar de un extracto')
+    parser.add_argument('--query', help='Búsqueda de prueba')
+    parser.add_argument('--lat', type=float, default=19.4326)
+    parser.add_argument('--lon', type=float, default=-99.1332)
+    parser.add_argument('--radius', type=float, default=1000, help='Radio en metros')
+    parser.add_argument('--top', type=int, default=10, help='Resultados mostrados de --query')
+    parser.add_argument('--bench', action='store_true', help='Medir rank() con varias búsquedas')
+    args = parser.parse_args()
+    if not args.source and not args.synthetic:
+        parser.error('Indica un extracto OSM o --synthetic N')
+
+    start = time.perf_counter()
+    if args.synthetic:
+        index = POIIndex.from_elements(synthetic_pois(args.synthetic))
+    elif args.source.endswith(('.geojson', '.geojsonseq')):
+        index = POIIndex.from_elements(elements_from_geojson(args.source))
+    else:
+        index = POIIndex.load(args.source)
+    print(f"{len(index)} POI indexados en {time.perf_counter() - start:.2f} s")
+    if args.out:
+        index.save(args.out)
+        print(f"Índice guardado en {args.out}")
+
+    if args.query:
+        start = time.perf_counter()
+        ids, scores, distances = index.rank(args.query, args.lat, args.lon, args.radius, k=args.top)
+        print(f"Top {len(ids)} en {(time.perf_counter() - start) * 1000:.2f} ms")
+        for i, score, distance in zip(ids, scores, distances):
+            print(f"  {index.tags[i].get('name', 'Sin nombre')} (puntuación {score:.0f}, {distance:.0f} m)")
+
+    if args.bench:
+        matcher = 'rapidfuzz' if _rapid_process is not None else 'n-gramas'
+        print(f"rank() con radio {args.radius:.0f} m (similitud: {matcher})")
+        for record in benchmark_rank(index, args.lat, args.lon, args.radius, k=args.top):
+            print(f"  {record['query']:<16} {record['kept']:>6}/{record['in_radius']} candidatos  "
+                  f"{record['ms']:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Ruta segura al punto de interés (POI) más cercano
+
+En lugar de calcular una ruta por cada candidato, los POI que coinciden con
+la búsqueda se asignan a su nodo más cercano del grafo y se lanza una sola
+búsqueda uno-a-muchos sobre el grafo ponderado por riesgo desde el nodo del
+usuario. La búsqueda se detiene al asentar los nodos de los k primeros POI,
+así que los resultados salen ya ordenados por el coste de la ruta segura.
+"""
+import heapq
+import math
+
+from instrumentation import stage, count
+
+
+# Un POI a más de esta distancia de cualquier nodo del grafo no es alcanzable a pie
+MAX_SNAP_M = 150
+
+
+def _multi_target_search(indptr, adj, heads, weights, lengths, source, targets, k, max_length):
+    """
+    Dijkstra from `source` that stops once k target nodes are settled
+
+    Paths longer than `max_length` meters are not extended, which bounds the
+    search to the walking radius. Each node keeps a single label, the
+    cheapest one, and the pruning uses that label's walked length; this
+    approximates the resource-constrained problem. A node reachable within
+    `max_length` only by a costlier but shorter path is pruned, so a POI near
+    the edge of the radius whose safest approach is long can be missed.
+
+    Args:
+        targets: Dict node -> number of POIs snapped to it
+
+    Returns:
+        Tuple (dist, pred, found) with found the target nodes in settle order
+    """
+    dist = {source: 0.0}
+    walked = {source: 0.0}
+    pred = {}
+    settled = set()
+    found = []
+    n_found = 0
+    heap = [(0.0, source)]
+
+    while heap:
+        d, node = heapq.heappop(heap)
+        if node in settled:
+            continue
+        settled.add(node)
+        if node in targets:
+            found.append(node)
+            n_found += targets[node]
+            if n_found >= k:
+                break
+
+        for e in adj[indptr[node]:indptr[node + 1]]:
+            head = heads[e]
+            length = walked[node] + lengths[e]
+            if length > max_length:
+                continue
+            nd = d + weights[e]
+            if nd < dist.get(head, math.inf):
+                dist[head] = nd
+                walked[head] = length
+                pred[head] = e
+                heapq.heappush(heap, (nd, head))
+
+    count('nodes_settled', len(settled))
+    return dist, pred, found
+
+
+def _pred_path(pred, arrays, source, node):
+    edges = []
+    while node != source:
+        e = pred[node]
+        edges.append(e)
+        node = int(arrays.u[e])
+    edges.reverse()
+    return edges
+
+
+def safest_pois(model, poi_index, origin, busqueda=None, tags=(), k=3, radius_m=1000, hour=None,
+                crime_profile=None, strategy='log', max_snap_m=MAX_SNAP_M):
+    """
+    The k matching POIs with the safest walking route from `origin`
+
+    Args:
+        model: risk_model.RiskModel
+        poi_index: poi_index.POIIndex
+        origin: (lat, lon) of the user
+        busqueda: Free-text search ranked with POIIndex.rank; if None, every
+                  POI matching `tags` is a candidate
+        tags: (key, value) pairs such as ("amenity", "pharmacy")
+        k: Number of POIs
+        radius_m: Maximum walking distance in meters, applied to the safest
+                  path found to each node (see _multi_target_search)
+        hour, crime_profile, strategy: As in RiskModel.edge_costs
+        max_snap_m: POIs farther than this from the graph are ignored
+
+    Returns:
+        List of (poi_id, risk_model.Route) ordered by safe-path cost
+    """
+    arrays = model.arrays
+    with stage('poi_candidates'):
+        if busqueda:
+            ids, _, _ = poi_index.rank(busqueda, origin[0], origin[1], radius_m, tags=tags)
+        else:
+            ids, _ = poi_index.search(origin[0], origin[1], radius_m, tags=tags)
+        count('poi_candidates', len(ids))
+    if not len(ids):
+        return []
+
+    with stage('nearest_nodes'):
+        source = arrays.nearest_node(origin[0], origin[1])
+        nodes, snap = arrays.nearest_nodes(poi_index.lat[ids], poi_index.lon[ids])
+        reachable = snap <= max_snap_m
+        ids, nodes = ids[reachable], nodes[reachable]
+        pois_at = {}
+        for poi, node in zip(ids.tolist(), nodes.tolist()):
+            pois_at.setdefault(node, []).append(poi)
+
+    with stage('edge_costs'):
+        costs = model.edge_cost_list(hour, crime_profile, strategy)
+        risk = model.edge_risk(hour, crime_profile)
+
+    with stage('dijkstra'):
+        indptr, adj, heads = arrays.adjacency_lists()
+        targets = {node: len(pois) for node, pois in pois_at.items()}
+        dist, pred, found = _multi_target_search(indptr, adj, heads, costs, arrays.length_list(),
+                                                 source, targets, k, radius_m)
+
+    results = []
+    with stage('build_routes'):
+        for node in found:
+            route = model.build_route(source, _pred_path(pred, arrays, source, node), risk, cost=dist[node])
+            for poi in pois_at[node]:
+                results.append((poi, route))
+    count('pois_found', len(results[:k]))
+    return results[:k]
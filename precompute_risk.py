@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Precálculo en paralelo de las intersecciones arista-buffer de toda la ciudad
+
+Es el paso más caro de RiskModel.from_graph. Las aristas se reparten en
+teselas espaciales y cada tesela se cruza con los buffers de su entorno en un
+pool de procesos (risk_model.parallel_edge_buffer_pairs). El resultado se
+ordena por (arista, buffer), así que es idéntico con cualquier número de
+procesos, y se guarda en un .npz con una huella del grafo y de los buffers;
+RiskModel.from_graph(pairs=...) lo reutiliza y lo rechaza si no coinciden.
+
+Uso:
+    python precompute_risk.py --graph cache_MexicoCity_walk.graphml --crimes crime_buffers.geojson \\
+        --workers 4 --out edge_buffer_pairs.npz
+    # Escalado con 1/2/4/8 procesos sobre el grafo sintético
+    python precompute_risk.py --synthetic --scaling 1 2 4 8
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from graph_arrays import GraphArrays
+from risk_model import edge_buffer_pairs, pairs_fingerprint, parallel_edge_buffer_pairs
+
+
+def save_pairs(path, pairs, fingerprint):
+    """
+    Save the pairs with the pairs_fingerprint of the graph and buffers they come from
+
+    RiskModel.from_graph refuses them later if the graph or the buffers changed.
+    """
+    edge_idx, buffer_idx = pairs
+    np.savez_compressed(path, edge_idx=edge_idx, buffer_idx=buffer_idx, **fingerprint)
+
+
+def load_pairs(path):
+    """(edge_idx, buffer_idx, fingerprint) saved by this script, for RiskModel.from_graph(pairs=...)"""
+    with np.load(path) as data:
+        if 'edge_checksum' not in data:
+            raise ValueError(f"{path} no guarda la huella del grafo y los buffers; vuelve a generarlo")
+        fingerprint = {
+            'n_edges': int(data['n_edges']),
+            'n_buffers': int(data['n_buffers']),
+            'edge_checksum': str(data['edge_checksum']),
+            'buffer_checksum': str(data['buffer_checksum']),
+        }
+        return data['edge_idx'], data['buffer_idx'], fingerprint
+
+
+def measure_scaling(arrays, buffer_gdf, worker_counts, mode='process', repeat=3):
+    """
+    Time parallel_edge_buffer_pairs for each worker count
+
+    Every run is checked against the single-query result.
+
+    Returns:
+        List of dicts with workers, best time in seconds, speedup over the
+        sequential edge_buffer_pairs and the CPUs of the machine
+    """
+    start = time.perf_counter()
+    reference = edge_buffer_pairs(arrays, buffer_gdf)
+    sequential = time.perf_counter() - start
+    order = np.lexsort((reference[1], reference[0]))
+    reference = (reference[0][order], reference[1][order])
+
+    cpus = os.cpu_count()
+    records = [{'workers': 0, 'seconds': sequential, 'speedup': 1.0, 'cpus': cpus}]
+    for workers in worker_counts:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            pairs = parallel_edge_buffer_pairs(arrays, buffer_gdf, workers, mode=mode)
+            times.append(time.perf_counter() - start)
+        if not (np.array_equal(pairs[0], reference[0]) and np.array_equal(pairs[1], reference[1])):
+            raise RuntimeError(f"Resultado distinto con {workers} procesos")
+        best = min(times)
+        records.append({'workers': workers, 'seconds': best, 'speedup': sequential / best, 'cpus': cpus})
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Precálculo paralelo de intersecciones arista-buffer')
+    parser.add_argument('--graph', help='Archivo GraphML con la red peatonal')
+    parser.add_argument('--crimes', help='GeoJSON con los buffers de crimen')
+    parser.add_argument('--synthetic', action='store_true', help='Usar el grafo y los delitos sintéticos de benchmark.py')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Procesos del pool')
+    parser.add_argument('--mode', choices=('process', 'thread'), default='process')
+    parser.add_argument('--scaling', type=int, nargs='+', metavar='N', help='Medir el escalado con N procesos')
+    parser.add_argument('--out', default='edge_buffer_pairs.npz', help='Archivo .npz de salida')
+    args = parser.parse_args()
+
+    if args.synthetic or not args.graph:
+        from benchmark import synthetic_grid_graph, synthetic_crime_buffers
+        graph = synthetic_grid_graph(radius_km=10, spacing_m=100)
+        crime_buffers = synthetic_crime_buffers(graph, n_crimes=50000)
+    else:
+        import geopandas as gpd
+        import osmnx as ox
+        graph = ox.load_graphml(args.graph)
+        crime_buffers = gpd.read_file(args.crimes)
+
+    arrays = GraphArrays.from_graph(graph)
+    arrays.edge_geometries()
+    print(f"{arrays.n_edges} aristas, {len(crime_buffers)} buffers, {os.cpu_count()} CPU")
+
+    if args.scaling:
+        for record in measure_scaling(arrays, crime_buffers, args.scaling, args.mode):
+            label = 'secuencial' if record['workers'] == 0 else f"{record['workers']} workers"
+            # Con más procesos que CPU la cifra mide el reparto, no la aceleración
+            note = '  (más procesos que CPU)' if record['workers'] > record['cpus'] else ''
+            print(f"  {label:<12} {record['seconds']:.2f} s  x{record['speedup']:.2f}  {record['cpus']} CPU{note}")
+        return
+
+    start = time.perf_counter()
+    pairs = parallel_edge_buffer_pairs(arrays, crime_buffers, args.workers, mode=args.mode)
+    print(f"{len(pairs[0])} pares en {time.perf_counter() - start:.2f} s con {args.workers} procesos")
+    save_pairs(args.out, pairs, pairs_fingerprint(arrays, crime_buffers))
+    print(f"Pares guardados en {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,16 @@ from math import radians, sin, cos, sqrt, atan2
 from geopy.distance import geodesic
 import geocoder
 import re
+import os
+import sys
+import numpy as np
 
 from fuzzywuzzy import fuzz
 
+# geodesy.py está en la raíz del repositorio, un nivel por encima de este script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from geodesy import haversine_m, top_k_smallest
+
 def calcular_puntuacion_fuzzy(nombre, busqueda):
     """
     Calcula una puntuación basada en coincidencias aproximadas usando Fuzzy Matching.
@@ -38,26 +45,19 @@ def determinar_tipo_lugar(tags):
         elif tags["cuisine"] == "chinese":
             return "Restaurante Chino"
 
-def buscar_lugares_cercanos(busqueda, lat, lon, radio=5000):
+def consultar_overpass(categorias, lat, lon, radio):
     """
-    Busca lugares cercanos usando la API de Overpass (OpenStreetMap) con filtros mejorados
+    Descarga de la API de Overpass los lugares alrededor de un punto
     
     Args:
-        busqueda (str): Término de búsqueda (restaurante, tienda, producto, etc.)
+        categorias (list): Categorías devueltas por identificar_categorias
         lat (float): Latitud de la ubicación
         lon (float): Longitud de la ubicación
         radio (int): Radio de búsqueda en metros
         
     Returns:
-        list: Lista de lugares encontrados ordenados por distancia
+        dict: Respuesta JSON de Overpass ({"elements": [...]})
     """
-    # Convertimos la búsqueda a minúsculas para hacer la comparación insensible a mayúsculas
-    termino_busqueda = busqueda.lower()
-    palabras_clave = re.split(r'[\s,]+', termino_busqueda)  # Dividir en palabras clave
-    
-    # Categorías y tags para buscar
-    categorias = identificar_categorias(termino_busqueda)
-    
     # Construimos la consulta Overpass más completa
     overpass_query = f"""
     [out:json][timeout:25];
@@ -124,22 +124,57 @@ def buscar_lugares_cercanos(busqueda, lat, lon, radio=5000):
     # URL de la API de Overpass
     overpass_url = "https://overpass-api.de/api/interpreter"
     
-    try:
-        # Realizar la consulta a la API
-        response = requests.post(
-            overpass_url, 
-            data={"data": overpass_query},
-            headers={"Content-Type": "application/x-www-form-urlencoded"}
-        )
+    # Realizar la consulta a la API
+    response = requests.post(
+        overpass_url, 
+        data={"data": overpass_query},
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    
+    response.raise_for_status()  # Lanzar excepción si hay error HTTP
+    return response.json()
+
+def buscar_lugares_cercanos(busqueda, lat, lon, radio=5000, indice=None, limite=None):
+    """
+    Busca lugares cercanos de OpenStreetMap (API de Overpass o índice local) con filtros mejorados
+    
+    Args:
+        busqueda (str): Término de búsqueda (restaurante, tienda, producto, etc.)
+        lat (float): Latitud de la ubicación
+        lon (float): Longitud de la ubicación
+        radio (int): Radio de búsqueda en metros
+        indice (POIIndex): Índice local de POI (poi_index.py); si se indica
+            se usa en lugar de la API de Overpass
+        limite (int): Número máximo de lugares devueltos (None para todos)
         
-        response.raise_for_status()  # Lanzar excepción si hay error HTTP
-        data = response.json()
+    Returns:
+        list: Lista de lugares encontrados ordenados por puntuación y distancia
+    """
+    # Convertimos la búsqueda a minúsculas para hacer la comparación insensible a mayúsculas
+    termino_busqueda = busqueda.lower()
+    palabras_clave = re.split(r'[\s,]+', termino_busqueda)  # Dividir en palabras clave
+    
+    # Categorías y tags para buscar
+    categorias = identificar_categorias(termino_busqueda)
+    
+    if indice is not None:
+        # Índice local (poi_index.POIIndex): sin llamada a Overpass y puntuación en bloque
+        etiquetas = [(c["key"], c["value"]) for c in categorias if c["key"] != "name"]
+        ids, puntuaciones, distancias = indice.rank(termino_busqueda, lat, lon, radio, k=limite, tags=etiquetas)
+        return [
+            crear_resultado(indice.tags[i], float(indice.lat[i]), float(indice.lon[i]),
+                            round(float(d) / 1000, 3), float(p))
+            for i, p, d in zip(ids, puntuaciones, distancias)
+        ]
+    
+    try:
+        data = consultar_overpass(categorias, lat, lon, radio)
 
         '''import pprint
         pprint.pprint(data)'''
         
         # Filtrar los resultados según el término de búsqueda con un algoritmo de puntuación
-        resultados = []
+        candidatos = []
         for elemento in data.get("elements", []):
             tags = elemento.get("tags", {})
             
@@ -180,33 +215,22 @@ def buscar_lugares_cercanos(busqueda, lat, lon, radio=5000):
                 else:
                     continue  # Saltar si no podemos determinar coordenadas
                 
-                # Calcular distancia
-                distancia = calcular_distancia(lat, lon, lugar_lat, lugar_lon)
-                
-                # Determinar el tipo de lugar para mostrar
-                tipo_mostrar = determinar_tipo_lugar(tags)
-                
-                resultados.append({
-                "nombre": tags.get("name", "Sin nombre"),
-                "marca": tags.get("brand", "Desconocida"),
-                "tipo_lugar": determinar_tipo_lugar(tags),
-                "horarios": tags.get("opening_hours", "Horario no disponible"),
-                "teléfono": tags.get("phone", "No disponible"),
-                "web": tags.get("website", "No disponible"),
-                "reseñas_count": tags.get("review:count", "0"),  # Número de reseñas
-                "calificación": tags.get("review:rating", "No disponible"),  # Calificación promedio
-                "dirección": obtener_direccion(tags),
-                "latitud": lugar_lat,
-                "longitud": lugar_lon,
-                "distancia": distancia,
-                "puntuacion": puntuacion,
-                "tags": tags  # Guardar todos los tags para depuración
-            })
+                candidatos.append((tags, lugar_lat, lugar_lon, puntuacion))
 
+        if not candidatos:
+            return []
         
-        # Ordenar por puntuación (primero) y distancia (segundo criterio)
-        resultados.sort(key=lambda x: (-x["puntuacion"], x["distancia"]))
-        return resultados
+        # Distancias de todos los candidatos en una sola llamada (en km)
+        tags_lst, lats, lons, puntuaciones = zip(*candidatos)
+        distancias = np.round(haversine_m(lat, lon, np.array(lats, dtype=float), np.array(lons, dtype=float)) / 1000, 3)
+        puntuaciones = np.array(puntuaciones, dtype=float)
+        
+        # Ordenar por puntuación (primero) y distancia (segundo criterio), solo los `limite` primeros
+        orden = top_k_smallest(-puntuaciones * (distancias.max() + 1) + distancias, limite)
+        return [
+            crear_resultado(tags_lst[i], lats[i], lons[i], float(distancias[i]), puntuaciones[i])
+            for i in orden
+        ]
         
     except requests.exceptions.RequestException as e:
         print(f"Error al realizar la solicitud: {e}")
@@ -215,6 +239,36 @@ def buscar_lugares_cercanos(busqueda, lat, lon, radio=5000):
         print(f"Error general: {e}")
         return []
 
+def crear_resultado(tags, lugar_lat, lugar_lon, distancia, puntuacion):
+    """
+    Diccionario con la información de un lugar encontrado
+    
+    Args:
+        tags (dict): Tags OSM del lugar
+        lugar_lat, lugar_lon: Coordenadas del lugar
+        distancia (float): Distancia en kilómetros
+        puntuacion (float): Puntuación de relevancia
+    
+    Returns:
+        dict: Lugar con nombre, marca, horarios, dirección, distancia, etc.
+    """
+    return {
+        "nombre": tags.get("name", "Sin nombre"),
+        "marca": tags.get("brand", "Desconocida"),
+        "tipo_lugar": determinar_tipo_lugar(tags),
+        "horarios": tags.get("opening_hours", "Horario no disponible"),
+        "teléfono": tags.get("phone", "No disponible"),
+        "web": tags.get("website", "No disponible"),
+        "reseñas_count": tags.get("review:count", "0"),  # Número de reseñas
+        "calificación": tags.get("review:rating", "No disponible"),  # Calificación promedio
+        "dirección": obtener_direccion(tags),
+        "latitud": lugar_lat,
+        "longitud": lugar_lon,
+        "distancia": distancia,
+        "puntuacion": puntuacion,
+        "tags": tags  # Guardar todos los tags para depuración
+    }
+
 def calcular_puntuacion(nombre, cuisine, tipo_tienda, amenity, description, brand, palabras_clave, termino_busqueda):
     """
     Calcula una puntuación de relevancia para el lugar
@@ -420,7 +474,7 @@ def buscar_con_ubicacion_actual(busqueda, radio=1000):
     
     return buscar_lugares_cercanos(busqueda, lat, lon, radio)
 
-def buscar_con_coordenadas(busqueda, lat, lon, radio=5000):
+def buscar_con_coordenadas(busqueda, lat, lon, radio=5000, indice=None):
     """
     Busca lugares cercanos a unas coordenadas específicas
     
@@ -429,11 +483,12 @@ def buscar_con_coordenadas(busqueda, lat, lon, radio=5000):
         lat (float): Latitud
         lon (float): Longitud
         radio (int): Radio de búsqueda en metros
+        indice (POIIndex): Índice local de POI opcional
         
     Returns:
         list: Lista de lugares encontrados
     """
-    return buscar_lugares_cercanos(busqueda, lat, lon, radio)
+    return buscar_lugares_cercanos(busqueda, lat, lon, radio, indice)
 
 # Ejemplo de uso
 if __name__ == "__main__":
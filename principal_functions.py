@@ -1,27 +1,45 @@
-from rtree import index
-import pandas as pd
 import numpy as np
-import geopandas as gpd
 from shapely import LineString
 from shapely.geometry import Point
-import osmnx as ox
 from shapely.geometry import Polygon
-import networkx as nx
-import folium
 import math
+import logging
+import os
+import shapely
+
+from instrumentation import trace_route, stage, count, current_trace
+from lazy_imports import lazy_module
+from geodesy import nearest
+from risk_model import normalize_time_zone, time_zone_center
+from alternatives import plateau_alternatives
+from poi_routing import safest_pois
+
+
+logger = logging.getLogger(__name__)
+
+# Dependencias pesadas que solo usan algunas funciones: se importan en el primer uso
+index = lazy_module('rtree.index')
+pd = lazy_module('pandas')
+gpd = lazy_module('geopandas')
+ox = lazy_module('osmnx')
+nx = lazy_module('networkx')
+folium = lazy_module('folium')
 
 
 """def load_crimes_geojson(file_path):
     return gpd.read_file(file_path)
 
 buffer = load_crimes_geojson('crimes.geojson')"""
-def get_intersecting_crimes(route_coords, crime_buffers_gdf):
+def get_intersecting_crimes(route_coords, crime_buffers_gdf, merged=False):
     """
     Find crime buffers that intersect with a route
     
     Args:
         route_coords: List of coordinate tuples [(lat, lon), ...]
         crime_buffers_gdf: GeoDataFrame with crime buffer data
+        merged: crime_buffers_gdf is a dissolved risk layer
+                (crime_pipeline.dissolve_risk_buffers); the crimes of the
+                buffers behind the touched polygons are reported once each
     
     Returns:
         List of crime records that intersect with the route
@@ -31,18 +49,61 @@ def get_intersecting_crimes(route_coords, crime_buffers_gdf):
     route_points = [(lon, lat) for lat, lon in route_coords]
     route_line = LineString(route_points)
     
-    # Find intersecting crime buffers
-    intersecting_buffers = crime_buffers_gdf[crime_buffers_gdf.intersects(route_line)]
+    # Find intersecting crime buffers (the spatial index is cached on the GeoDataFrame)
+    hits = crime_buffers_gdf.sindex.query(route_line, predicate='intersects')
+    intersecting_buffers = crime_buffers_gdf.iloc[sorted(hits)]
     # Return the relevant crime information
     crime_list = []
+    if merged:
+        # Un buffer repartido en varios polígonos a lo largo de la ruta cuenta una vez
+        delitos = {}
+        for _, polygon in intersecting_buffers.iterrows():
+            if 'buffer_delitos' in polygon:
+                delitos.update(zip(_merged_values(polygon['buffer_ids'], int),
+                                   _merged_values(polygon['buffer_delitos'], str)))
+        return [delitos[buffer_id] for buffer_id in sorted(delitos)]
     for _, crime in intersecting_buffers.iterrows():
-
-        print(crime.head())
         if 'delito' in crime:
             crime_list.append(crime['delito'])
     
     return crime_list
 
+def _merged_values(values, cast):
+    """Tuple column of a dissolved risk layer, also when read back from GeoJSON as 'a,b,c'"""
+    if isinstance(values, str):
+        return [cast(value) for value in values.split(',')] if values else []
+    return [cast(value) for value in values]
+
+# Centroides de los buffers por GeoDataFrame: (gdf, lat, lon)
+_CRIME_CENTROIDS = {}
+
+def get_nearest_crimes(point, crime_buffers_gdf, k=10, max_distance_m=None):
+    """
+    Crimes closest to a point
+
+    Distances to every buffer centroid are computed in one NumPy call and
+    the k closest are selected with argpartition (geodesy.nearest).
+
+    Args:
+        point: (lat, lon) tuple
+        crime_buffers_gdf: GeoDataFrame with crime buffer data
+        k: Number of crimes to return
+        max_distance_m: Ignore crimes farther than this
+
+    Returns:
+        List of (delito, distance_m) tuples ordered by distance
+    """
+    cached = _CRIME_CENTROIDS.get(id(crime_buffers_gdf))
+    if cached is None or cached[0] is not crime_buffers_gdf:
+        centroids = shapely.centroid(crime_buffers_gdf.geometry.values)
+        cached = (crime_buffers_gdf, shapely.get_y(centroids), shapely.get_x(centroids))
+        _CRIME_CENTROIDS[id(crime_buffers_gdf)] = cached
+    _, lats, lons = cached
+
+    idx, distances = nearest(point[0], point[1], lats, lons, k, max_distance_m)
+    delitos = crime_buffers_gdf['delito'].to_numpy()[idx] if 'delito' in crime_buffers_gdf else [None] * len(idx)
+    return [(delito, float(d)) for delito, d in zip(delitos, distances)]
+
 def combine_node_edge_weights(graph, node_weight_attribute='node_weight', edge_weight_attribute='edge_weight',
                              output_attribute='combined_weight', alpha=0.5):
     """
@@ -89,9 +150,39 @@ def combine_node_edge_weights(graph, node_weight_attribute='node_weight', edge_w
         # Almacenar el peso combinado
         G[u][v][key][output_attribute] = combined
 
-    print(f"Pesos combinados calculados y guardados como '{output_attribute}'")
+    count('edges_combined', G.number_of_edges())
+    logger.debug("Pesos combinados calculados y guardados como '%s'", output_attribute)
     return G
 
+def label_nodes_vectorized(graph, buffer_gdf, weight_col='weight', attribute_name='node_weight'):
+    """
+    Etiqueta los nodos del grafo con la suma de pesos de buffers que los intersectan
+    usando un único spatial join (versión vectorizada de model.ipynb)
+    
+    Args:
+        graph: Grafo de NetworkX
+        buffer_gdf: GeoDataFrame con buffers y columna de peso
+        weight_col: Nombre de la columna con pesos en buffer_gdf
+        attribute_name: Nombre del atributo a añadir a los nodos
+    
+    Returns:
+        Grafo con el atributo añadido a todos los nodos (0 si no tocan ningún buffer)
+    """
+    nodes = list(graph.nodes)
+    gdf_nodes = gpd.GeoDataFrame(
+        geometry=gpd.points_from_xy([graph.nodes[n]['x'] for n in nodes], [graph.nodes[n]['y'] for n in nodes]),
+        crs=buffer_gdf.crs
+    )
+
+    # Spatial join: una fila por cada par (nodo, buffer) que intersectan
+    joined = gpd.sjoin(gdf_nodes, buffer_gdf[[weight_col, 'geometry']], how='inner', predicate='intersects')
+    weights = np.bincount(joined.index.to_numpy(), weights=joined[weight_col].to_numpy(dtype=float),
+                          minlength=len(nodes))
+
+    nx.set_node_attributes(graph, dict(zip(nodes, weights.tolist())), name=attribute_name)
+    count('nodes_with_buffers', int(np.count_nonzero(weights)))
+    return graph
+
 def custom_weight_strategy(edge_data, node_u_data, node_v_data, buffer_weight):
     """
     Calculate custom edge weight combining length and crime risk factors
@@ -103,17 +194,17 @@ def custom_weight_strategy(edge_data, node_u_data, node_v_data, buffer_weight):
         buffer_weight: Sum of crime buffer weights intersecting the edge
     
     Returns:
-        float: Combined risk-aware weight
+        float: Risk-aware weight of the edge alone; node risk is applied
+        afterwards, only once, by combine_node_edge_weights (together they
+        are weight_strategies.exp_combine_strategy)
     """
     base_length = edge_data.get('length', 0)
-    # Average buffer weights of the connected nodes
-    node_weight = (node_u_data.get('buffer_weight', 0) + node_v_data.get('buffer_weight', 0)) / 2
 
     # Calculate combined weight - logarithmic scaling to avoid extreme values
     # Higher crime weights will increase the effective "cost" of the edge
-    return base_length * (1 + math.log(1 + node_weight + buffer_weight))
+    return base_length * (1 + math.log(1 + buffer_weight))
 
-def fast_edge_weight_calculation(graph, buffer_gdf, weight_col='weight'):
+def fast_edge_weight_calculation(graph, buffer_gdf, weight_col='weight', merged=False):
     """
     Calculate edge weights based on intersecting crime buffers using R-tree for spatial indexing
     
@@ -121,11 +212,15 @@ def fast_edge_weight_calculation(graph, buffer_gdf, weight_col='weight'):
         graph: NetworkX graph
         buffer_gdf: GeoDataFrame with crime buffers
         weight_col: Name of the weight column in buffer_gdf
+        merged: buffer_gdf is a dissolved risk layer
+                (crime_pipeline.dissolve_risk_buffers); the buffers behind
+                the touched polygons are deduplicated by buffer_ids, so each
+                adds its weight and count once
     
     Returns:
         NetworkX graph with updated edge attributes
     """
-    print(f"Processing {len(graph.edges())} edges against {len(buffer_gdf)} buffers...")
+    logger.debug("Processing %d edges against %d buffers...", len(graph.edges()), len(buffer_gdf))
 
     # Create spatial index for buffers
     buffer_idx = index.Index()
@@ -134,11 +229,16 @@ def fast_edge_weight_calculation(graph, buffer_gdf, weight_col='weight'):
     # Populate the R-tree index
     for i, (_, row) in enumerate(buffer_gdf.iterrows()):
         buffer_idx.insert(i, row.geometry.bounds)
-        buffer_data.append((row.geometry, row[weight_col]))
+        if merged:
+            buffers = dict(zip(_merged_values(row['buffer_ids'], int), _merged_values(row['buffer_weights'], float)))
+        else:
+            buffers = {i: row[weight_col]}
+        buffer_data.append((row.geometry, buffers))
 
     # Process each edge
     edge_count = 0
     edges_with_buffers = 0
+    candidate_count = 0
 
     for u, v, k, data in graph.edges(data=True, keys=True):
         edge_count += 1
@@ -153,15 +253,16 @@ def fast_edge_weight_calculation(graph, buffer_gdf, weight_col='weight'):
 
         # Find potential buffer intersections using R-tree
         buffer_ids = list(buffer_idx.intersection(line.bounds))
-        total_buffer_weight = 0
-        buffer_count = 0
+        candidate_count += len(buffer_ids)
+        touched = {}
 
         # Check for precise intersections
         for buf_id in buffer_ids:
-            geom, weight = buffer_data[buf_id]
+            geom, buffers = buffer_data[buf_id]
             if line.intersects(geom):
-                total_buffer_weight += weight
-                buffer_count += 1
+                touched.update(buffers)
+        total_buffer_weight = sum(touched.values())
+        buffer_count = len(touched)
 
         if buffer_count > 0:
             edges_with_buffers += 1
@@ -179,15 +280,46 @@ def fast_edge_weight_calculation(graph, buffer_gdf, weight_col='weight'):
         data['buffer_count'] = buffer_count
         data['buffer_influence'] = total_buffer_weight
 
-    print(f"Processed {edge_count} edges, {edges_with_buffers} have buffer intersections")
+    count('edges_processed', edge_count)
+    count('edges_with_buffers', edges_with_buffers)
+    count('buffer_candidates', candidate_count)
+    logger.debug("Processed %d edges, %d have buffer intersections", edge_count, edges_with_buffers)
     return graph
 
-def get_path(origin_node,destination_node,filtered_graph):
+def _counting_weight(graph, attribute):
+    """
+    Weight function equivalent to weight=attribute that counts relaxed edges
 
-    shortest_route = nx.shortest_path(filtered_graph, origin_node, destination_node, weight='length')
+    The extra Python call per relaxed edge costs about 7% per search on a
+    3 km synthetic grid, so get_path only uses it when edge counting is
+    requested explicitly (count_edges=True or SAFEROUTE_COUNT_EDGES=1).
+    """
+    if graph.is_multigraph():
+        def weight(u, v, d):
+            count('edges_relaxed')
+            return min(attr.get(attribute, 1) for attr in d.values())
+    else:
+        def weight(u, v, d):
+            count('edges_relaxed')
+            return d.get(attribute, 1)
+    return weight
+
+def get_path(origin_node,destination_node,filtered_graph, count_edges=None):
+
+    if count_edges is None:
+        count_edges = os.getenv('SAFEROUTE_COUNT_EDGES') == '1'
+    # Contar aristas solo tiene efecto dentro de una traza
+    counting = count_edges and current_trace() is not None
+    length_weight = _counting_weight(filtered_graph, 'length') if counting else 'length'
+    safe_weight = _counting_weight(filtered_graph, 'combined_weight') if counting else 'combined_weight'
+
+    with stage('shortest_path_length'):
+        shortest_route = nx.shortest_path(filtered_graph, origin_node, destination_node, weight=length_weight)
     route_coords = [(filtered_graph.nodes[node]['y'], filtered_graph.nodes[node]['x']) for node in shortest_route]
 
-    safest_route = nx.shortest_path(filtered_graph, origin_node, destination_node, weight='combined_weight')
+    with stage('shortest_path_safe'):
+        safest_route = nx.shortest_path(filtered_graph, origin_node, destination_node, weight=safe_weight)
+    count('path_nodes', len(shortest_route) + len(safest_route))
 
     safest_route_coords = [(filtered_graph.nodes[node]['y'], filtered_graph.nodes[node]['x']) for node in safest_route]
 
@@ -230,24 +362,98 @@ def crop_graph(origin, destination, graph):
     
     return subgraph
 
-def buscar_ruta(origin, destination, time, graph, buffer):
-    if time in buffer['time_zones'].unique():
-        crimes_df = buffer[buffer['time_zones'] == time]
-    else:
-        crimes_df = buffer.copy()
-
-    origin_node = ox.distance.nearest_nodes(graph, origin[1], origin[0])
-    destination_node = ox.distance.nearest_nodes(graph, destination[1], destination[0])
-
-    region = crop_graph(origin, destination, graph)
+def buscar_ruta(origin, destination, time, graph, buffer, profile=None, merged=False, hour=None,
+                risk_model=None, time_dependent=False, crime_profile=None, weight_strategy='log', metrics=False,
+                snap='edge', trees=None):
+    zone = normalize_time_zone(time)
+
+    if risk_model is not None:
+        # Riesgo precalculado por hora: sin filtrar el GeoDataFrame en cada petición
+        if hour is None and zone is not None:
+            hour = time_zone_center(zone)
+        # snap='edge': los clics se proyectan sobre la calle más cercana en vez del nodo más cercano
+        with trace_route('buscar_ruta', profile=profile, time=time, hour=hour, time_dependent=time_dependent,
+                         crime_profile=crime_profile, weight_strategy=weight_strategy, snap=snap):
+            return risk_model.route(origin, destination, hour, time_dependent, crime_profile, weight_strategy,
+                                    metrics, snap, trees)
+
+    with trace_route('buscar_ruta', profile=profile, time=time):
+        with stage('time_zone_filter'):
+            # La interfaz usa etiquetas con mayúscula ("Noche") y el clustering en minúscula
+            labels = buffer['time_zones'].map(normalize_time_zone)
+            if zone is not None and (labels == zone).any():
+                crimes_df = buffer[labels == zone]
+            else:
+                crimes_df = buffer.copy()
+        count('crime_buffers', len(crimes_df))
+
+        with stage('nearest_nodes'):
+            origin_node = ox.distance.nearest_nodes(graph, origin[1], origin[0])
+            destination_node = ox.distance.nearest_nodes(graph, destination[1], destination[0])
+
+        with stage('crop_graph'):
+            region = crop_graph(origin, destination, graph)
+        count('region_nodes', region.number_of_nodes())
+        count('region_edges', region.number_of_edges())
+
+        #route = ox.shortest_path(graph, origin_node, destination_node, weight='length')
+
+        with stage('label_nodes'):
+            region = label_nodes_vectorized(region, crimes_df)
+
+        with stage('fast_edge_weight_calculation'):
+            labeled_graph = fast_edge_weight_calculation(region, crimes_df, merged=merged)
+
+        with stage('combine_node_edge_weights'):
+            final_graph = combine_node_edge_weights(labeled_graph)
+
+        # 'combined_weight' solo existe en la copia que devuelve combine_node_edge_weights
+        return get_path(origin_node, destination_node, final_graph)
+
+def buscar_alternativas(origin, destination, time, risk_model, k=3, hour=None, crime_profile=None,
+                        weight_strategy='log', profile=None):
+    """
+    Up to k diverse safe routes from a single pair of search trees
 
-    #route = ox.shortest_path(graph, origin_node, destination_node, weight='length')
+    Args:
+        origin, destination: (lat, lon) points
+        time: Time-zone label, used when `hour` is not given
+        risk_model: risk_model.RiskModel built at startup
+        k: Maximum number of routes
 
-    labeled_graph = fast_edge_weight_calculation(region, crimes_df)
+    Returns:
+        List of risk_model.Route, safest first
+    """
+    zone = normalize_time_zone(time)
+    if hour is None and zone is not None:
+        hour = time_zone_center(zone)
+    with trace_route('buscar_alternativas', profile=profile, time=time, hour=hour, k=k):
+        return plateau_alternatives(risk_model, origin, destination, k, hour, crime_profile, weight_strategy)
+
+def buscar_poi_seguro(origin, busqueda, time, risk_model, poi_index, k=3, radius_m=1000, tags=(), hour=None,
+                      crime_profile=None, weight_strategy='log', profile=None):
+    """
+    Matching POIs ranked by the safe walking route to them, from one search
 
-    final_graph = combine_node_edge_weights(labeled_graph)
+    Args:
+        origin: (lat, lon) of the user
+        busqueda: Free-text search ("farmacia", "cafe"...), or None to use only `tags`
+        time: Time-zone label, used when `hour` is not given
+        risk_model: risk_model.RiskModel built at startup
+        poi_index: poi_index.POIIndex with the local POIs
+        k: Number of POIs
+        radius_m: Maximum walking distance in meters
+        tags: (key, value) pairs that also select POIs
 
-    return get_path(origin_node, destination_node, labeled_graph)
+    Returns:
+        List of (poi_id, risk_model.Route), safest first
+    """
+    zone = normalize_time_zone(time)
+    if hour is None and zone is not None:
+        hour = time_zone_center(zone)
+    with trace_route('buscar_poi_seguro', profile=profile, time=time, hour=hour, k=k):
+        return safest_pois(risk_model, poi_index, origin, busqueda, tags, k, radius_m, hour, crime_profile,
+                           weight_strategy)
 """
 
 
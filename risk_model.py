@@ -0,0 +1,944 @@
+"""
+Modelo de riesgo continuo en el tiempo
+
+En lugar de filtrar el GeoDataFrame de buffers por franja en cada petición,
+el riesgo de cada arista se precalcula una vez para las 24 horas del día en
+una matriz aristas x 24 (float16). Para una hora de salida concreta el peso
+se obtiene interpolando linealmente entre las dos horas más cercanas, que es
+solo indexar dos columnas de la matriz.
+"""
+import hashlib
+import heapq
+import math
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import shapely
+
+from graph_arrays import GraphArrays, dijkstra, path_edges, edges_to_nodes, snapped_shortest_path
+from instrumentation import stage, count
+from lazy_imports import lazy_module
+from polyline_codec import encode_polyline, decode_polyline
+from search_trees import SearchTree
+from weight_strategies import compute_edge_costs
+
+
+# Solo node_buffer_pairs usa geopandas (sjoin); los clientes que solo leen Route no lo cargan
+gpd = lazy_module('geopandas')
+
+
+HOURS = 24
+# Vectores de coste guardados como listas de Python (unos 32 bytes por arista cada uno)
+COST_LIST_CACHE = 4
+# Columnas horarias como listas por matriz: una búsqueda dependiente del tiempo cruza dos o tres
+HOUR_COLUMN_CACHE = 3
+
+# Semianchura en horas del núcleo triangular con el que se reparte cada delito con hora
+HOUR_KERNEL_HALF_WIDTH = 3.0
+
+# Velocidad media a pie (~4.7 km/h) para estimar la hora de llegada a cada arista
+WALKING_SPEED_MPS = 1.3
+
+# Inicio de cada franja en horas; la última llega hasta medianoche.
+# Los nombres son los de la agrupación de mainUAB.ipynb (en minúsculas).
+TIME_ZONE_STARTS = (0, 5, 10, 13, 17, 21)
+TIME_ZONES = ('madrugada', 'mañana', 'mediodia', 'tarde', 'noche', 'medianoche')
+
+
+def normalize_time_zone(label):
+    """
+    Canonical time-zone name for a UI or data label
+
+    The web UI shows capitalized labels ("Mañana", "Mediodia") while the
+    clustering produced lowercase ones; both map to the same name here.
+
+    Returns:
+        One of TIME_ZONES, or None for "Todo" and unknown labels
+    """
+    if label is None:
+        return None
+    key = str(label).strip().lower().replace('í', 'i')
+    return key if key in TIME_ZONES else None
+
+
+def time_zone_hours(zone):
+    """(start, end) hours of a time zone, end excluded"""
+    i = TIME_ZONES.index(zone)
+    end = TIME_ZONE_STARTS[i + 1] if i + 1 < len(TIME_ZONES) else HOURS
+    return TIME_ZONE_STARTS[i], end
+
+
+def time_zone_for_hour(hour):
+    """Time zone that contains `hour` (0-24)"""
+    i = int(np.searchsorted(TIME_ZONE_STARTS, hour % HOURS, side='right')) - 1
+    return TIME_ZONES[max(i, 0)]
+
+
+def time_zone_center(zone):
+    """Hour in the middle of a time zone, used when only the label is known"""
+    start, end = time_zone_hours(zone)
+    return (start + end) / 2
+
+
+def edge_buffer_pairs(arrays, buffer_gdf):
+    """
+    Every (edge, buffer) pair whose geometries intersect
+
+    A single STRtree query over all edge geometries; GEOS does the work
+    without a Python loop over edges.
+
+    Returns:
+        Tuple (edge_idx, buffer_idx) of int arrays with one entry per pair
+    """
+    tree = shapely.STRtree(buffer_gdf.geometry.to_numpy())
+    edge_idx, buffer_idx = tree.query(arrays.edge_geometries(), predicate='intersects')
+    count('edge_buffer_pairs', len(edge_idx))
+    return edge_idx, buffer_idx
+
+
+def _checksum(*columns):
+    digest = hashlib.sha1()
+    for column in columns:
+        column = np.asarray(column)
+        # Los ids no numéricos (p. ej. nodos con nombre) se resumen por su texto
+        digest.update(column.tobytes() if column.dtype.kind in 'iufb' else '\x1f'.join(map(str, column)).encode())
+    return digest.hexdigest()
+
+
+def pairs_fingerprint(arrays, buffer_gdf):
+    """
+    Identity of the edges and buffers an (edge_idx, buffer_idx) result refers to
+
+    Returns:
+        dict with n_edges, n_buffers and sha1 checksums of the edge ids
+        (u, v, key) and of the buffer index
+    """
+    nodes = np.asarray(arrays.nodes)
+    keys = arrays.keys if arrays.keys is not None else np.zeros(arrays.n_edges, dtype=np.int64)
+    return {
+        'n_edges': arrays.n_edges,
+        'n_buffers': len(buffer_gdf),
+        'edge_checksum': _checksum(nodes[arrays.u], nodes[arrays.v], keys),
+        'buffer_checksum': _checksum(buffer_gdf.index.to_numpy()),
+    }
+
+
+def check_pairs(arrays, buffer_gdf, pairs, fingerprint=None):
+    """
+    Reject edge-buffer pairs computed for a different graph or buffer set
+
+    Args:
+        pairs: Tuple (edge_idx, buffer_idx)
+        fingerprint: Optional pairs_fingerprint() saved with the pairs
+
+    Raises:
+        ValueError: If the fingerprint does not match the current graph and
+                    buffers, or an index is out of range
+    """
+    if fingerprint is not None:
+        current = pairs_fingerprint(arrays, buffer_gdf)
+        stale = [name for name, value in current.items() if fingerprint.get(name) != value]
+        if stale:
+            raise ValueError(f"Los pares arista-buffer no corresponden al grafo o a los buffers actuales "
+                             f"({', '.join(stale)} distintos); vuelve a ejecutar precompute_risk.py")
+    edge_idx, buffer_idx = pairs
+    if len(edge_idx) != len(buffer_idx):
+        raise ValueError("edge_idx y buffer_idx tienen longitudes distintas")
+    if len(edge_idx) and (edge_idx.min() < 0 or edge_idx.max() >= arrays.n_edges
+                          or buffer_idx.min() < 0 or buffer_idx.max() >= len(buffer_gdf)):
+        raise ValueError("Los pares arista-buffer tienen índices fuera del grafo o de los buffers actuales")
+
+
+def spatial_tiles(arrays, n_tiles):
+    """
+    Partition the edges into a grid of roughly n_tiles spatial tiles
+
+    Edges are assigned by the midpoint of their end nodes, so nearby edges
+    share a tile and only meet the buffers around it.
+
+    Returns:
+        List of int arrays of edge indices, one per non-empty tile, in a
+        deterministic order
+    """
+    if arrays.n_edges == 0:
+        return []
+    side = max(int(math.ceil(math.sqrt(n_tiles))), 1)
+    mid_x = (arrays.x[arrays.u] + arrays.x[arrays.v]) / 2
+    mid_y = (arrays.y[arrays.u] + arrays.y[arrays.v]) / 2
+
+    def cell(values):
+        lo, hi = values.min(), values.max()
+        return np.minimum(((values - lo) / max(hi - lo, 1e-12) * side).astype(np.int64), side - 1)
+
+    tile = cell(mid_x) * side + cell(mid_y)
+    order = np.argsort(tile, kind='stable')
+    bounds = np.flatnonzero(np.diff(tile[order])) + 1
+    return np.split(order, bounds)
+
+
+def _tile_pairs(edge_wkb, buffer_wkb, buffer_ids):
+    """
+    Intersections of one tile (runs in a worker process)
+
+    Geometries travel as WKB: pickling an array of bytes is much cheaper than
+    pickling shapely objects one by one.
+    """
+    tree = shapely.STRtree(shapely.from_wkb(buffer_wkb))
+    edge_idx, local_buffer = tree.query(shapely.from_wkb(edge_wkb), predicate='intersects')
+    return edge_idx, buffer_ids[local_buffer]
+
+
+def parallel_edge_buffer_pairs(arrays, buffer_gdf, workers=4, tiles_per_worker=4, mode='process'):
+    """
+    edge_buffer_pairs split into spatial tiles and run on a worker pool
+
+    Each tile receives only its edges and the buffers whose bounding box
+    touches the tile, so process workers get small payloads. The pairs are
+    merged and sorted by (edge, buffer), so the result does not depend on the
+    number of workers or on which tile finishes first.
+
+    Args:
+        arrays: GraphArrays of the walking graph
+        buffer_gdf: Crime buffers in the graph CRS
+        workers: Size of the pool; with 1 or fewer there is nothing to
+                 parallelize and the single STRtree query of
+                 edge_buffer_pairs is used instead of the tiles
+        tiles_per_worker: Tiles per worker, for load balancing
+        mode: 'process' (ProcessPoolExecutor) or 'thread' (ThreadPoolExecutor;
+              only helps when the GEOS calls release the GIL)
+
+    Returns:
+        Tuple (edge_idx, buffer_idx) like edge_buffer_pairs
+    """
+    if mode not in ('process', 'thread'):
+        raise ValueError(f"Modo desconocido: {mode}. Opciones: process, thread")
+    if workers <= 1:
+        # Las teselas y el paso por WKB solo compensan repartidos entre varios procesos
+        edge_idx, buffer_idx = edge_buffer_pairs(arrays, buffer_gdf)
+        order = np.lexsort((buffer_idx, edge_idx))
+        return edge_idx[order], buffer_idx[order]
+    buffers = buffer_gdf.geometry.to_numpy()
+    edges = arrays.edge_geometries()
+    tree = shapely.STRtree(buffers)
+
+    tiles = spatial_tiles(arrays, workers * tiles_per_worker)
+    jobs = []
+    for tile in tiles:
+        tile_geometries = edges[tile]
+        candidates = tree.query(shapely.box(*shapely.total_bounds(tile_geometries)))
+        candidates.sort()
+        jobs.append((shapely.to_wkb(tile_geometries), shapely.to_wkb(buffers[candidates]), candidates))
+    count('tiles', len(jobs))
+
+    pool = ProcessPoolExecutor if mode == 'process' else ThreadPoolExecutor
+    with pool(max_workers=workers) as executor:
+        results = list(executor.map(_tile_pairs, *zip(*jobs)))
+
+    edge_idx = np.concatenate([tile[e] for tile, (e, _) in zip(tiles, results)] or [np.empty(0, np.int64)])
+    buffer_idx = np.concatenate([b for _, b in results] or [np.empty(0, np.int64)])
+    order = np.lexsort((buffer_idx, edge_idx))
+    count('edge_buffer_pairs', len(edge_idx))
+    return edge_idx[order], buffer_idx[order]
+
+
+def edge_buffer_csr(n_edges, pairs):
+    """
+    Buffers touching each edge as CSR arrays (indptr, buffer_ids)
+
+    The buffers of edge e are buffer_ids[indptr[e]:indptr[e + 1]].
+    """
+    edge_idx, buffer_idx = pairs
+    order = np.argsort(edge_idx, kind='stable')
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(edge_idx, minlength=n_edges))])
+    return indptr, buffer_idx[order]
+
+
+def node_buffer_pairs(arrays, buffer_gdf):
+    """
+    Every (node, buffer) pair where the node lies in the buffer
+
+    One geopandas sjoin of all graph nodes against all buffers, the
+    vectorized labeling of model.ipynb (label_nodes_vectorized).
+
+    Returns:
+        Tuple (node_idx, buffer_idx) of int arrays with one entry per pair
+    """
+    nodes = gpd.GeoDataFrame(geometry=gpd.points_from_xy(arrays.x, arrays.y), crs=buffer_gdf.crs)
+    buffers = gpd.GeoDataFrame(geometry=buffer_gdf.geometry.to_numpy(), crs=buffer_gdf.crs)
+    joined = gpd.sjoin(nodes, buffers, how='inner', predicate='intersects')
+    count('node_buffer_pairs', len(joined))
+    return joined.index.to_numpy(), joined['index_right'].to_numpy()
+
+
+def buffer_hour_weights(buffer_gdf, weight_col='weight', hour_col='hora', zone_col='time_zones'):
+    """
+    Weight of every buffer in each hour of the day
+
+    Every buffer adds up to its weight times the length of its time zone,
+    so the risk at an hour is on the scale of the legacy zone filter (the
+    summed weights of the zone): without an hour, the buffer counts its full
+    weight in every hour of its zone (of the day if the zone is unknown).
+    With an hour column (crime_pipeline.py keeps 'hora') that same total is
+    spread with a triangular kernel of HOUR_KERNEL_HALF_WIDTH hours around
+    the hour of the incident.
+
+    Returns:
+        float32 array (n_buffers, 24)
+    """
+    weights = buffer_gdf[weight_col].to_numpy(dtype=np.float32)
+    result = np.zeros((len(buffer_gdf), HOURS), dtype=np.float32)
+
+    zones = buffer_gdf[zone_col].map(normalize_time_zone).to_numpy() if zone_col in buffer_gdf \
+        else np.full(len(buffer_gdf), None)
+    timed = np.zeros(len(buffer_gdf), dtype=bool)
+    if hour_col in buffer_gdf:
+        hours = buffer_gdf[hour_col].to_numpy(dtype=float)
+        timed = np.isfinite(hours)
+        hours = hours[timed] % HOURS
+        zone_idx = np.searchsorted(TIME_ZONE_STARTS, hours, side='right') - 1
+
+        # Distancia circular del centro de cada hora (h + 0.5) a la hora del delito
+        distance = np.abs(np.arange(HOURS) + 0.5 - hours[:, None])
+        kernel = np.maximum(0.0, 1.0 - np.minimum(distance, HOURS - distance) / HOUR_KERNEL_HALF_WIDTH)
+        total = weights[timed] * np.diff(TIME_ZONE_STARTS + (HOURS,))[zone_idx]
+        result[timed] = kernel * (total / kernel.sum(axis=1))[:, None]
+
+    for zone in TIME_ZONES:
+        start, end = time_zone_hours(zone)
+        rows = ~timed & (zones == zone)
+        result[rows, start:end] = weights[rows][:, None]
+    unknown = ~timed & ~np.isin(zones, TIME_ZONES)
+    result[unknown, :] = weights[unknown][:, None]
+    return result
+
+
+class HourlyEdgeRisk:
+    """
+    Crime risk of every edge for each hour of the day
+
+    `matrix` has shape (n_edges, 24) and dtype float16; it is stored
+    column-major so selecting an hour reads a contiguous block. The same
+    structure holds the per-node risk (rows are nodes, see from_pairs).
+    """
+
+    def __init__(self, matrix):
+        self.matrix = np.asfortranarray(matrix, dtype=np.float16)
+        self._columns = OrderedDict()
+        self._columns_lock = threading.Lock()
+
+    @classmethod
+    def from_buffers(cls, arrays, buffer_gdf, weight_col='weight', hour_col='hora', zone_col='time_zones',
+                     pairs=None):
+        """
+        Precompute the matrix from the crime buffers
+
+        Args:
+            arrays: GraphArrays of the walking graph
+            buffer_gdf: Crime buffers in the graph CRS
+            pairs: Optional (edge_idx, buffer_idx) already computed
+
+        Returns:
+            HourlyEdgeRisk
+        """
+        pairs = pairs if pairs is not None else edge_buffer_pairs(arrays, buffer_gdf)
+        return cls.from_pairs(arrays.n_edges, pairs, buffer_gdf, weight_col, hour_col, zone_col)
+
+    @classmethod
+    def from_pairs(cls, n_rows, pairs, buffer_gdf, weight_col='weight', hour_col='hora', zone_col='time_zones'):
+        """
+        Build the matrix from (row, buffer) intersection pairs
+
+        Args:
+            n_rows: Number of edges (or nodes)
+            pairs: Tuple (row_idx, buffer_idx) from edge_buffer_pairs or
+                   node_buffer_pairs
+
+        Returns:
+            HourlyEdgeRisk
+        """
+        row_idx, buffer_idx = pairs
+        hour_weights = buffer_hour_weights(buffer_gdf, weight_col, hour_col, zone_col)
+
+        matrix = np.empty((n_rows, HOURS), dtype=np.float32, order='F')
+        for h in range(HOURS):
+            matrix[:, h] = np.bincount(row_idx, weights=hour_weights[buffer_idx, h], minlength=n_rows)
+        return cls(matrix)
+
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes
+
+    def risk_at(self, hour=None):
+        """
+        Risk of every edge at a given hour
+
+        Hour bins are centered on h + 0.5, and values between two centers are
+        interpolated linearly (wrapping around midnight).
+
+        Args:
+            hour: Hour of the day (0-24), or None for the daily mean
+
+        Returns:
+            float32 array with one value per edge
+        """
+        if hour is None:
+            return self.matrix.mean(axis=1, dtype=np.float32)
+
+        h = (hour - 0.5) % HOURS
+        lo = int(math.floor(h))
+        hi = (lo + 1) % HOURS
+        f = np.float32(h - lo)
+        return (1 - f) * self.matrix[:, lo].astype(np.float32) + f * self.matrix[:, hi].astype(np.float32)
+
+    def hour_column(self, h):
+        """
+        Risk of every edge in hour bin `h` as a plain Python list
+
+        A list costs about 32 bytes per row against 2 for the float16
+        matrix, so only the last HOUR_COLUMN_CACHE columns are kept.
+        """
+        with self._columns_lock:
+            column = self._columns.get(h)
+            if column is not None:
+                self._columns.move_to_end(h)
+                return column
+
+        column = self.matrix[:, h].astype(np.float32).tolist()
+        with self._columns_lock:
+            self._columns[h] = column
+            while len(self._columns) > HOUR_COLUMN_CACHE:
+                self._columns.popitem(last=False)
+        return column
+
+    def save(self, path):
+        np.save(path, self.matrix)
+
+    @classmethod
+    def load(cls, path):
+        return cls(np.load(path))
+
+
+# Categorías de delito relevantes para un peatón, en orden de prioridad: cada
+# delito se asigna a la primera categoría cuyas palabras clave contiene
+# (texto en mayúsculas y sin acentos, como en delito_counts.csv). Una tupla
+# de palabras exige todas: el robo con violencia solo es de peatón en la vía
+# pública, no el de negocio, casa, vehículo o repartidor.
+CRIME_CATEGORIES = (
+    ('violencia_grave', ('HOMICIDIO', 'LESIONES', 'DISPARO', 'SECUESTRO')),
+    ('sexual', ('ACOSO', 'VIOLACION', 'ABUSO SEXUAL')),
+    ('transporte_publico', ('PASAJERO', 'METRO', 'MICROBUS', 'TROLEBUS', 'RTP', 'TREN', 'TAXI')),
+    ('negocio', ('NEGOCIO', 'LOCALES', 'OFICINA', 'ESCUELA', 'EVENTOS', 'SUCURSAL')),
+    ('casa', ('CASA HABITACION',)),
+    ('vehiculo', ('VEHICULO', 'AUTO', 'PLACA', 'MOTO')),
+    ('transeunte_con_violencia', (('TRANSEUNTE', 'CON VIOLENCIA'), ('TRANSEUNTE', 'C/V'),
+                                  ('VIA PUBLICA', 'CON VIOLENCIA'), ('VIA PUBLICA', 'C/V'))),
+    ('transeunte_sin_violencia', ('TRANSEUNTE', 'OBJETOS', 'DOCUMENTOS', 'DINERO', 'CELULAR', 'ALHAJAS')),
+)
+CATEGORY_NAMES = tuple(name for name, _ in CRIME_CATEGORIES) + ('otros',)
+
+# Perfiles de consulta: peso de cada categoría (las que faltan valen 0)
+CRIME_PROFILES = {
+    'general': {name: 1.0 for name in CATEGORY_NAMES},
+    'peaton': {
+        'violencia_grave': 1.0, 'sexual': 1.0, 'transeunte_con_violencia': 1.0,
+        'transeunte_sin_violencia': 0.6, 'transporte_publico': 0.3, 'negocio': 0.2, 'otros': 0.1,
+    },
+    'peaton_violento': {'violencia_grave': 1.0, 'sexual': 1.0, 'transeunte_con_violencia': 1.0},
+    'sin_vehiculos': {name: 1.0 for name in CATEGORY_NAMES if name != 'vehiculo'},
+}
+
+
+def _keyword_pattern(keyword):
+    # Tupla = todas las palabras, en cualquier orden
+    if isinstance(keyword, tuple):
+        return '^' + ''.join(f"(?=.*{re.escape(part)})" for part in keyword)
+    return re.escape(keyword)
+
+
+def categorize_delito(delitos):
+    """
+    Category index of every crime description
+
+    Args:
+        delitos: pandas Series with the 'delito' column
+
+    Returns:
+        int array with positions in CATEGORY_NAMES
+    """
+    text = (delitos.fillna('').astype(str).str.upper()
+            .str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii'))
+    result = np.full(len(text), len(CATEGORY_NAMES) - 1, dtype=np.int64)
+    unassigned = np.ones(len(text), dtype=bool)
+    for i, (_, keywords) in enumerate(CRIME_CATEGORIES):
+        pattern = '|'.join(_keyword_pattern(k) for k in keywords)
+        hit = unassigned & text.str.contains(pattern, regex=True).to_numpy()
+        result[hit] = i
+        unassigned &= ~hit
+    return result
+
+
+def profile_vector(profile):
+    """
+    Weight vector over CATEGORY_NAMES for a profile
+
+    Args:
+        profile: Name in CRIME_PROFILES, dict category -> weight, or a
+                 sequence with one weight per category
+
+    Raises:
+        ValueError: Unknown profile or category
+    """
+    if isinstance(profile, str):
+        if profile not in CRIME_PROFILES:
+            raise ValueError(f"Perfil desconocido: {profile}. Opciones: {', '.join(CRIME_PROFILES)}")
+        profile = CRIME_PROFILES[profile]
+    if isinstance(profile, dict):
+        unknown = set(profile) - set(CATEGORY_NAMES)
+        if unknown:
+            raise ValueError(f"Categorías desconocidas: {', '.join(sorted(unknown))}")
+        return np.array([profile.get(name, 0.0) for name in CATEGORY_NAMES], dtype=np.float32)
+
+    vector = np.asarray(profile, dtype=np.float32)
+    if vector.shape != (len(CATEGORY_NAMES),):
+        raise ValueError(f"El perfil debe tener {len(CATEGORY_NAMES)} pesos")
+    return vector
+
+
+class CategoryEdgeRisk:
+    """
+    Crime risk of every edge split by crime category
+
+    `matrix` has shape (n_edges, n_categories): the daily mean of the hourly
+    risk (buffer_hour_weights) of each category, so a profile is on the
+    scale of HourlyEdgeRisk.risk_at(None). A profile is applied with one
+    matrix-vector product, so changing profile never touches the geometries.
+    """
+
+    def __init__(self, matrix):
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+
+    @classmethod
+    def from_buffers(cls, arrays, buffer_gdf, weight_col='weight', delito_col='delito', pairs=None,
+                     hour_col='hora', zone_col='time_zones'):
+        """
+        Precompute the per-category layers from the crime buffers
+
+        Args:
+            arrays: GraphArrays of the walking graph
+            buffer_gdf: Crime buffers with a 'delito' column
+            pairs: Optional (edge_idx, buffer_idx) already computed
+
+        Returns:
+            CategoryEdgeRisk
+        """
+        edge_idx, buffer_idx = pairs if pairs is not None else edge_buffer_pairs(arrays, buffer_gdf)
+        weights = buffer_hour_weights(buffer_gdf, weight_col, hour_col, zone_col).mean(axis=1, dtype=np.float64)
+        categories = categorize_delito(buffer_gdf[delito_col])
+
+        # Una sola bincount sobre el índice combinado arista * K + categoría
+        k = len(CATEGORY_NAMES)
+        flat = np.bincount(edge_idx * k + categories[buffer_idx], weights=weights[buffer_idx],
+                           minlength=arrays.n_edges * k)
+        return cls(flat.reshape(arrays.n_edges, k))
+
+    def risk_for(self, profile):
+        """Risk of every edge under a profile (see profile_vector)"""
+        return self.matrix @ profile_vector(profile)
+
+
+class RiskModel:
+    """
+    Precomputed routing state: graph arrays plus per-hour edge risk
+
+    Build it once at startup (e.g. in st.cache_resource) and reuse it for every
+    request; a route then costs one cost-array evaluation and two searches.
+    """
+
+    def __init__(self, arrays, hourly_risk, category_risk=None, node_risk=None, edge_buffers=None):
+        self.arrays = arrays
+        self.hourly_risk = hourly_risk
+        self.category_risk = category_risk
+        # Riesgo por nodo y hora (node_weight de los notebooks); None = sin riesgo de nodo
+        self.node_risk = node_risk
+        # CSR arista -> buffers que la tocan, para contar delitos por ruta
+        self.edge_buffers = edge_buffers
+        self._cost_lists = OrderedDict()
+        self._cost_lock = threading.Lock()
+
+    @classmethod
+    def from_graph(cls, graph, buffer_gdf, workers=1, pairs=None, **kwargs):
+        """
+        Args:
+            graph: networkx graph from osmnx
+            buffer_gdf: Crime buffers in the graph CRS
+            workers: Compute the edge-buffer intersections on this many
+                     processes (parallel_edge_buffer_pairs)
+            pairs: Optional (edge_idx, buffer_idx) already computed, or
+                   (edge_idx, buffer_idx, fingerprint) as returned by
+                   precompute_risk.load_pairs; they are checked against the
+                   graph and buffers with check_pairs
+            **kwargs: Column names forwarded to HourlyEdgeRisk.from_buffers
+
+        The per-category layers are built too when the buffers have a
+        'delito' column; both share the same edge-buffer intersections.
+        Node risk comes from one sjoin of all nodes against the buffers.
+
+        Raises:
+            ValueError: If `pairs` belong to another graph or buffer set
+        """
+        arrays = GraphArrays.from_graph(graph)
+        if pairs is not None:
+            fingerprint = pairs[2] if len(pairs) == 3 else None
+            pairs = (np.asarray(pairs[0]), np.asarray(pairs[1]))
+            check_pairs(arrays, buffer_gdf, pairs, fingerprint)
+        else:
+            pairs = (parallel_edge_buffer_pairs(arrays, buffer_gdf, workers) if workers > 1
+                     else edge_buffer_pairs(arrays, buffer_gdf))
+        hourly = HourlyEdgeRisk.from_buffers(arrays, buffer_gdf, pairs=pairs, **kwargs)
+        node_risk = HourlyEdgeRisk.from_pairs(arrays.n_nodes, node_buffer_pairs(arrays, buffer_gdf),
+                                              buffer_gdf, **kwargs)
+        categories = None
+        if 'delito' in buffer_gdf:
+            categories = CategoryEdgeRisk.from_buffers(arrays, buffer_gdf, kwargs.get('weight_col', 'weight'),
+                                                       pairs=pairs, hour_col=kwargs.get('hour_col', 'hora'),
+                                                       zone_col=kwargs.get('zone_col', 'time_zones'))
+        return cls(arrays, hourly, categories, node_risk, edge_buffer_csr(arrays.n_edges, pairs))
+
+    def edge_costs(self, hour=None, crime_profile=None, strategy='log', **params):
+        """
+        Risk-aware cost of every edge at `hour`
+
+        The default 'log' strategy is length * (1 + log(1 + risk)) with node
+        and edge risk inside the log; 'exp_combine' is the weight of the
+        legacy buscar_ruta path. Node risk at `hour` enters through the
+        strategy. With a crime profile
+        the risk comes from the all-day per-category edge layers instead,
+        `hour` is ignored and node risk is not used.
+
+        Args:
+            strategy: Name in weight_strategies.STRATEGIES
+            **params: Parameters of the strategy
+        """
+        if crime_profile is not None:
+            if self.category_risk is None:
+                raise ValueError("Los buffers no tienen columna 'delito': no hay capas por categoría")
+            return compute_edge_costs(strategy, self.arrays, self.category_risk.risk_for(crime_profile), **params)
+
+        node_risk = self.node_risk.risk_at(hour) if self.node_risk is not None else None
+        return compute_edge_costs(strategy, self.arrays, self.hourly_risk.risk_at(hour), node_risk, **params)
+
+    def edge_cost_list(self, hour=None, crime_profile=None, strategy='log'):
+        """
+        edge_costs() as a Python list for the heapq searches
+
+        The last COST_LIST_CACHE (hour, profile, strategy) combinations are
+        kept, so repeated requests for the same time zone skip both the cost
+        evaluation and the conversion of the whole array.
+        """
+        # El perfil como bytes del vector de pesos: dos perfiles equivalentes comparten lista
+        key = (hour, profile_vector(crime_profile).tobytes() if crime_profile is not None else None, strategy)
+        with self._cost_lock:
+            costs = self._cost_lists.get(key)
+            if costs is not None:
+                self._cost_lists.move_to_end(key)
+                return costs
+
+        costs = self.edge_costs(hour, crime_profile, strategy).tolist()
+        with self._cost_lock:
+            self._cost_lists[key] = costs
+            while len(self._cost_lists) > COST_LIST_CACHE:
+                self._cost_lists.popitem(last=False)
+        return costs
+
+    def route(self, origin, destination, hour=None, time_dependent=False, crime_profile=None, strategy='log',
+              metrics=False, snap='node', trees=None):
+        """
+        Safest and shortest routes between two (lat, lon) points
+
+        Args:
+            hour: Departure hour (0-24), or None for the daily mean risk
+            time_dependent: Look up the risk of each edge at the estimated
+                            arrival time instead of at the departure hour
+            crime_profile: Optional profile over crime categories (see
+                           profile_vector); uses the all-day category layers
+            strategy: Weight strategy (weight_strategies.STRATEGIES); the
+                      time-dependent search always uses 'log'
+            metrics: Return Route objects instead of coordinate lists
+            snap: 'node' starts and ends the routes at the nearest nodes;
+                  'edge' at the closest point of the nearest streets, with
+                  the partial edges costed in proportion (the time-dependent
+                  search always snaps to nodes)
+            trees: Optional search_trees.SearchTreeCache; with snap='edge'
+                   the searches from an origin already seen are reused and
+                   only the paths are rebuilt
+
+        Returns:
+            Tuple (safe_route, fast_route) as lists of (lat, lon), like
+            buscar_ruta, or as Route objects when `metrics` is True
+        """
+        use_time_dependent = time_dependent and hour is not None and crime_profile is None and strategy == 'log'
+        if snap == 'edge' and not use_time_dependent:
+            return self._route_snapped(origin, destination, hour, crime_profile, strategy, metrics, trees)
+
+        with stage('nearest_nodes'):
+            source = self.arrays.nearest_node(origin[0], origin[1])
+            target = self.arrays.nearest_node(destination[0], destination[1])
+
+        with stage('shortest_path_length'):
+            _, pred = dijkstra(self.arrays, self.arrays.length_list(), source, target)
+            fast = path_edges(self.arrays, pred, source, target)
+
+        if use_time_dependent:
+            with stage('shortest_path_safe'):
+                _, pred = time_dependent_dijkstra(self, source, hour, target)
+        else:
+            with stage('edge_costs'):
+                costs = self.edge_cost_list(hour, crime_profile, strategy)
+            with stage('shortest_path_safe'):
+                _, pred = dijkstra(self.arrays, costs, source, target)
+        safe = path_edges(self.arrays, pred, source, target)
+        count('path_nodes', len(fast) + len(safe) + 2)
+
+        if not metrics:
+            return (self.arrays.node_coords(edges_to_nodes(self.arrays, source, safe)),
+                    self.arrays.node_coords(edges_to_nodes(self.arrays, source, fast)))
+
+        with stage('route_metrics'):
+            risk = self.edge_risk(hour, crime_profile)
+            return self.build_route(source, safe, risk), self.build_route(source, fast, risk)
+
+    def _route_snapped(self, origin, destination, hour, crime_profile, strategy, metrics, trees=None):
+        """route() with both points snapped onto edges (snapped_shortest_path)"""
+        with stage('nearest_edges'):
+            source = self.arrays.nearest_edge(origin[0], origin[1])
+            target = self.arrays.nearest_edge(destination[0], destination[1])
+
+        if trees is not None:
+            # El perfil como bytes del vector de pesos: dos perfiles equivalentes comparten árbol
+            profile_key = profile_vector(crime_profile).tobytes() if crime_profile is not None else None
+            origin_key = (source.edge, round(source.fraction, 6))
+            with stage('shortest_path_length'):
+                _, fast = trees.get(origin_key + ('length',),
+                                    lambda: SearchTree(self.arrays, self.arrays.length_list(), source)).path_to(target)
+            with stage('shortest_path_safe'):
+                tree = trees.get(origin_key + (hour, profile_key, strategy),
+                                 lambda: SearchTree(self.arrays, self.edge_cost_list(hour, crime_profile, strategy),
+                                                    source))
+                _, safe = tree.path_to(target)
+        else:
+            with stage('shortest_path_length'):
+                _, fast = snapped_shortest_path(self.arrays, self.arrays.length_list(), source, target)
+            with stage('edge_costs'):
+                costs = self.edge_cost_list(hour, crime_profile, strategy)
+            with stage('shortest_path_safe'):
+                _, safe = snapped_shortest_path(self.arrays, costs, source, target)
+        count('path_nodes', len(fast) + len(safe) + 2)
+
+        if not metrics:
+            return ([tuple(p) for p in self.arrays.piece_coords(safe).tolist()],
+                    [tuple(p) for p in self.arrays.piece_coords(fast).tolist()])
+
+        with stage('route_metrics'):
+            risk = self.edge_risk(hour, crime_profile)
+            return self.build_snapped_route(safe, risk), self.build_snapped_route(fast, risk)
+
+    def edge_risk(self, hour=None, crime_profile=None):
+        """Crime risk of every edge, the quantity summed in Route.risk"""
+        if crime_profile is not None:
+            return self.category_risk.risk_for(crime_profile)
+        return self.hourly_risk.risk_at(hour)
+
+    def build_route(self, source, edges, risk, cost=None):
+        """
+        Route with its metrics aggregated from the edge arrays
+
+        Args:
+            source: Node index where the path starts
+            edges: Edge indices of the path
+            risk: Array with the risk of every edge (see edge_risk)
+            cost: Optional search cost of the path
+
+        Returns:
+            Route
+        """
+        edge_array = np.asarray(edges, dtype=np.int64)
+        length = float(self.arrays.length[edge_array].sum())
+
+        return Route(
+            coords=self.arrays.path_coords(edge_array, source),
+            edges=edge_array.tolist(),
+            length=length,
+            risk=float(risk[edge_array].sum()),
+            crime_count=self._crime_count(edge_array),
+            walk_time=length / WALKING_SPEED_MPS,
+            cost=cost,
+        )
+
+    def build_snapped_route(self, pieces, risk, cost=None):
+        """
+        Route for a path with partial first and last edges
+
+        Length and risk of a partial edge are proportional to the fraction
+        walked; a crime buffer touching it counts as crossed.
+
+        Args:
+            pieces: (edge, start, end) list from snapped_shortest_path
+            risk: Array with the risk of every edge (see edge_risk)
+            cost: Optional search cost of the path
+        """
+        edge_array = np.array([piece[0] for piece in pieces], dtype=np.int64)
+        share = np.array([piece[2] - piece[1] for piece in pieces], dtype=np.float64)
+        length = float((self.arrays.length[edge_array] * share).sum())
+
+        return Route(
+            coords=self.arrays.piece_coords(pieces),
+            edges=edge_array.tolist(),
+            length=length,
+            risk=float((risk[edge_array] * share).sum()),
+            crime_count=self._crime_count(edge_array),
+            walk_time=length / WALKING_SPEED_MPS,
+            cost=cost,
+        )
+
+    def _crime_count(self, edge_array):
+        # Delitos distintos: un mismo buffer puede tocar varias aristas de la ruta
+        if self.edge_buffers is None or not len(edge_array):
+            return 0
+        indptr, buffer_ids = self.edge_buffers
+        touched = [buffer_ids[indptr[e]:indptr[e + 1]] for e in edge_array.tolist()]
+        return len(np.unique(np.concatenate(touched)))
+
+
+class Route:
+    """
+    A walking route and its aggregated metrics
+
+    Attributes:
+        coords: float64 array (n, 2) of (lat, lon) following the street geometry
+        edges: Edge indices in the GraphArrays of the model
+        length: Length in meters
+        risk: Summed crime risk of its edges
+        crime_count: Number of distinct crime buffers it crosses
+        walk_time: Walking time in seconds at WALKING_SPEED_MPS
+        cost: Search cost, when the route comes from a ranked search
+    """
+
+    def __init__(self, coords, edges, length, risk, crime_count, walk_time, cost=None):
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        self.edges = edges
+        self.length = length
+        self.risk = risk
+        self.crime_count = crime_count
+        self.walk_time = walk_time
+        self.cost = cost
+
+    @property
+    def polyline(self):
+        """Coordinates as an encoded polyline string (polyline_codec)"""
+        return encode_polyline(self.coords)
+
+    def to_dict(self, with_coords=True):
+        """JSON-friendly dict; the geometry goes as an encoded polyline"""
+        data = {
+            'length': self.length,
+            'risk': self.risk,
+            'crime_count': self.crime_count,
+            'walk_time': self.walk_time,
+        }
+        if self.cost is not None:
+            data['cost'] = self.cost
+        if with_coords:
+            data['polyline'] = self.polyline
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """Inverse of to_dict; also accepts a plain 'coords' list"""
+        coords = decode_polyline(data['polyline']) if 'polyline' in data else data.get('coords', [])
+        return cls(coords, [], data['length'], data['risk'], data['crime_count'], data['walk_time'],
+                   data.get('cost'))
+
+def time_dependent_dijkstra(model, source, hour, target=None, speed=WALKING_SPEED_MPS):
+    """
+    Safest paths when the risk changes while walking
+
+    The cost of an edge is the one of RiskModel.edge_costs evaluated at the
+    time the walker reaches the edge: departure hour plus the walking time of
+    the path so far (length / speed). The walking time only depends on the
+    distance, so every node keeps the arrival time of its best label, which is
+    exact for the cost ranking and an approximation for the clock.
+
+    Only the hour columns the walk actually crosses are converted to lists
+    (HourlyEdgeRisk.hour_column), and the search keeps its own references
+    to them, so it touches two or three columns of the matrix.
+
+    Args:
+        model: RiskModel
+        source: Node index where the walk starts
+        hour: Departure hour (0-24)
+        target: Optional node index; the search stops when it is settled
+        speed: Walking speed in m/s
+
+    Returns:
+        Tuple (dist, pred) of dicts like graph_arrays.dijkstra
+    """
+    arrays = model.arrays
+    indptr, adj, heads = arrays.adjacency_lists()
+    lengths = arrays.length_list()
+    edge_column = model.hourly_risk.hour_column
+    node_column = model.node_risk.hour_column if model.node_risk is not None else None
+    zeros = [0.0] * arrays.n_nodes if node_column is None else None
+    # Columnas usadas por esta búsqueda: la caché compartida puede descartarlas mientras tanto
+    columns = {}
+
+    def column_pair(lo):
+        pair = columns.get(lo)
+        if pair is None:
+            hi = (lo + 1) % HOURS
+            if node_column is not None:
+                nodes = (node_column(lo), node_column(hi))
+            else:
+                nodes = (zeros, zeros)
+            pair = columns[lo] = (edge_column(lo), edge_column(hi)) + nodes
+        return pair
+    hours_per_meter = 1 / (speed * 3600)
+    log1p = math.log1p
+
+    dist = {source: 0.0}
+    walked = {source: 0.0}
+    pred = {}
+    settled = set()
+    heap = [(0.0, source)]
+
+    while heap:
+        d, node = heapq.heappop(heap)
+        if node in settled:
+            continue
+        settled.add(node)
+        if node == target:
+            break
+
+        # Interpolación entre los centros de las dos horas vecinas, como risk_at
+        h = (hour + walked[node] * hours_per_meter - 0.5) % HOURS
+        lo = int(h)
+        f = h - lo
+        risk_lo, risk_hi, node_lo, node_hi = column_pair(lo)
+        # Mitad del riesgo del nodo de salida, común a todas sus aristas
+        node_u = ((1 - f) * node_lo[node] + f * node_hi[node]) / 2
+
+        for e in adj[indptr[node]:indptr[node + 1]]:
+            head = heads[e]
+            length = lengths[e]
+            risk = (1 - f) * risk_lo[e] + f * risk_hi[e] + node_u + ((1 - f) * node_lo[head] + f * node_hi[head]) / 2
+            nd = d + length * (1 + log1p(risk))
+            if nd < dist.get(head, math.inf):
+                dist[head] = nd
+                walked[head] = walked[node] + length
+                pred[head] = e
+                heapq.heappush(heap, (nd, head))
+
+    count('nodes_settled', len(settled))
+    return dist, pred
@@ -0,0 +1,221 @@
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+
+
+PENDING = 'pendiente'
+RUNNING = 'ejecutando'
+DONE = 'terminado'
+FAILED = 'error'
+CANCELLED = 'cancelado'
+
+
+class QueueFullError(RuntimeError):
+    """Raised when the queue already holds `max_pending` unfinished jobs"""
+
+
+class RouteJob:
+    """
+    State and timing of a single job submitted to RouteJobQueue
+
+    Times are taken with time.perf_counter(); `wait_time` is the time spent in
+    the queue and `run_time` the time spent executing the function.
+    """
+
+    def __init__(self, job_id, future):
+        self.job_id = job_id
+        self.future = future
+        self.status = PENDING
+        self.error = None
+        self.cancel_requested = False
+        self.submitted_at = time.perf_counter()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def wait_time(self):
+        if self.started_at is not None:
+            return self.started_at - self.submitted_at
+        end = self.finished_at if self.finished_at is not None else time.perf_counter()
+        return end - self.submitted_at
+
+    @property
+    def run_time(self):
+        if self.started_at is None:
+            return 0.0
+        end = self.finished_at if self.finished_at is not None else time.perf_counter()
+        return end - self.started_at
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'error': str(self.error) if self.error else None,
+            'wait_time': self.wait_time,
+            'run_time': self.run_time,
+        }
+
+
+class RouteJobQueue:
+    """
+    Local job queue that runs route computations on a thread pool
+
+    Jobs are identified by an integer id so the Streamlit session only has to
+    keep that id in `st.session_state` and poll on the next rerun.
+    Threads are used instead of processes because the graph and crime buffers
+    are large and would have to be pickled for every job.
+
+    Python threads cannot be interrupted, so cancelling a running job only
+    marks it as cancelled and its result is discarded when it finishes.
+    Jobs that are still waiting in the queue are never started.
+    """
+
+    def __init__(self, max_workers=2, max_pending=16, keep_finished=100):
+        """
+        Args:
+            max_workers: Maximum number of jobs running at the same time
+            max_pending: Maximum number of unfinished jobs (queued + running)
+            keep_finished: Number of finished jobs kept for status and metrics
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.keep_finished = keep_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='route-job')
+        self._jobs = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue `fn(*args, **kwargs)` and return the id of the new job
+
+        Raises:
+            QueueFullError: If `max_pending` jobs are already unfinished
+        """
+        with self._lock:
+            if self.pending_count() >= self.max_pending:
+                raise QueueFullError(f"Hay {self.max_pending} cálculos en curso, inténtalo más tarde")
+
+            job_id = next(self._ids)
+            job = RouteJob(job_id, None)
+            job.future = self._executor.submit(self._run, job, fn, args, kwargs)
+            self._jobs[job_id] = job
+            self._prune()
+
+        return job_id
+
+    def _run(self, job, fn, args, kwargs):
+        if job.cancel_requested:
+            job.status = CANCELLED
+            return None
+
+        job.started_at = time.perf_counter()
+        job.status = RUNNING
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            job.error = e
+            job.status = FAILED
+            raise
+        finally:
+            job.finished_at = time.perf_counter()
+
+        if job.cancel_requested:
+            job.status = CANCELLED
+            return None
+
+        job.status = DONE
+        return result
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.future.done()]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
+
+    def pending_count(self):
+        """Number of jobs that are queued or running"""
+        return sum(1 for job in self._jobs.values() if not job.future.done())
+
+    def get(self, job_id):
+        """Return the RouteJob for `job_id`, or None if it is unknown"""
+        return self._jobs.get(job_id)
+
+    def status(self, job_id):
+        """Dictionary with the status and timings of a job, or None"""
+        job = self.get(job_id)
+        return job.to_dict() if job else None
+
+    def done(self, job_id):
+        """True when the job finished, failed or was cancelled"""
+        job = self.get(job_id)
+        return job is None or job.future.done()
+
+    def result(self, job_id, timeout=None):
+        """
+        Wait for a job and return its result
+
+        Args:
+            job_id: Id returned by submit()
+            timeout: Seconds to wait, None to wait forever
+
+        Returns:
+            The value returned by the job function, or None if it was cancelled
+
+        Raises:
+            KeyError: If the job id is unknown
+            concurrent.futures.TimeoutError: If the job does not finish in time
+            Exception: Whatever the job function raised
+        """
+        job = self._jobs[job_id]
+        try:
+            return job.future.result(timeout=timeout)
+        except CancelledError:
+            return None
+
+    def cancel(self, job_id):
+        """
+        Cancel a job; queued jobs never start, running ones are discarded
+
+        Returns:
+            bool: True if the job existed and was not finished yet
+        """
+        job = self.get(job_id)
+        if job is None or job.future.done():
+            return False
+
+        job.cancel_requested = True
+        if job.future.cancel():
+            job.status = CANCELLED
+            job.finished_at = time.perf_counter()
+        return True
+
+    def metrics(self):
+        """
+        Aggregated timings of the finished jobs kept by the queue
+
+        Returns:
+            dict with job counts per status and mean/max wait and run times
+        """
+        with self._lock:
+            jobs = list(self._jobs.values())
+
+        counts = {}
+        for job in jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+
+        finished = [job for job in jobs if job.status == DONE]
+        waits = [job.wait_time for job in finished]
+        runs = [job.run_time for job in finished]
+
+        return {
+            'counts': counts,
+            'pending': sum(1 for job in jobs if not job.future.done()),
+            'mean_wait': sum(waits) / len(waits) if waits else 0.0,
+            'max_wait': max(waits, default=0.0),
+            'mean_run': sum(runs) / len(runs) if runs else 0.0,
+            'max_run': max(runs, default=0.0),
+        }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
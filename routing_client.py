@@ -0,0 +1,139 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from risk_model import Route
+from polyline_codec import decode_polyline
+
+
+class RoutingClient:
+    """
+    Thin client for routing_service.py that reuses pooled HTTP connections
+
+    A single instance should be shared by the whole frontend process (e.g.
+    through st.cache_resource) so requests reuse the open connections instead
+    of doing a new TCP handshake per route.
+    """
+
+    def __init__(self, base_url, pool_size=10, timeout=60, retries=2):
+        """
+        Args:
+            base_url: URL of the service, e.g. "http://localhost:8080"
+            pool_size: Maximum number of connections kept open
+            timeout: Seconds to wait for a response
+            retries: Retries for connection errors and 502/503/504 responses
+        """
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            max_retries=Retry(total=retries, backoff_factor=0.2,
+                              status_forcelist=(502, 503, 504), allowed_methods=None),
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _post(self, path, payload):
+        response = self.session.post(f"{self.base_url}{path}", json=payload, timeout=self.timeout)
+        if response.status_code >= 400:
+            # El servicio envía {'error': ...} en los 500 y el motivo en el texto de los 4xx/503
+            try:
+                message = response.json()['error']
+            except (ValueError, KeyError, TypeError):
+                message = response.text.strip() or response.reason
+            raise requests.HTTPError(f"{response.status_code} {path}: {message}", response=response)
+        return response.json()
+
+    def health(self):
+        response = self.session.get(f"{self.base_url}/health", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def route(self, origin, destination, time, hour=None, crime_profile=None, metrics=False):
+        """
+        Same contract as principal_functions.buscar_ruta
+
+        Args:
+            hour: Optional departure hour (0-24); takes precedence over `time`
+            crime_profile: Optional name of a profile in risk_model.CRIME_PROFILES
+            metrics: Return risk_model.Route objects with length, risk,
+                     crime count and walking time
+
+        Returns:
+            Tuple (safe_route, fast_route) with lists of (lat, lon) tuples,
+            or Route objects when `metrics` is True
+        """
+        payload = {'origin': list(origin), 'destination': list(destination), 'time': time, 'encoding': 'polyline'}
+        if hour is not None:
+            payload['hour'] = hour
+        if crime_profile is not None:
+            payload['crime_profile'] = crime_profile
+        data = self._post('/route', payload)
+        if metrics:
+            return tuple(Route.from_dict({**data['metrics'][name], 'polyline': data[name]}) for name in ('safe', 'fast'))
+        return tuple([tuple(p) for p in decode_polyline(data[name]).tolist()] for name in ('safe', 'fast'))
+
+    def route_batch(self, items):
+        """
+        Compute several routes in one request
+
+        Args:
+            items: List of (origin, destination, time) tuples
+
+        Returns:
+            List with one dict per item: {'safe', 'fast', 'elapsed'} or {'error'}
+        """
+        payload = {'requests': [
+            {'origin': list(origin), 'destination': list(destination), 'time': time}
+            for origin, destination, time in items
+        ]}
+        return self._post('/route/batch', payload)['results']
+
+    def alternatives(self, origin, destination, time, k=3, hour=None, crime_profile=None):
+        """
+        Same contract as principal_functions.buscar_alternativas
+
+        Returns:
+            List of risk_model.Route
+        """
+        payload = {'origin': list(origin), 'destination': list(destination), 'time': time, 'k': k}
+        if hour is not None:
+            payload['hour'] = hour
+        if crime_profile is not None:
+            payload['crime_profile'] = crime_profile
+        data = self._post('/route/alternatives', payload)
+        return [Route.from_dict(route) for route in data['routes']]
+
+    def safest_pois(self, origin, query=None, time='Todo', k=3, radius_m=1000, tags=(), hour=None,
+                    crime_profile=None):
+        """
+        Same contract as principal_functions.buscar_poi_seguro, but the POIs
+        come back as dicts (lat, lon, tags) instead of index ids
+
+        Returns:
+            List of (poi, risk_model.Route), safest first
+        """
+        payload = {'origin': list(origin), 'time': time, 'k': k, 'radius': radius_m,
+                   'tags': [list(t) for t in tags]}
+        if query is not None:
+            payload['query'] = query
+        if hour is not None:
+            payload['hour'] = hour
+        if crime_profile is not None:
+            payload['crime_profile'] = crime_profile
+        data = self._post('/route/poi', payload)
+        return [(item['poi'], Route.from_dict(item['route'])) for item in data['pois']]
+
+    def crimes_along(self, route_coords):
+        """
+        Same contract as principal_functions.get_intersecting_crimes
+
+        Returns:
+            List of crime names ('delito') whose buffer intersects the route
+        """
+        return self._post('/crimes/along', {'route': [list(p) for p in route_coords]})['crimes']
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+Servicio HTTP de rutas seguras
+
+Carga el grafo peatonal y los buffers de crimen una sola vez y atiende
+peticiones concurrentes. El cálculo de rutas es CPU y se ejecuta en un
+ThreadPoolExecutor para no bloquear el bucle de eventos. AdmissionController
+(admission.py) agrupa las peticiones idénticas en curso y responde 503 con
+Retry-After cuando la cola de espera está llena.
+
+Endpoints:
+    GET  /health         Estado del servicio
+    GET  /metrics        Histograma de tiempos por etapa (instrumentation.py)
+    GET  /metrics/admission  Profundidad de la cola, peticiones agrupadas y rechazadas, tiempos de espera
+    POST /route          {"origin": [lat, lon], "destination": [lat, lon], "time": "Noche", "hour": 22.5,
+                          "crime_profile": "peaton_violento"}
+                         "encoding": "polyline" devuelve las rutas como encoded polylines
+    POST /route/batch    {"requests": [<cuerpo de /route>, ...]}
+    POST /route/alternatives  <cuerpo de /route> + {"k": 3}
+    POST /route/poi      {"origin": [lat, lon], "query": "farmacia", "tags": [["amenity", "pharmacy"]],
+                          "k": 3, "radius": 1000} + "time", "hour" y "crime_profile" como en /route
+                         (requiere --pois)
+    POST /crimes/along   {"route": [[lat, lon], ...]}
+
+Uso:
+    python routing_service.py --graph cache_MexicoCity_walk.graphml --crimes crime_buffers.geojson --pois pois_cdmx.json \
+        --workers 4 --max-queue 32
+"""
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+import geopandas as gpd
+import osmnx as ox
+
+from admission import AdmissionController, ServiceBusyError
+from principal_functions import buscar_ruta, buscar_alternativas, buscar_poi_seguro, get_intersecting_crimes
+from instrumentation import timing_summary
+from poi_index import POIIndex
+from risk_model import RiskModel, CRIME_PROFILES, normalize_time_zone
+
+
+DEFAULT_GRAPH = 'cache_MexicoCity_walk.graphml'
+DEFAULT_CRIMES = 'crime_buffers.geojson'
+MAX_BATCH = 50
+MAX_ALTERNATIVES = 5
+MAX_POIS = 10
+MAX_POI_RADIUS_M = 5000
+DEFAULT_MAX_QUEUE = 32
+
+
+class RoutingService:
+    """
+    Holds the graph, the crime buffers and the worker pool shared by all requests
+    """
+
+    def __init__(self, graph, crime_buffers, workers=4, poi_index=None, max_queue=DEFAULT_MAX_QUEUE):
+        self.graph = graph
+        self.crime_buffers = crime_buffers
+        self.poi_index = poi_index
+        # Construir el índice espacial una vez, geopandas lo guarda en el GeoDataFrame
+        self.crime_buffers.sindex
+        self.risk_model = RiskModel.from_graph(graph, crime_buffers)
+        # request_key proyecta cada petición sobre su calle: el índice de aristas se construye ya
+        self.risk_model.arrays.build_edge_index()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='routing')
+        self.admission = AdmissionController(self.executor, workers, max_queue)
+
+    async def run(self, fn, *args, key=None, shed=True):
+        return await self.admission.run(fn, *args, key=key, shed=shed)
+
+    def request_key(self, origin, destination, *options):
+        """
+        Identity of a route request for coalescing: both endpoints snapped
+        onto their edges plus the options that change the result
+        """
+        arrays = self.risk_model.arrays
+        ends = []
+        for lat, lon in (origin, destination):
+            snap = arrays.nearest_edge(lat, lon)
+            ends += [snap.edge, round(snap.fraction, 4)]
+        return (*ends, *options)
+
+    def _route(self, origin, destination, time_zone, hour=None, crime_profile=None, encoding=None):
+        safe, fast = buscar_ruta(origin, destination, time_zone, self.graph, self.crime_buffers,
+                                 hour=hour, risk_model=self.risk_model, time_dependent=hour is not None,
+                                 crime_profile=crime_profile, metrics=True)
+        if encoding == 'polyline':
+            encoded = {'safe': safe.polyline, 'fast': fast.polyline, 'encoding': 'polyline'}
+        else:
+            encoded = {'safe': safe.coords.tolist(), 'fast': fast.coords.tolist()}
+        return {
+            **encoded,
+            'metrics': {'safe': safe.to_dict(with_coords=False), 'fast': fast.to_dict(with_coords=False)},
+        }
+
+    async def route(self, body, shed=True):
+        origin, destination = parse_point(body, 'origin'), parse_point(body, 'destination')
+        start = time.perf_counter()
+        hour, crime_profile = parse_hour(body), parse_crime_profile(body)
+        time_zone, encoding = parse_time_zone(body), parse_encoding(body)
+        key = self.request_key(origin, destination, 'route', normalize_time_zone(time_zone), hour, crime_profile,
+                               encoding)
+        # Copia: el resultado puede compartirse con otras peticiones agrupadas
+        result = dict(await self.run(self._route, origin, destination, time_zone, hour, crime_profile, encoding,
+                                     key=key, shed=shed))
+        result['elapsed'] = time.perf_counter() - start
+        return result
+
+    def _alternatives(self, origin, destination, time_zone, k, hour=None, crime_profile=None):
+        routes = buscar_alternativas(origin, destination, time_zone, self.risk_model, k, hour, crime_profile)
+        return [route.to_dict() for route in routes]
+
+    async def alternatives(self, body):
+        origin, destination = parse_point(body, 'origin'), parse_point(body, 'destination')
+        hour, crime_profile = parse_hour(body), parse_crime_profile(body)
+        k = body.get('k', 3)
+        if not isinstance(k, int) or not 1 <= k <= MAX_ALTERNATIVES:
+            raise web.HTTPBadRequest(reason=f"'k' debe ser un entero entre 1 y {MAX_ALTERNATIVES}")
+        start = time.perf_counter()
+        time_zone = parse_time_zone(body)
+        key = self.request_key(origin, destination, 'alternatives', normalize_time_zone(time_zone), k, hour,
+                               crime_profile)
+        routes = await self.run(self._alternatives, origin, destination, time_zone, k, hour, crime_profile, key=key)
+        return {'routes': routes, 'elapsed': time.perf_counter() - start}
+
+    def _pois(self, origin, query, tags, k, radius, time_zone, hour=None, crime_profile=None):
+        results = buscar_poi_seguro(origin, query, time_zone, self.risk_model, self.poi_index, k, radius, tags,
+                                    hour, crime_profile)
+        return [
+            {
+                'poi': {'lat': float(self.poi_index.lat[poi]), 'lon': float(self.poi_index.lon[poi]),
+                        'tags': self.poi_index.tags[poi]},
+                'route': route.to_dict(),
+            }
+            for poi, route in results
+        ]
+
+    async def pois(self, body):
+        if self.poi_index is None:
+            raise web.HTTPServiceUnavailable(reason="El servicio no tiene índice de POI (--pois)")
+        origin = parse_point(body, 'origin')
+        hour, crime_profile, time_zone = parse_hour(body), parse_crime_profile(body), parse_time_zone(body)
+        query, tags = body.get('query'), body.get('tags', [])
+        if query is not None and not isinstance(query, str):
+            raise web.HTTPBadRequest(reason="'query' debe ser un texto")
+        if not isinstance(tags, list) or not all(isinstance(t, list) and len(t) == 2 for t in tags):
+            raise web.HTTPBadRequest(reason="'tags' debe ser una lista de pares [clave, valor]")
+        if not query and not tags:
+            raise web.HTTPBadRequest(reason="Indica 'query' o 'tags'")
+        k, radius = body.get('k', 3), body.get('radius', 1000)
+        if not isinstance(k, int) or not 1 <= k <= MAX_POIS:
+            raise web.HTTPBadRequest(reason=f"'k' debe ser un entero entre 1 y {MAX_POIS}")
+        if not isinstance(radius, (int, float)) or not 0 < radius <= MAX_POI_RADIUS_M:
+            raise web.HTTPBadRequest(reason=f"'radius' debe estar entre 0 y {MAX_POI_RADIUS_M} metros")
+        start = time.perf_counter()
+        pois = await self.run(self._pois, origin, query, [tuple(t) for t in tags], k, radius,
+                              time_zone, hour, crime_profile)
+        return {'pois': pois, 'elapsed': time.perf_counter() - start}
+
+
+def parse_point(body, name):
+    try:
+        lat, lon = body[name]
+        return [float(lat), float(lon)]
+    except (KeyError, TypeError, ValueError):
+        raise web.HTTPBadRequest(reason=f"'{name}' debe ser [lat, lon]")
+
+
+def parse_hour(body):
+    hour = body.get('hour')
+    if hour is None:
+        return None
+    try:
+        hour = float(hour)
+    except (TypeError, ValueError):
+        hour = -1
+    if not 0 <= hour <= 24:
+        raise web.HTTPBadRequest(reason="'hour' debe ser un número entre 0 y 24")
+    return hour
+
+
+def parse_crime_profile(body):
+    crime_profile = body.get('crime_profile')
+    if crime_profile is not None and (not isinstance(crime_profile, str) or crime_profile not in CRIME_PROFILES):
+        raise web.HTTPBadRequest(reason=f"'crime_profile' debe ser uno de: {', '.join(CRIME_PROFILES)}")
+    return crime_profile
+
+
+def parse_time_zone(body):
+    time_zone = body.get('time', 'Todo')
+    if not isinstance(time_zone, str):
+        raise web.HTTPBadRequest(reason="'time' debe ser el nombre de una franja horaria")
+    return time_zone
+
+
+def parse_encoding(body):
+    # Cualquier valor distinto de 'polyline' devuelve coordenadas, como antes
+    return 'polyline' if body.get('encoding') == 'polyline' else None
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(reason="El cuerpo debe ser JSON")
+
+
+def service_busy(error):
+    return web.HTTPServiceUnavailable(reason=str(error), headers={'Retry-After': '1'})
+
+
+async def health(request):
+    service = request.app['service']
+    return web.json_response({
+        'status': 'ok',
+        'nodes': service.graph.number_of_nodes(),
+        'edges': service.graph.number_of_edges(),
+        'crime_buffers': len(service.crime_buffers),
+    })
+
+
+async def metrics(request):
+    return web.json_response(timing_summary())
+
+
+async def admission_metrics(request):
+    return web.json_response(request.app['service'].admission.stats())
+
+
+async def route(request):
+    service = request.app['service']
+    body = await read_json(request)
+    try:
+        return web.json_response(await service.route(body))
+    except web.HTTPException:
+        raise
+    except ServiceBusyError as e:
+        raise service_busy(e)
+    except Exception as e:
+        return web.json_response({'error': str(e)}, status=500)
+
+
+async def route_alternatives(request):
+    service = request.app['service']
+    body = await read_json(request)
+    try:
+        return web.json_response(await service.alternatives(body))
+    except web.HTTPException:
+        raise
+    except ServiceBusyError as e:
+        raise service_busy(e)
+    except Exception as e:
+        return web.json_response({'error': str(e)}, status=500)
+
+
+async def route_poi(request):
+    service = request.app['service']
+    body = await read_json(request)
+    try:
+        return web.json_response(await service.pois(body))
+    except web.HTTPException:
+        raise
+    except ServiceBusyError as e:
+        raise service_busy(e)
+    except Exception as e:
+        return web.json_response({'error': str(e)}, status=500)
+
+
+async def route_batch(request):
+    service = request.app['service']
+    body = await read_json(request)
+    requests = body.get('requests', [])
+    if not isinstance(requests, list) or len(requests) > MAX_BATCH:
+        raise web.HTTPBadRequest(reason=f"'requests' debe ser una lista de hasta {MAX_BATCH} rutas")
+
+    # El lote se admite entero: sus rutas no compiten con la cola entre ellas
+    try:
+        service.admission.check()
+    except ServiceBusyError as e:
+        raise service_busy(e)
+    results = await asyncio.gather(*(service.route(item, shed=False) for item in requests), return_exceptions=True)
+    return web.json_response({
+        'results': [
+            {'error': str(result)} if isinstance(result, Exception) else result
+            for result in results
+        ]
+    })
+
+
+async def crimes_along(request):
+    service = request.app['service']
+    body = await read_json(request)
+    route_coords = body.get('route')
+    if not route_coords or len(route_coords) < 2:
+        raise web.HTTPBadRequest(reason="'route' debe tener al menos dos puntos [lat, lon]")
+
+    try:
+        crimes = await service.run(get_intersecting_crimes, route_coords, service.crime_buffers)
+    except ServiceBusyError as e:
+        raise service_busy(e)
+    return web.json_response({'crimes': crimes})
+
+
+def create_app(graph_path=DEFAULT_GRAPH, crimes_path=DEFAULT_CRIMES, workers=4, pois_path=None,
+               max_queue=DEFAULT_MAX_QUEUE):
+    """
+    Build the aiohttp application; the data is loaded on startup
+
+    Args:
+        graph_path: GraphML file with the walking network
+        crimes_path: GeoJSON file with the crime buffers
+        workers: Maximum number of routes computed at the same time
+        pois_path: Optional POI store (poi_index.py) for /route/poi
+        max_queue: Computations allowed to wait for a worker before
+                   answering 503
+
+    Returns:
+        aiohttp.web.Application
+    """
+    app = web.Application()
+
+    async def on_startup(app):
+        print(f"Cargando grafo {graph_path} y buffers {crimes_path}...")
+        graph = ox.load_graphml(graph_path)
+        crime_buffers = gpd.read_file(crimes_path)
+        poi_index = POIIndex.load(pois_path) if pois_path else None
+        app['service'] = RoutingService(graph, crime_buffers, workers, poi_index, max_queue)
+        print("Servicio de rutas listo")
+
+    async def on_cleanup(app):
+        app['service'].executor.shutdown(wait=False, cancel_futures=True)
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_get('/health', health)
+    app.router.add_get('/metrics', metrics)
+    app.router.add_get('/metrics/admission', admission_metrics)
+    app.router.add_post('/route', route)
+    app.router.add_post('/route/batch', route_batch)
+    app.router.add_post('/route/alternatives', route_alternatives)
+    app.router.add_post('/route/poi', route_poi)
+    app.router.add_post('/crimes/along', crimes_along)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servicio HTTP de rutas seguras')
+    parser.add_argument('--graph', default=DEFAULT_GRAPH, help='Archivo GraphML con la red peatonal')
+    parser.add_argument('--crimes', default=DEFAULT_CRIMES, help='GeoJSON con los buffers de crimen')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=4, help='Rutas calculadas en paralelo')
+    parser.add_argument('--pois', help='Índice local de POI (poi_index.py) para /route/poi')
+    parser.add_argument('--max-queue', type=int, default=DEFAULT_MAX_QUEUE,
+                        help='Cálculos en espera antes de responder 503')
+    args = parser.parse_args()
+
+    web.run_app(create_app(args.graph, args.crimes, args.workers, args.pois, args.max_queue),
+                host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,19 +2,23 @@
 import os
 import re
 import json
-from google import genai
-from dotenv import load_dotenv
 from collections import Counter
-from geopy.geocoders import Nominatim
 
 
-load_dotenv()
+# Cliente de Gemini creado en la primera llamada, no al importar el módulo
+_client = None
 
-API_KEY = os.getenv("API_KEY")
 
-print(API_KEY)
+def get_client():
+    """Shared Gemini client, built on first use with the API_KEY from .env"""
+    global _client
+    if _client is None:
+        from google import genai
+        from dotenv import load_dotenv
 
-client = genai.Client(api_key = API_KEY)
+        load_dotenv()
+        _client = genai.Client(api_key=os.getenv("API_KEY"))
+    return _client
 
 # Buscar una ubicació
 
@@ -37,7 +41,7 @@ class SafeRouteChatbot:
         
         prompt += f"Mensage del usuario: {user_message}"
         
-        response = client.models.generate_content(
+        response = get_client().models.generate_content(
             model="gemini-2.0-flash", contents=[prompt]
         )        
         return response.text
@@ -45,6 +49,7 @@ class SafeRouteChatbot:
     
     def generate_response(self, origen, destino, context):
         # Configurar el geocodificador
+        from geopy.geocoders import Nominatim
         geolocator = Nominatim(user_agent="safe_route_chatbot")
 
         # Obtener la dirección
@@ -156,7 +161,7 @@ class SafeRouteChatbot:
     def _generate_explanation(self, prompt):
         """Generate explanation using LLM and clean the response"""
         # Obtener respuesta del modelo
-        response = client.models.generate_content(
+        response = get_client().models.generate_content(
             model="gemini-2.0-flash", contents=[prompt]
         )
         return response
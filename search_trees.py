@@ -0,0 +1,144 @@
+"""
+Árboles de búsqueda reutilizables por origen
+
+En la app el usuario suele dejar fijo el origen y mover el destino. Un
+SearchTree guarda el resultado uno-a-todos (distancias y predecesores) desde
+el punto de origen proyectado sobre su calle, así que cada destino nuevo se
+responde reconstruyendo el camino, sin volver a buscar. SearchTreeCache
+guarda los árboles de una sesión (por origen, hora, perfil y estrategia) y
+descarta los menos usados cuando se supera su presupuesto de memoria.
+"""
+import math
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from graph_arrays import snap_starts, snap_ends, same_edge_path, snapped_search, snapped_pieces
+from instrumentation import count
+
+
+# Presupuesto por sesión: unos 12 bytes por nodo y árbol más la lista de costes (~32 bytes por arista)
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+# Tamaño de un float de Python
+FLOAT_BYTES = sys.getsizeof(0.0)
+
+
+class SearchTree:
+    """
+    One-to-all search from a point snapped onto an edge
+
+    Attributes:
+        source: graph_arrays.EdgeSnap of the origin
+        weights: List with the edge costs the tree was built with (usually
+                 shared with RiskModel.edge_cost_list)
+        dist: float64 array with the cost to every node (inf if unreached)
+        pred: int32 array with the edge used to reach every node (-1 at the
+              seeds and unreached nodes)
+    """
+
+    def __init__(self, arrays, weights, source):
+        self.arrays = arrays
+        self.source = source
+        self.weights = weights.tolist() if isinstance(weights, np.ndarray) else weights
+        self.starts = snap_starts(arrays, self.weights, source)
+        dist, pred, _, _ = snapped_search(arrays, self.weights, self.starts)
+
+        self.dist = np.full(arrays.n_nodes, math.inf)
+        self.dist[list(dist)] = list(dist.values())
+        self.pred = np.full(arrays.n_nodes, -1, dtype=np.int32)
+        self.pred[list(pred)] = list(pred.values())
+
+    @property
+    def nbytes(self):
+        # La lista de costes se cuenta entera (punteros y floats de 24 bytes): aunque al crearse se comparta
+        # con RiskModel.edge_cost_list, el árbol la mantiene viva cuando esa caché ya la ha descartado
+        return self.dist.nbytes + self.pred.nbytes + sys.getsizeof(self.weights) + FLOAT_BYTES * len(self.weights)
+
+    def path_to(self, target):
+        """
+        Cheapest path to a snapped point, by path reconstruction only
+
+        Args:
+            target: graph_arrays.EdgeSnap
+
+        Returns:
+            Tuple (cost, pieces) like graph_arrays.snapped_shortest_path
+
+        Raises:
+            ValueError: If the target cannot be reached
+        """
+        w = self.weights
+        best, pieces = same_edge_path(w, self.source, target)
+        best_end = None
+        ends = snap_ends(self.arrays, w, target)
+        for node, (cost, _) in ends.items():
+            if self.dist[node] + cost < best:
+                best, best_end = float(self.dist[node] + cost), node
+
+        if best == math.inf:
+            raise ValueError("No hay camino entre los puntos de origen y destino")
+        if best_end is None:
+            return best, pieces
+        return best, snapped_pieces(self.arrays, self.pred, self.starts, ends[best_end][1], best_end)
+
+
+class SearchTreeCache:
+    """
+    LRU of SearchTrees bounded by memory
+
+    Attributes:
+        max_bytes: Trees are evicted, least recently used first, while the
+                   total exceeds this; a single larger tree is not stored
+        nbytes: Memory held by the stored trees
+        hits, misses: Lookups answered from the cache / that built a tree
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._trees = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._trees)
+
+    def get(self, key, build):
+        """
+        Tree stored under `key`, or the one returned by build() on a miss
+
+        Args:
+            key: Hashable, e.g. (origin edge, fraction, hour, profile, strategy)
+            build: Callable without arguments returning a SearchTree
+        """
+        with self._lock:
+            tree = self._trees.get(key)
+            if tree is not None:
+                self._trees.move_to_end(key)
+                self.hits += 1
+                count('search_tree_hits')
+                return tree
+
+        tree = build()
+        with self._lock:
+            self.misses += 1
+            count('search_tree_misses')
+            if tree.nbytes > self.max_bytes or key in self._trees:
+                return tree
+            self._trees[key] = tree
+            self.nbytes += tree.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._trees.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        return tree
+
+    def clear(self):
+        with self._lock:
+            self._trees.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        return {'trees': len(self._trees), 'nbytes': self.nbytes, 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,21 @@
+import numpy as np
+
+from benchmark import synthetic_grid_graph, synthetic_crime_buffers
+from graph_arrays import GraphArrays
+from principal_functions import combine_node_edge_weights, fast_edge_weight_calculation, label_nodes_vectorized
+from weight_strategies import compute_edge_costs
+
+
+def test_legacy_weights_match_exp_combine_strategy():
+    graph = synthetic_grid_graph(radius_km=0.5, spacing_m=100)
+    buffers = synthetic_crime_buffers(graph, 300, hotspots=3)
+    graph = combine_node_edge_weights(fast_edge_weight_calculation(label_nodes_vectorized(graph, buffers), buffers))
+
+    arrays = GraphArrays.from_graph(graph)
+    edges = list(graph.edges(keys=True, data=True))
+    edge_risk = np.array([data['buffer_influence'] for *_, data in edges])
+    node_risk = np.array([graph.nodes[node]['node_weight'] for node in arrays.nodes])
+    assert edge_risk.any() and node_risk.any()
+
+    expected = compute_edge_costs('exp_combine', arrays, edge_risk, node_risk, use_numba=False)
+    np.testing.assert_allclose([data['combined_weight'] for *_, data in edges], expected)
@@ -0,0 +1,66 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmark import ZOCALO, synthetic_grid_graph
+from graph_arrays import GraphArrays, shortest_path
+from risk_model import CATEGORY_NAMES, CRIME_PROFILES, RiskModel, categorize_delito
+
+
+@pytest.mark.parametrize('delito, category', [
+    ('ROBO A TRANSEUNTE EN VIA PUBLICA CON VIOLENCIA', 'transeunte_con_violencia'),
+    ('ROBO A TRANSEUNTE DE CELULAR CON VIOLENCIA', 'transeunte_con_violencia'),
+    ('ROBO A TRANSEUNTE EN VÍA PÚBLICA C/V', 'transeunte_con_violencia'),
+    ('ROBO A TRANSEUNTE EN VIA PUBLICA SIN VIOLENCIA', 'transeunte_sin_violencia'),
+    ('ROBO A NEGOCIO CON VIOLENCIA', 'negocio'),
+    ('ROBO A CASA HABITACION CON VIOLENCIA', 'casa'),
+    ('ROBO DE VEHICULO DE SERVICIO PARTICULAR CON VIOLENCIA', 'vehiculo'),
+    ('ROBO DE MOTOCICLETA CON VIOLENCIA', 'vehiculo'),
+    ('ROBO A REPARTIDOR CON VIOLENCIA', 'otros'),
+    ('ROBO A PASAJERO A BORDO DE MICROBUS CON VIOLENCIA', 'transporte_publico'),
+    ('HOMICIDIO DOLOSO', 'violencia_grave'),
+    ('ABUSO SEXUAL', 'sexual'),
+])
+def test_categorize_delito(delito, category):
+    assert CATEGORY_NAMES[categorize_delito(pd.Series([delito]))[0]] == category
+
+
+def test_violent_profiles_exclude_location_robberies():
+    delitos = pd.Series(['ROBO A NEGOCIO CON VIOLENCIA', 'ROBO A CASA HABITACION CON VIOLENCIA',
+                         'ROBO DE VEHICULO DE SERVICIO PARTICULAR CON VIOLENCIA', 'ROBO A REPARTIDOR CON VIOLENCIA'])
+    categories = [CATEGORY_NAMES[i] for i in categorize_delito(delitos)]
+    assert not set(categories) & set(CRIME_PROFILES['peaton_violento'])
+    assert CRIME_PROFILES['sin_vehiculos'].get(categories[2], 0.0) == 0.0
+
+
+@pytest.fixture(scope='module')
+def blocked_street():
+    """Grid graph with six crimes spread over 21-24 h on the middle of the shortest path between two corners"""
+    graph = synthetic_grid_graph(radius_km=0.5, spacing_m=100, drop_fraction=0)
+    arrays = GraphArrays.from_graph(graph)
+    source, target = arrays.nearest_node(*ZOCALO), arrays.nearest_node(ZOCALO[0], ZOCALO[1] + 0.006)
+    path = shortest_path(arrays, arrays.length_list(), source, target)
+    a, b = path[len(path) // 2 - 1], path[len(path) // 2]
+    lon, lat = (arrays.x[a] + arrays.x[b]) / 2, (arrays.y[a] + arrays.y[b]) / 2
+
+    n = 6
+    points = gpd.GeoSeries(gpd.points_from_xy([lon] * n, [lat] * n), crs=4326)
+    buffers = gpd.GeoDataFrame({
+        'weight': np.ones(n), 'hora': np.linspace(21.25, 23.75, n), 'time_zones': ['medianoche'] * n,
+        'delito': ['ROBO A TRANSEUNTE EN VIA PUBLICA CON VIOLENCIA'] * n,
+    }, geometry=points.to_crs(epsg=32614).buffer(50).to_crs(epsg=4326), crs=4326)
+    ends = [(arrays.y[node], arrays.x[node]) for node in (source, target)]
+    return RiskModel.from_graph(graph, buffers), ends
+
+
+def test_safe_route_avoids_crimes_on_shortest_path(blocked_street):
+    model, (origin, destination) = blocked_street
+    safe, fast = model.route(origin, destination, hour=22.5, metrics=True)
+    assert safe.edges != fast.edges
+    assert safe.risk < fast.risk
+
+
+def test_profile_risk_on_the_scale_of_hourly_risk(blocked_street):
+    model, _ = blocked_street
+    np.testing.assert_allclose(model.category_risk.risk_for('general'), model.hourly_risk.risk_at(None), rtol=1e-2)
@@ -0,0 +1,40 @@
+import asyncio
+import random
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from benchmark import synthetic_grid_graph, synthetic_crime_buffers
+from graph_prep import largest_strong_component
+from routing_service import MAX_BATCH, RoutingService, route_batch
+
+
+@pytest.fixture(scope='module')
+def service():
+    graph = largest_strong_component(synthetic_grid_graph(radius_km=1, spacing_m=100, drop_fraction=0.2))
+    service = RoutingService(graph, synthetic_crime_buffers(graph, 200), workers=4, max_queue=32)
+    yield service
+    service.executor.shutdown(wait=True)
+
+
+def test_full_batch_on_idle_service_is_not_shed(service):
+    rng = random.Random(0)
+    nodes = [(data['y'], data['x']) for _, data in service.graph.nodes(data=True)]
+    requests = [{'origin': list(a), 'destination': list(b)}
+                for a, b in (rng.sample(nodes, 2) for _ in range(MAX_BATCH))]
+
+    app = web.Application()
+    app['service'] = service
+    app.router.add_post('/route/batch', route_batch)
+
+    async def send():
+        async with TestClient(TestServer(app)) as client:
+            response = await client.post('/route/batch', json={'requests': requests})
+            assert response.status == 200
+            return (await response.json())['results']
+
+    results = asyncio.run(send())
+    assert len(results) == MAX_BATCH
+    assert not [result['error'] for result in results if 'error' in result]
+    assert service.admission.counters['rejected'] == 0
@@ -1,14 +1,25 @@
+import logging
+import os
 import streamlit as st
 import folium
 import random
+import time
 import geopandas as gpd
 import osmnx as ox
 from math import cos, sin, pi
 from folium.plugins import Draw
 from streamlit_folium import st_folium
 from principal_functions import buscar_ruta, get_intersecting_crimes
+from map_state import (DEFAULT_CENTER, DEFAULT_ZOOM, create_base_map, build_dynamic_layer,
+                       get_route_bounds, bounds_to_view, layer_payload_size)
+from route_jobs import RouteJobQueue, QueueFullError
+from routing_client import RoutingClient
+from risk_model import RiskModel, CRIME_PROFILES
+from search_trees import SearchTreeCache
 from safe import SafeRouteChatbot
 
+logger = logging.getLogger(__name__)
+
 # Configuración inicial de la página
 chat = SafeRouteChatbot()
 st.set_page_config(page_title="Chatbot con Mapa", layout="wide")
@@ -16,14 +27,50 @@ st.set_page_config(page_title="Chatbot con Mapa", layout="wide")
 # Función para carga de datos
 @st.cache_resource
 def load_data():
+    crime = gpd.read_file('crime_buffers.geojson')
+    graph = ox.load_graphml('cache_MexicoCity_walk.graphml')
     return {
-        'crime': gpd.read_file('crime_buffers.geojson'),
-        'graph': ox.load_graphml('cache_MexicoCity_walk.graphml')
+        'crime': crime,
+        'graph': graph,
+        # Riesgo por arista y hora precalculado una vez (risk_model.py)
+        'risk': RiskModel.from_graph(graph, crime),
     }
 
 # Cargar datos una sola vez
 data = load_data()
 
+# Cola de cálculos de rutas compartida por todas las sesiones
+@st.cache_resource
+def get_job_queue():
+    return RouteJobQueue(max_workers=2, max_pending=16)
+
+jobs = get_job_queue()
+
+# Cliente del servicio de rutas (routing_service.py) si ROUTING_API_URL está definida
+@st.cache_resource
+def get_routing_client():
+    api_url = os.getenv("ROUTING_API_URL")
+    return RoutingClient(api_url) if api_url else None
+
+routing_client = get_routing_client()
+
+# Trabajo ejecutado en segundo plano: rutas (con sus métricas) y delitos de la ruta rápida
+def calcular_rutas(origen, destino, periodo, hora=None, perfil=None, arboles=None):
+    if routing_client is not None:
+        segura, rapida = routing_client.route(origen, destino, periodo, hour=hora, crime_profile=perfil,
+                                              metrics=True)
+        msg_lst = routing_client.crimes_along(rapida.coords)
+    else:
+        segura, rapida = buscar_ruta(origen, destino, periodo, data['graph'], data['crime'],
+                                     hour=hora, risk_model=data['risk'], time_dependent=hora is not None,
+                                     crime_profile=perfil, metrics=True, trees=arboles)
+        msg_lst = get_intersecting_crimes(rapida.coords, data['crime'])
+
+    # En la sesión se guardan como polylines codificadas (unos bytes por punto)
+    rutas = (segura.polyline, rapida.polyline)
+    metricas = (segura.to_dict(with_coords=False), rapida.to_dict(with_coords=False))
+    return rutas, msg_lst, metricas
+
 # Estilos CSS personalizados
 st.markdown("""
 <style>
@@ -80,83 +127,43 @@ st.markdown("""
 if 'messages' not in st.session_state:
     st.session_state.messages = []
     
+if 'route_job' not in st.session_state:
+    st.session_state.route_job = None
+
+# Error al encolar el cálculo: se muestra después del st.rerun()
+if 'route_error' not in st.session_state:
+    st.session_state.route_error = None
+
+# Árboles de búsqueda de la sesión: mismo origen y nuevo destino = solo reconstruir el camino
+if 'search_trees' not in st.session_state:
+    st.session_state.search_trees = SearchTreeCache()
+
 if 'map_state' not in st.session_state:
-    # Coordenadas del centro de la Ciudad de México
-    default_center = [19.424918, -99.175004]
     st.session_state.map_state = {
         'points': [],
         'show_crime': False,
-        'center': default_center,
-        'zoom': 12,
-        'routes': None
+        'center': DEFAULT_CENTER,
+        'zoom': DEFAULT_ZOOM,
+        'routes': None,
+        'route_metrics': None
     }
 
-# Función para crear mapa base
-def create_base_map(center, zoom):
-    m = folium.Map(location=center, zoom_start=zoom, control_scale=True)
-    Draw(draw_options={'marker': True, 'polyline': False}, export=False).add_to(m)
-    return m
-
-# Función para calcular bounds para ajustar el zoom a las rutas
-def get_route_bounds(routes):
-    if not routes:
-        return None
-    
-    # Extraer todas las coordenadas de ambas rutas
-    all_points = []
-    for route in routes:
-        all_points.extend(route)
-    
-    # Calcular los límites
-    min_lat = min(point[0] for point in all_points)
-    max_lat = max(point[0] for point in all_points)
-    min_lng = min(point[1] for point in all_points)
-    max_lng = max(point[1] for point in all_points)
-    
-    # Agregar un pequeño margen
-    margin = 0.005  # aproximadamente 500m
-    return [[min_lat - margin, min_lng - margin], [max_lat + margin, max_lng + margin]]
+# Mapa base (tiles, Draw y capa de crimen) cacheado por sus entradas:
+# solo se reconstruye cuando cambia la visibilidad de la capa de crimen
+@st.cache_resource
+def get_base_map(show_crime):
+    return create_base_map(DEFAULT_CENTER, DEFAULT_ZOOM, data['crime'] if show_crime else None)
 
-# Función para actualizar el mapa
+# Función para actualizar el mapa: solo los marcadores y las rutas cambian
 def update_map():
-    # Usar los mismos coordenadas predeterminadas consistentemente
-    default_center = [19.424918, -99.175004]
-    center = st.session_state.map_state.get('center', default_center)
-    zoom = st.session_state.map_state.get('zoom', 12)
-    
-    # Crear mapa base
-    m = create_base_map(center, zoom)
-    
-    # Añadir marcadores
-    for i, point in enumerate(st.session_state.map_state['points']):
-        folium.Marker(
-            location=point,
-            icon=folium.Icon(color='green' if i == 0 else 'red'),
-            tooltip="Origen" if i == 0 else "Destino"
-        ).add_to(m)
-    
-    # Añadir rutas existentes
-    if st.session_state.map_state['routes']:
-        ruta_segura, ruta_rapida = st.session_state.map_state['routes']
-        folium.PolyLine(ruta_segura, color='green', weight=3).add_to(m)
-        folium.PolyLine(ruta_rapida, color='red', weight=3).add_to(m)
-        
-        # Ajustar el zoom para mostrar toda la ruta
-        bounds = get_route_bounds(st.session_state.map_state['routes'])
-        if bounds:
-            m.fit_bounds(bounds)
-    
-    # Añadir capa de crimen si está activa
-    if st.session_state.map_state['show_crime']:
-        folium.GeoJson(
-            data['crime'],
-            name="Zonas de Riesgo",
-            style_function=lambda x: {'fillColor': 'red', 'color': 'red', 'fillOpacity': 0.3},
-            tooltip=folium.GeoJsonTooltip(fields=['periodo_de', 'tipo_delic'])
-        ).add_to(m)
-    
-    folium.LayerControl().add_to(m)
-    return m
+    zoom = st.session_state.map_state.get('zoom', DEFAULT_ZOOM)
+    points = st.session_state.map_state['points']
+    routes = st.session_state.map_state['routes']
+
+    raw, simplified = layer_payload_size(points, routes, zoom)
+    logger.debug("Capa dinámica: %d/%d vértices enviados (zoom %s)", simplified, raw, zoom)
+
+    return build_dynamic_layer(points, routes, zoom)
 
 # Interfaz principal
 col1, col2 = st.columns([0.4, 0.6])
@@ -196,10 +203,14 @@ with col2:
     # Renderizar mapa
     with st.container(height=600):
         map_data = st_folium(
-            update_map(),
+            get_base_map(st.session_state.map_state['show_crime']),
             width=850,
             height=550,
             key="main_map",
+            center=st.session_state.map_state['center'],
+            zoom=st.session_state.map_state['zoom'],
+            feature_group_to_add=update_map(),
+            render=False,
             returned_objects=["last_clicked", "bounds", "zoom"]
         )
         
@@ -229,6 +240,9 @@ with col2:
         cols = st.columns([1,1,2])
         with cols[0]:
             if st.button("🗑️ Reiniciar puntos", use_container_width=True):
+                if st.session_state.route_job is not None:
+                    jobs.cancel(st.session_state.route_job)
+                    st.session_state.route_job = None
                 st.session_state.map_state['points'] = []
                 st.session_state.map_state['routes'] = None
                 st.rerun()
@@ -243,41 +257,85 @@ with col2:
     # Calculo de rutas
     if len(st.session_state.map_state['points']) == 2:
         periodo = st.selectbox("Seleccionar período:", ["Mediodia", "Mañana", "Tarde", "Noche","Medianoche","Madrugada","Todo"])
+        hora = None
+        if st.checkbox("Indicar hora de salida"):
+            hora = st.slider("Hora de salida:", 0.0, 23.5, 20.0, step=0.5)
+        # Perfil por tipo de delito; "general" usa el riesgo por hora
+        perfil = st.selectbox("Delitos a evitar:", list(CRIME_PROFILES))
+        perfil = None if perfil == 'general' else perfil
         
-        if st.button("🚀 Calcular rutas", use_container_width=True):
-            with st.spinner("Calculando mejores rutas..."):
-                try:
-                    origen = st.session_state.map_state['points'][0]
-                    destino = st.session_state.map_state['points'][1]
-                    
-                    rutas = buscar_ruta(
-                        origen, destino, periodo, 
-                        data['graph'], data['crime']
-                    )
-
-                    msg_lst = get_intersecting_crimes(rutas[1], data['crime'])
-                    
-                    str_lst = "\n".join(msg_lst)
-
-                    answer = chat.free("Explica porque se ha elegido una ruta alternativa a la más rapida, que es la que intersecciona con lo comentado", context=str_lst)
-
-                    print(answer)
-
-
-                    st.session_state.messages.append({"role": "assistant", "content": answer})
-                    
-                    st.session_state.map_state['routes'] = rutas
-                    st.rerun()
-                    
-                except Exception as e:
-                    st.error(f"Error: {str(e)}")
+        if st.button("🚀 Calcular rutas", use_container_width=True, disabled=st.session_state.route_job is not None):
+            origen = st.session_state.map_state['points'][0]
+            destino = st.session_state.map_state['points'][1]
+            try:
+                st.session_state.route_job = jobs.submit(calcular_rutas, origen, destino, periodo, hora, perfil,
+                                                       st.session_state.search_trees)
+            except QueueFullError as e:
+                st.session_state.route_error = str(e)
+            st.rerun()
+
+        if st.session_state.route_error:
+            st.error(st.session_state.route_error)
+            st.session_state.route_error = None
+
+    # Seguimiento del cálculo en segundo plano
+    if st.session_state.route_job is not None:
+        job_id = st.session_state.route_job
+        if not jobs.done(job_id):
+            status = jobs.status(job_id)
+            st.info(f"Calculando mejores rutas... ({status['status']}, {status['wait_time'] + status['run_time']:.1f} s)")
+            time.sleep(0.5)
+            st.rerun()
+
+        st.session_state.route_job = None
+        status = jobs.status(job_id)
+        try:
+            if status is None:
+                # La cola ya descartó el trabajo (id desconocido o demasiado antiguo)
+                raise LookupError("El cálculo ya no está disponible, vuelve a calcular las rutas")
+            resultado = jobs.result(job_id)
+            status = jobs.status(job_id)
+            logger.debug("Trabajo %s: espera %.2f s, cálculo %.2f s", job_id, status['wait_time'],
+                         status['run_time'])
+
+            if resultado is not None:
+                rutas, msg_lst, metricas = resultado
+
+                str_lst = "\n".join(msg_lst)
+
+                answer = chat.free("Explica porque se ha elegido una ruta alternativa a la más rapida, que es la que intersecciona con lo comentado", context=str_lst)
+
+                print(answer)
+
+
+                st.session_state.messages.append({"role": "assistant", "content": answer})
+                
+                st.session_state.map_state['routes'] = rutas
+                st.session_state.map_state['route_metrics'] = metricas
+
+                # Centrar la vista en las rutas sin reconstruir el mapa
+                bounds = get_route_bounds(rutas)
+                if bounds:
+                    center, zoom = bounds_to_view(bounds)
+                    st.session_state.map_state['center'] = center
+                    st.session_state.map_state['zoom'] = zoom
+                st.rerun()
+                
+        except Exception as e:
+            st.error(f"Error: {str(e)}")
 
     # Mostrar estadísticas
     if st.session_state.map_state['routes']:
         st.success("Rutas calculadas:")
-        ruta_segura, ruta_rapida = st.session_state.map_state['routes']
+        segura, rapida = st.session_state.map_state['route_metrics']
+        menos_riesgo = 100 * (1 - segura['risk'] / rapida['risk']) if rapida['risk'] > 0 else 0.0
+        minutos_menos = (segura['walk_time'] - rapida['walk_time']) / 60
         cols = st.columns(2)
         with cols[0]:
-            st.metric("Ruta Segura", f"{len(ruta_segura)*0.01:.2f} km", "±25% menos riesgo")
+            st.metric("Ruta Segura", f"{segura['length']/1000:.2f} km · {segura['walk_time']/60:.0f} min",
+                      f"{menos_riesgo:.0f}% menos riesgo")
+            st.caption(f"{segura['crime_count']} delitos registrados junto a la ruta")
         with cols[1]:
-            st.metric("Ruta Rápida", f"{len(ruta_rapida)*0.01:.2f} km", "±35% más rápida")
\ No newline at end of file
+            st.metric("Ruta Rápida", f"{rapida['length']/1000:.2f} km · {rapida['walk_time']/60:.0f} min",
+                      f"{minutos_menos:.0f} min más rápida")
+            st.caption(f"{rapida['crime_count']} delitos registrados junto a la ruta")
\ No newline at end of file
@@ -0,0 +1,126 @@
+"""
+Estrategias de peso de las aristas como kernels vectorizados
+
+Cada estrategia recibe arrays con una posición por arista (longitud, riesgo de
+la arista y riesgo de los dos nodos extremos) y devuelve el coste de todas las
+aristas de una vez. Así cambiar de estrategia o ajustar sus parámetros
+recalcula los costes de toda la ciudad sin recorrer el grafo de networkx.
+
+Si numba está instalado los kernels se compilan con njit la primera vez que se
+usan; si no, se ejecutan como expresiones de NumPy. numba solo se importa al
+compilar el primer kernel, no al importar este módulo.
+"""
+import importlib.util
+
+import numpy as np
+
+
+HAS_NUMBA = importlib.util.find_spec('numba') is not None
+
+
+# Nombre -> kernel(length, edge_risk, node_u_risk, node_v_risk, **params)
+STRATEGIES = {}
+_COMPILED = {}
+
+
+def register_strategy(name):
+    """
+    Decorator that adds a kernel to STRATEGIES
+
+    Kernels must only use NumPy array operations so they also compile with
+    numba.njit.
+    """
+    def decorator(kernel):
+        STRATEGIES[name] = kernel
+        return kernel
+    return decorator
+
+
+@register_strategy('log')
+def log_strategy(length, edge_risk, node_u_risk, node_v_risk):
+    """length * (1 + log(1 + node risk + edge risk)), the default of RiskModel"""
+    node_risk = (node_u_risk + node_v_risk) / 2
+    return length * (1 + np.log1p(node_risk + edge_risk))
+
+
+@register_strategy('exp_combine')
+def exp_combine_strategy(length, edge_risk, node_u_risk, node_v_risk, alpha=0.5):
+    """
+    The weight of the legacy buscar_ruta path
+
+    principal_functions.custom_weight_strategy (length * (1 + log(1 + edge
+    risk))) followed by combine_node_edge_weights, which grows the edge
+    cost by alpha * (exp(mean node risk) - 1).
+    """
+    edge_weight = length * (1 + np.log1p(edge_risk))
+    node_impact = np.expm1(np.maximum((node_u_risk + node_v_risk) / 2, 0))
+    return edge_weight * (1 + alpha * node_impact)
+
+
+@register_strategy('linear')
+def linear_strategy(length, edge_risk, node_u_risk, node_v_risk, beta=1.0):
+    """length * (1 + beta * risk)"""
+    node_risk = (node_u_risk + node_v_risk) / 2
+    return length * (1 + beta * (node_risk + edge_risk))
+
+
+@register_strategy('capped')
+def capped_strategy(length, edge_risk, node_u_risk, node_v_risk, beta=1.0, cap=3.0):
+    """
+    Linear penalty limited to `cap` times the length
+
+    Keeps a single very dangerous block from forcing huge detours.
+    """
+    node_risk = (node_u_risk + node_v_risk) / 2
+    return length * np.minimum(1 + beta * (node_risk + edge_risk), cap)
+
+
+def get_kernel(name, use_numba=None):
+    """
+    Kernel registered under `name`, compiled with numba when available
+
+    Args:
+        name: Key in STRATEGIES
+        use_numba: Force (True) or disable (False) numba; None = if installed
+
+    Raises:
+        ValueError: Unknown strategy, or numba requested but not installed
+    """
+    if name not in STRATEGIES:
+        raise ValueError(f"Estrategia desconocida: {name}. Opciones: {', '.join(STRATEGIES)}")
+    if use_numba is None:
+        use_numba = HAS_NUMBA
+    if not use_numba:
+        return STRATEGIES[name]
+    if not HAS_NUMBA:
+        raise ValueError("numba no está instalado")
+
+    if name not in _COMPILED:
+        import numba
+        _COMPILED[name] = numba.njit(cache=True, fastmath=True)(STRATEGIES[name])
+    return _COMPILED[name]
+
+
+def compute_edge_costs(name, arrays, edge_risk, node_risk=None, use_numba=None, **params):
+    """
+    Cost of every edge of a GraphArrays under a strategy
+
+    Args:
+        name: Key in STRATEGIES
+        arrays: graph_arrays.GraphArrays
+        edge_risk: Array with the crime risk of every edge
+        node_risk: Optional array with the crime risk of every node
+        use_numba: See get_kernel
+        **params: Strategy parameters (alpha, beta, cap...)
+
+    Returns:
+        float64 array with one cost per edge
+    """
+    kernel = get_kernel(name, use_numba)
+    edge_risk = np.asarray(edge_risk, dtype=np.float64)
+    if node_risk is None:
+        node_u_risk = node_v_risk = np.zeros(arrays.n_edges)
+    else:
+        node_risk = np.asarray(node_risk, dtype=np.float64)
+        node_u_risk, node_v_risk = node_risk[arrays.u], node_risk[arrays.v]
+    return kernel(arrays.length, edge_risk, node_u_risk, node_v_risk, **params)